@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""
+Measure how long it takes to start the pymux client, and check that the
+client doesn't import the server.
+
+Every "pymux send-keys ..." or "pymux attach" call starts a new Python
+interpreter, so everything that the entry point imports is paid for by each
+call. This script runs `python -m pymux --help` a number of times, which
+imports exactly what the client imports, and reports the average time. It
+exits with a non-zero status when one of the server-only modules was
+imported.
+"""
+from __future__ import unicode_literals, print_function
+
+import subprocess
+import sys
+import time
+
+# Modules that only the server needs.
+SERVER_MODULES = [
+    'pymux.main',
+    'pymux.commands.commands',
+    'pymux.layout',
+    'pymux.screen',
+    'prompt_toolkit.layout',
+    'prompt_toolkit.interface',
+]
+
+RUNS = 20
+
+# Import the client entry point, like `python -m pymux` does, and print the
+# imported server modules.
+CHECK = '''
+import sys
+import pymux.entry_points.run_pymux
+for name in %r:
+    if name in sys.modules:
+        print(name)
+''' % (SERVER_MODULES, )
+
+
+def main():
+    # Check imports.
+    imported = subprocess.check_output([sys.executable, '-c', CHECK])
+    imported = imported.decode('utf-8').split()
+
+    # Timing.
+    start = time.time()
+    for i in range(RUNS):
+        subprocess.call([sys.executable, '-m', 'pymux', '--help'],
+                        stdout=subprocess.PIPE)
+    elapsed = (time.time() - start) / RUNS
+
+    print('Client startup: %.1fms (average of %i runs)' % (elapsed * 1000, RUNS))
+
+    if imported:
+        print('Server modules imported by the client: %s' % ', '.join(imported))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
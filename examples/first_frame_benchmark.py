@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Measure the time to the first frame of a new session: the time between a
+client attaching to a freshly started server and the first output that it
+receives.
+
+The first client that attaches runs the default configuration and the
+configuration file, and creates the first window. This script starts a
+server a number of times, once without a configuration file, and once with
+a large generated one, attaches with a minimal client, and reports the
+average time until the first frame.
+"""
+from __future__ import unicode_literals, print_function
+
+from pymux.commands.utils import wrap_argument
+from pymux.key_mappings import PYMUX_TO_PROMPT_TOOLKIT_KEYS
+from pymux.protocol import PacketReader, encode_packet
+
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+RUNS = 10
+
+# Number of key bindings in the generated configuration file.
+BINDINGS = 500
+
+# Start a server on the given socket, with the given configuration file.
+SERVER = '''
+import sys
+from pymux.main import Pymux
+p = Pymux(source_file=sys.argv[2] or None)
+p.listen_on_socket(sys.argv[1])
+p.run_server()
+'''
+
+
+def create_config(directory):
+    " Write a configuration file with many key bindings. "
+    filename = os.path.join(directory, 'pymux.conf')
+
+    keys = sorted(PYMUX_TO_PROMPT_TOOLKIT_KEYS)
+
+    with open(filename, 'w') as f:
+        f.write('set-option status-interval 1\n')
+        for i in range(BINDINGS):
+            # With and without prefix, for all the keys.
+            f.write('bind-key %s%s resize-pane -L %i\n' % (
+                ('-n ' if (i // len(keys)) % 2 else ''), wrap_argument(keys[i % len(keys)]), i))
+
+    return filename
+
+
+def measure(directory, config):
+    " Start a server, attach, and return the time until the first frame. "
+    socket_name = os.path.join(directory, 'pymux.sock')
+    server = subprocess.Popen(
+        [sys.executable, '-c', SERVER, socket_name, config or ''],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    try:
+        # Wait for the socket.
+        while not os.path.exists(socket_name):
+            time.sleep(.01)
+
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(socket_name)
+
+        start = time.time()
+        s.sendall(encode_packet({'cmd': 'size', 'data': [40, 120]}))
+        s.sendall(encode_packet({
+            'cmd': 'start-gui',
+            'detach-others': False,
+            'ansi-colors-only': False,
+            'true-color': False,
+            'term': 'xterm',
+        }))
+
+        reader = PacketReader()
+        while True:
+            data = s.recv(65536)
+            if not data:
+                raise Exception('Server closed the connection.')
+
+            reader.feed(data)
+            for packet in reader.read_packets():
+                if packet['cmd'] == 'out':
+                    s.close()
+                    return time.time() - start
+    finally:
+        server.kill()
+        server.wait()
+        if os.path.exists(socket_name):
+            os.remove(socket_name)
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        config = create_config(directory)
+
+        for name, filename in (('default config', None),
+                               ('%i key bindings' % BINDINGS, config)):
+            elapsed = sum(measure(directory, filename) for i in range(RUNS)) / RUNS
+            print('Time to first frame (%s): %.1fms (average of %i runs)' % (
+                name, elapsed * 1000, RUNS))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -27,6 +27,7 @@ __all__ = (
     'HSplit',
     'VSplit',
     'Window',
+    'Session',
     'Arrangement',
 )
 
@@ -572,23 +573,57 @@ class Window(object):
         return self.panes.index(pane)
 
 
+class Session(object):
+    """
+    Pymux session: a named list of windows. Every client is attached to one
+    session, but one server can host many sessions.
+    """
+    def __init__(self, name):
+        assert isinstance(name, six.text_type)
+
+        self.name = name
+        self.windows = []
+
+        # The active window of the last CLI that was attached to this
+        # session. Used as default when a new client is attached.
+        self.last_active_window = None
+
+    def __repr__(self):
+        return 'Session(%r)' % (self.name, )
+
+    @property
+    def has_panes(self):
+        " True when any of the windows has a :class:`.Pane`. "
+        for w in self.windows:
+            if w.has_panes:
+                return True
+        return False
+
+
 class Arrangement(object):
     """
-    Arrangement class for one Pymux session.
-    This contains the list of windows and the layout of the panes for each
-    window. All the clients share the same Arrangement instance, but they can
-    have different windows active.
+    Arrangement class for one Pymux server.
+    This contains the sessions, with for each session the list of windows and
+    the layout of the panes for each window. All the clients share the same
+    Arrangement instance, but they can have different sessions and windows
+    active.
     """
     def __init__(self):
-        self.windows = []
+        self.sessions = []
         self.base_index = 0
 
+        self._session_for_cli = weakref.WeakKeyDictionary()
         self._active_window_for_cli = weakref.WeakKeyDictionary()
         self._prev_active_window_for_cli = weakref.WeakKeyDictionary()
 
-        # The active window of the last CLI. Used as default when a new session
-        # is attached.
-        self._last_active_window = None
+        # The session of the last CLI. Used as default when a new client is
+        # attached.
+        self._last_active_session = None
+
+    @property
+    def windows(self):
+        " All the windows of all the sessions. "
+        return [w for s in self.sessions for w in s.windows]
 
     def pane_has_priority(self, pane):
         """
@@ -610,6 +645,53 @@ class Arrangement(object):
         w = self.get_active_window(cli)
         return w.invalidation_hash()
 
+    def create_session(self, name):
+        """
+        Create a new :class:`.Session`, without windows. (A window has to be
+        added right away.)
+        """
+        assert self.get_session_by_name(name) is None
+
+        session = Session(name)
+        self.sessions.append(session)
+        return session
+
+    def get_session_by_name(self, name):
+        " Return the Session with this name or None if not found. "
+        for s in self.sessions:
+            if s.name == name:
+                return s
+
+    def get_active_session(self, cli):
+        """
+        The :class:`.Session` to which this client is attached.
+        """
+        assert isinstance(cli, CommandLineInterface)
+
+        try:
+            return self._session_for_cli[cli]
+        except KeyError:
+            session = self._last_active_session or self.sessions[0]
+            self._session_for_cli[cli] = session
+            return session
+
+    def set_active_session(self, cli, session):
+        " Attach this client to another session. "
+        assert isinstance(cli, CommandLineInterface)
+        assert isinstance(session, Session)
+
+        if self._session_for_cli.get(cli) != session:
+            self._session_for_cli[cli] = session
+            self._active_window_for_cli.pop(cli, None)
+            self._prev_active_window_for_cli.pop(cli, None)
+
+        self._last_active_session = session
+
+    def _get_session_for_window(self, window):
+        for s in self.sessions:
+            if window in s.windows:
+                return s
+
     def get_active_window(self, cli):
         """
         The current active :class:`.Window`.
@@ -619,17 +701,26 @@ class Arrangement(object):
         try:
             return self._active_window_for_cli[cli]
         except KeyError:
-            self._active_window_for_cli[cli] = self._last_active_window or self.windows[0]
-            return self.windows[0]
+            session = self.get_active_session(cli)
+            w = session.last_active_window or session.windows[0]
+            self._active_window_for_cli[cli] = w
+            return w
 
     def set_active_window(self, cli, window):
+        """
+        Make this the active window. (When the window belongs to another
+        session, the client is attached to that session.)
+        """
         assert isinstance(cli, CommandLineInterface)
         assert isinstance(window, Window)
 
+        session = self._get_session_for_window(window)
+        self.set_active_session(cli, session)
+
         previous = self.get_active_window(cli)
         self._prev_active_window_for_cli[cli] = previous
         self._active_window_for_cli[cli] = window
-        self._last_active_window = window
+        session.last_active_window = window
 
     def set_active_window_from_pane_id(self, cli, pane_id):
         """
@@ -652,13 +743,16 @@ class Arrangement(object):
         except KeyError:
             return None
 
-    def get_window_by_index(self, index):
-        " Return the Window with this index or None if not found. "
-        for w in self.windows:
+    def get_window_by_index(self, cli, index):
+        """
+        Return the Window with this index in the session of this client or
+        None if not found.
+        """
+        for w in self.get_active_session(cli).windows:
             if w.index == index:
                 return w
 
-    def create_window(self, cli, pane, name=None, set_active=True):
+    def create_window(self, cli, pane, name=None, set_active=True, session=None):
         """
         Create a new window that contains just this pane.
 
@@ -666,13 +760,22 @@ class Arrangement(object):
         :param pane: The :class:`.Pane` instance to put in the new window.
         :param name: If given, name for the new window.
         :param set_active: When True, focus the new window.
+        :param session: The :class:`.Session` for the window. By default, the
+            session of the client.
         """
         assert isinstance(pane, Pane)
         assert cli is None or isinstance(cli, CommandLineInterface)
         assert name is None or isinstance(name, six.text_type)
+        assert session is None or isinstance(session, Session)
+
+        if session is None:
+            if cli is not None:
+                session = self.get_active_session(cli)
+            else:
+                session = self._last_active_session or self.sessions[0]
 
         # Take the first available index.
-        taken_indexes = [w.index for w in self.windows]
+        taken_indexes = [w.index for w in session.windows]
 
         index = self.base_index
         while index in taken_indexes:
@@ -681,10 +784,10 @@ class Arrangement(object):
         # Create new window and add it.
         w = Window(index)
         w.add_pane(pane)
-        self.windows.append(w)
+        session.windows.append(w)
 
         # Sort windows by index.
-        self.windows = sorted(self.windows, key=lambda w: w.index)
+        session.windows = sorted(session.windows, key=lambda w: w.index)
 
         if cli is not None and set_active:
             self.set_active_window(cli, w)
@@ -705,7 +808,8 @@ class Arrangement(object):
         window.index = new_index
 
         # Sort windows by index.
-        self.windows = sorted(self.windows, key=lambda w: w.index)
+        session = self._get_session_for_window(window)
+        session.windows = sorted(session.windows, key=lambda w: w.index)
 
     def get_active_pane(self, cli):
         """
@@ -723,33 +827,57 @@ class Arrangement(object):
         """
         assert isinstance(pane, Pane)
 
-        for w in self.windows:
-            w.remove_pane(pane)
+        for session in self.sessions:
+            for w in session.windows[:]:
+                w.remove_pane(pane)
+
+                # No panes left in this window?
+                if not w.has_panes:
+                    # Focus next.
+                    for cli, active_w in list(self._active_window_for_cli.items()):
+                        if w == active_w:
+                            self.focus_next_window(cli)
 
-            # No panes left in this window?
-            if not w.has_panes:
-                # Focus next.
-                for cli, active_w in self._active_window_for_cli.items():
-                    if w == active_w:
-                        self.focus_next_window(cli)
+                    session.windows.remove(w)
 
-                self.windows.remove(w)
+                    if session.last_active_window == w:
+                        session.last_active_window = None
+
+        # Remove sessions without windows. The clients that were attached to
+        # them, go to another session.
+        for session in self.sessions[:]:
+            if not session.windows:
+                self._remove_session(session)
+
+    def _remove_session(self, session):
+        self.sessions.remove(session)
+
+        if self._last_active_session == session:
+            self._last_active_session = None
+
+        for cli, s in list(self._session_for_cli.items()):
+            if s == session:
+                del self._session_for_cli[cli]
+                self._active_window_for_cli.pop(cli, None)
+                self._prev_active_window_for_cli.pop(cli, None)
 
     def focus_previous_window(self, cli):
         assert isinstance(cli, CommandLineInterface)
 
         w = self.get_active_window(cli)
+        windows = self.get_active_session(cli).windows
 
-        self.set_active_window(cli, self.windows[
-            (self.windows.index(w) - 1) % len(self.windows)])
+        self.set_active_window(cli, windows[
+            (windows.index(w) - 1) % len(windows)])
 
     def focus_next_window(self, cli):
         assert isinstance(cli, CommandLineInterface)
 
         w = self.get_active_window(cli)
+        windows = self.get_active_session(cli).windows
 
-        self.set_active_window(cli, self.windows[
-            (self.windows.index(w) + 1) % len(self.windows)])
+        self.set_active_window(cli, windows[
+            (windows.index(w) + 1) % len(windows)])
 
     def break_pane(self, cli, set_active=True):
         """
@@ -777,7 +905,7 @@ class Arrangement(object):
     @property
     def has_panes(self):
         " True when any of the windows has a :class:`.Pane`. "
-        for w in self.windows:
-            if w.has_panes:
+        for s in self.sessions:
+            if s.has_panes:
                 return True
         return False
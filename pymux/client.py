@@ -1,39 +1,70 @@
 from __future__ import unicode_literals
 
-from prompt_toolkit.eventloop.base import INPUT_TIMEOUT
-from prompt_toolkit.eventloop.posix import call_on_sigwinch
-from prompt_toolkit.eventloop.select import select_fds
-from prompt_toolkit.eventloop.posix_utils import PosixStdinReader
-from prompt_toolkit.terminal.vt100_input import raw_mode, cooked_mode
-from prompt_toolkit.terminal.vt100_output import _get_size, Vt100_Output
-
+from pymux.compression import Decompressor
+from pymux.local_echo import LocalEcho
+from pymux.protocol import PROTOCOL_VERSION, PacketReader, encode_packet
+from pymux.registry import ServerRegistry
 from pymux.utils import nonblocking
 
-import getpass
-import glob
+# Note: The prompt_toolkit modules are imported in the methods that need them.
+#       Scripts that call "pymux send-keys ..." in a loop only need a socket,
+#       and shouldn't pay for importing them.
+
+import errno
 import json
 import os
+import select
 import signal
 import socket
 import sys
-import tempfile
+import time
 
 
 __all__ = (
     'Client',
     'list_clients',
+    'list_servers',
 )
 
+# Amount of data that we read from the socket at once.
+RECV_SIZE = 64 * 1024
+
+# Stop reading from the server while we have this much output that we
+# couldn't write to the terminal yet.
+OUTPUT_BUFFER_LIMIT = 1024 * 1024
+
 
 class Client(object):
     def __init__(self, socket_name):
         self.socket_name = socket_name
         self._mode_context_managers = []
 
+        # Set when the server asks us to reconnect. (See `upgrade-server`.)
+        self._reconnect_requested = False
+
         # Connect to socket.
-        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        self.socket.connect(socket_name)
-        self.socket.setblocking(1)
+        self._connect()
+
+        # Input reader. (Created when attaching.)
+        self._stdin_reader = None
+
+        # Output received from the server, not yet written to stdout.
+        self._output_buffer = bytearray()
+
+        # Predictive local echo. (Only when enabled.)
+        self._local_echo = None
+
+        # Composes the output from frames. (Only when the client renders.)
+        self._composer = None
+        self._terminal_size = None
+        self._flushing = False
+
+        # Splits the received data into packets.
+        self._reader = PacketReader()
+        self._protocol_version = 1  # Wire format of the packets that we send.
+
+    def _create_stdin_reader(self):
+        from prompt_toolkit.eventloop.posix_utils import PosixStdinReader
 
         # Input reader.
         #     Some terminals, like lxterminal send non UTF-8 input sequences,
@@ -45,11 +76,40 @@ class Client(object):
         #     decoding otherwise. (Also don't pass errors='ignore', because
         #     that doesn't work for parsing mouse input escape sequences, which
         #     consist of a fixed number of bytes.)
-        self._stdin_reader = PosixStdinReader(sys.stdin.fileno(), errors='replace')
+        return PosixStdinReader(sys.stdin.fileno(), errors='replace')
+
+    def _connect(self):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(self.socket_name)
+        self.socket.setblocking(1)
+
+    def _reconnect(self):
+        """
+        Connect again to the same socket, after the server has been replaced.
+        Returns False when that didn't succeed within a few seconds.
+        """
+        self._reconnect_requested = False
+        self._reader = PacketReader()
+        self._protocol_version = 1
+        self.socket.close()
+
+        if self._composer:
+            self._composer.forget()
+
+        for i in range(50):
+            try:
+                self._connect()
+                return True
+            except socket.error:
+                time.sleep(.1)
+
+        return False
 
     def run_command(self, command, pane_id=None):
         """
-        Ask the server to run this command.
+        Ask the server to run this command. (Without waiting for the result.
+        Pymux itself uses `run_commands`; this is kept for scripts that use
+        the `Client` class.)
 
         :param pane_id: Optional identifier of the current pane.
         """
@@ -59,42 +119,133 @@ class Client(object):
             'pane_id': pane_id
         })
 
-    def attach(self, detach_other_clients=False, ansi_colors_only=False, true_color=False):
+    def run_commands(self, commands, pane_id=None):
+        """
+        Ask the server to run all these commands at once. Returns a list
+        with the result of each command (See `Pymux.run_commands`.), or
+        `None` when the connection was closed.
+
+        :param pane_id: Optional identifier of the current pane.
+        """
+        self._send_packet({
+            'cmd': 'run-commands',
+            'commands': commands,
+            'pane_id': pane_id,
+        })
+
+        while True:
+            data = self.socket.recv(RECV_SIZE)
+
+            if data == b'':
+                return None
+
+            self._reader.feed(data)
+
+            for packet in self._reader.read_packets():
+                if packet['cmd'] == 'command-results':
+                    return packet['results']
+
+    def attach(self, detach_other_clients=False, ansi_colors_only=False, true_color=False,
+               session=None, new_session=None, predict_echo=False, compress=False,
+               client_render=False):
         """
         Attach client user interface.
+
+        :param session: Name of the session to attach to.
+        :param new_session: Dictionary with the 'name' and 'command' for a new
+            session that is created for this client.
+        :param predict_echo: Display typed characters before the server
+            echoes them. (For slow connections.)
+        :param compress: Ask the server to compress the output. (For slow
+            connections.)
+        :param client_render: Let the server send what is displayed, and
+            compose the terminal output in this process. (See
+            `pymux.client_render`.)
         """
         assert isinstance(detach_other_clients, bool)
         assert isinstance(ansi_colors_only, bool)
         assert isinstance(true_color, bool)
+        assert new_session is None or isinstance(new_session, dict)
+        assert isinstance(predict_echo, bool)
+        assert isinstance(compress, bool)
+        assert isinstance(client_render, bool)
+
+        from prompt_toolkit.eventloop.base import INPUT_TIMEOUT
+        from prompt_toolkit.eventloop.posix import call_on_sigwinch
+        from prompt_toolkit.terminal.vt100_input import raw_mode
+        from prompt_toolkit.terminal.vt100_output import Vt100_Output
+
+        self._stdin_reader = self._create_stdin_reader()
+
+        if client_render:
+            from pymux.composer import Composer
+            self._composer = Composer(true_color=true_color,
+                                      ansi_colors_only=ansi_colors_only,
+                                      term=os.environ.get('TERM'))
+
+        def start_gui(detach_other_clients, session=None, new_session=None):
+            self._send_size()
+            self._send_packet({
+                'cmd': 'start-gui',
+                'detach-others': detach_other_clients,
+                'ansi-colors-only': ansi_colors_only,
+                'true-color': true_color,
+                'term': os.environ.get('TERM', ''),
+                'session': session,
+                'new-session': new_session,
+                'predict-echo': predict_echo,
+                'compress': compress,
+                'client-render': client_render,
+                'data': ''
+            })
 
-        self._send_size()
-        self._send_packet({
-            'cmd': 'start-gui',
-            'detach-others': detach_other_clients,
-            'ansi-colors-only': ansi_colors_only,
-            'true-color': true_color,
-            'term': os.environ.get('TERM', ''),
-            'data': ''
-        })
+            # Start without predictions. (Also after reconnecting, the new
+            # server repaints everything.)
+            if predict_echo:
+                self._local_echo = LocalEcho()
 
-        with raw_mode(sys.stdin.fileno()):
-            data_buffer = b''
+        start_gui(detach_other_clients, session, new_session)
 
+        with raw_mode(sys.stdin.fileno()):
             stdin_fd = sys.stdin.fileno()
+            stdout_fd = sys.stdout.fileno()
             socket_fd = self.socket.fileno()
             current_timeout = INPUT_TIMEOUT  # Timeout, used to flush escape sequences.
 
             with call_on_sigwinch(self._send_size):
                 while True:
-                    r = select_fds([stdin_fd, socket_fd], current_timeout)
+                    read_fds = [stdin_fd]
+                    write_fds = []
+
+                    # Stop reading from the server when the terminal can't
+                    # keep up. (The server will notice that it can't send.)
+                    if len(self._output_buffer) < OUTPUT_BUFFER_LIMIT:
+                        read_fds.append(socket_fd)
+
+                    if self._output_buffer:
+                        write_fds.append(stdout_fd)
+
+                    r, w = _select(read_fds, write_fds, current_timeout)
+
+                    if stdout_fd in w:
+                        self._flush_output()
 
                     if socket_fd in r:
-                        # Received packet from server.
-                        data = self.socket.recv(1024)
+                        # Received packets from server.
+                        data = self.socket.recv(RECV_SIZE)
+
+                        if data == b'' and self._reconnect_requested:
+                            # The server is being replaced. Attach to the
+                            # new one.
+                            if self._reconnect():
+                                socket_fd = self.socket.fileno()
+                                start_gui(False)
+                                continue
 
                         if data == b'':
                             # End of file. Connection closed.
-                            # Reset terminal
+                            # Write what we have, then reset terminal.
+                            self._flush_output(block=True)
                             o = Vt100_Output.from_pty(sys.stdout)
                             o.quit_alternate_screen()
                             o.disable_mouse_support()
@@ -103,42 +254,150 @@ class Client(object):
                             o.flush()
                             return
                         else:
-                            data_buffer += data
+                            self._receive(data)
 
-                            while b'\0' in data_buffer:
-                                pos = data_buffer.index(b'\0')
-                                self._process(data_buffer[:pos])
-                                data_buffer = data_buffer[pos + 1:]
+                            # Write the output of all these packets at once.
+                            self._flush_output()
 
                     elif stdin_fd in r:
                         # Got user input.
                         self._process_stdin()
                         current_timeout = INPUT_TIMEOUT
 
-                    else:
+                    elif not w:
                         # Timeout. (Tell the server to flush the vt100 Escape.)
                         self._send_packet({'cmd': 'flush-input'})
                         current_timeout = None
 
-    def _process(self, data_buffer):
+    def control(self, session=None):
         """
-        Handle incoming packet from server.
+        Run in control mode. (See `pymux.control`.)
+
+        Every line on stdin is executed as a command. The events that we
+        receive are written to stdout, as one JSON object per line. The
+        replies to the commands have the line number as 'id'.
+
+        :param session: Name of the session for the commands.
         """
-        packet = json.loads(data_buffer.decode('utf-8'))
+        self._send_packet({'cmd': 'control', 'session': session})
 
+        stdin_fd = sys.stdin.fileno()
+        socket_fd = self.socket.fileno()
+        read_fds = [stdin_fd, socket_fd]
+        line_number = 0
+        stdin_buffer = b''
+
+        while True:
+            r, _ = _select(read_fds, [], None)
+
+            if socket_fd in r:
+                data = self.socket.recv(RECV_SIZE)
+
+                if data == b'':
+                    return
+
+                self._reader.feed(data)
+
+                for packet in self._reader.read_packets():
+                    if packet['cmd'] == 'control':
+                        for event in packet['events']:
+                            self._write_output(json.dumps(event) + '\n')
+
+                    elif packet['cmd'] == 'protocol':
+                        self._process(packet)
+
+                self._flush_output(block=True)
+
+            if stdin_fd in r:
+                data = os.read(stdin_fd, RECV_SIZE)
+
+                if data == b'':
+                    # End of input. Keep receiving events until the server
+                    # closes the connection.
+                    read_fds = [socket_fd]
+
+                stdin_buffer += data
+                lines = stdin_buffer.split(b'\n')
+                stdin_buffer = lines.pop()
+
+                # The last command does not need a trailing newline.
+                if data == b'' and stdin_buffer:
+                    lines.append(stdin_buffer)
+                    stdin_buffer = b''
+
+                for line in lines:
+                    line_number += 1
+                    self._send_packet({
+                        'cmd': 'control-command',
+                        'id': line_number,
+                        'data': line.decode('utf-8', 'replace'),
+                    })
+
+    def _receive(self, data):
+        """
+        Split the data that we received into packets, and process them.
+        """
+        self._reader.feed(data)
+
+        for packet in self._reader.read_packets():
+            self._process(packet)
+
+    def _process(self, packet):
+        """
+        Handle incoming packet from server.
+        """
         if packet['cmd'] == 'out':
-            # Call os.write manually. In Python2.6, sys.stdout.write doesn't use UTF-8.
-            os.write(sys.stdout.fileno(), packet['data'].encode('utf-8'))
+            # Written after processing all the packets that we received.
+            # (Erase the predicted characters first.)
+            if self._local_echo:
+                self._write_output(self._local_echo.undo())
+            if self._composer:
+                self._composer.forget()
+            self._write_output(packet['data'])
+
+        elif packet['cmd'] == 'frame':
+            # What is displayed. (When we render ourself.)
+            self._composer.feed(packet)
+            self._write_output(self._composer.render(*self._terminal_size))
+
+        elif packet['cmd'] == 'echo-state':
+            # Where the cursor of the active pane is. (After 'out'.)
+            if self._local_echo:
+                self._write_output(self._local_echo.update(packet))
+
+        elif packet['cmd'] == 'compress':
+            # The server is going to compress everything that follows.
+            self._reader.enable_decompression(Decompressor())
+
+        elif packet['cmd'] == 'protocol':
+            # Switch to the binary protocol. (See `pymux.protocol`.)
+            if PROTOCOL_VERSION in packet.get('versions', []):
+                self._send_packet({'cmd': 'protocol', 'version': PROTOCOL_VERSION})
+                self._protocol_version = PROTOCOL_VERSION
+
+            elif packet.get('version') == PROTOCOL_VERSION:
+                self._reader.version = PROTOCOL_VERSION
+
+        elif packet['cmd'] == 'reconnect':
+            # The server is going to be replaced. Reconnect when the
+            # connection has been closed.
+            self._reconnect_requested = True
 
         elif packet['cmd'] == 'suspend':
             # Suspend client process to background.
+            self._flush_output(block=True)
+
             if hasattr(signal, 'SIGTSTP'):
                 os.kill(os.getpid(), signal.SIGTSTP)
 
         elif packet['cmd'] == 'mode':
             # Set terminal to raw/cooked.
+            from prompt_toolkit.terminal.vt100_input import raw_mode, cooked_mode
             action = packet['data']
 
+            # The output that came before was meant for the previous mode.
+            self._flush_output(block=True)
+
             if action == 'raw':
                 cm = raw_mode(sys.stdin.fileno())
                 cm.__enter__()
@@ -153,6 +412,53 @@ class Client(object):
                 cm = self._mode_context_managers.pop()
                 cm.__exit__()
 
+    def _write_output(self, data):
+        """
+        Add text (or UTF-8 encoded bytes) to the output buffer. (See
+        `_flush_output`.)
+        """
+        if data:
+            if not isinstance(data, bytes):
+                data = data.encode('utf-8')
+            self._output_buffer += data
+
+    def _flush_output(self, block=False):
+        """
+        Write the buffered output to stdout. Without `block`, we write only
+        what the terminal accepts right now; the rest is written when stdout
+        becomes writable again.
+        """
+        fd = sys.stdout.fileno()
+
+        # (Also called from the SIGWINCH handler. See `_send_size`.)
+        if self._flushing:
+            return
+        self._flushing = True
+        try:
+            self._flush_output_buffer(fd, block)
+        finally:
+            self._flushing = False
+
+    def _flush_output_buffer(self, fd, block):
+        while self._output_buffer:
+            if block:
+                _select([], [fd], None)
+
+            # Call os.write manually. In Python2.6, sys.stdout.write doesn't use UTF-8.
+            try:
+                with nonblocking(fd):
+                    written = os.write(fd, self._output_buffer)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    written = 0
+                else:
+                    raise
+
+            del self._output_buffer[:written]
+
+            if not written and not block:
+                return
+
     def _process_stdin(self):
         """
         Received data on stdin. Read and send to server.
@@ -160,6 +466,11 @@ class Client(object):
         with nonblocking(sys.stdin.fileno()):
             data = self._stdin_reader.read()
 
+        # Display the characters that we expect the server to echo.
+        if self._local_echo:
+            self._write_output(self._local_echo.predict(data))
+            self._flush_output()
+
         # Send input in chunks of 4k.
         step = 4056
         for i in range(0, len(data), step):
@@ -170,30 +481,60 @@ class Client(object):
 
     def _send_packet(self, data):
         " Send to server. "
-        data = json.dumps(data).encode('utf-8')
+        data = encode_packet(data, self._protocol_version)
 
         # Be sure that our socket is blocking, otherwise, the send() call could
         # raise `BlockingIOError` if the buffer is full.
         self.socket.setblocking(1)
 
-        self.socket.send(data + b'\0')
+        self.socket.sendall(data)
 
     def _send_size(self):
         " Report terminal size to server. "
+        from prompt_toolkit.terminal.vt100_output import _get_size
         rows, cols = _get_size(sys.stdout.fileno())
+        self._terminal_size = (rows, cols)
         self._send_packet({
             'cmd': 'size',
             'data': [rows, cols]
         })
 
+        # When we render ourself, redraw right away for the new size. (The
+        # server sends the content for this size after that.)
+        if self._composer:
+            self._write_output(self._composer.render(rows, cols))
+            self._flush_output()
+
+
+def _select(read_fds, write_fds, timeout):
+    """
+    Wait until one of the file descriptors is ready. Returns the (readable,
+    writable) lists, which are both empty after a timeout.
+    """
+    while True:
+        try:
+            r, w, _ = select.select(read_fds, write_fds, [], timeout)
+            return r, w
+        except (select.error, OSError) as e:
+            # Retry when interrupted by a signal. (Like SIGWINCH.)
+            if not (e.args and e.args[0] == errno.EINTR):
+                raise
+
+
+def list_servers():
+    """
+    Return the :class:`.ServerInfo` of all the servers that are running,
+    according to the registry. (This doesn't connect to the servers.)
+    """
+    return ServerRegistry().list_servers()
+
 
 def list_clients():
     """
-    List all the servers that are running.
+    Connect to all the servers that are running.
     """
-    p = '%s/pymux.sock.%s.*' % (tempfile.gettempdir(), getpass.getuser())
-    for path in glob.glob(p):
+    for info in list_servers():
         try:
-            yield Client(path)
+            yield Client(info.socket_name)
         except socket.error:
             pass
@@ -0,0 +1,417 @@
+"""
+Client-side rendering.
+
+Normally, the server renders the complete user interface for every client,
+and sends the terminal output. A client that attaches with `--client-render`
+receives 'frame' packets instead, which describe what has to be displayed.
+The client composes the terminal output itself. (See `pymux.composer`.) This
+moves most of the rendering work out of the server process, and the client
+can redraw right away when its terminal is resized.
+
+A frame contains the items that changed since the previous frame:
+
+    {'cmd': 'frame',
+     'styles': [[style_id, [color, bgcolor, bold, underline, italic, blink, reverse]], ...],
+     'body': [columns, rows],               # Size of the window.
+     'panes': [[pane_id, x, y, width, height], ...],
+     'lines': [[x, y, length, vertical], ...],  # Borders between the panes.
+     'active': pane_id,                     # Pane with the highlighted border.
+     'rows': [[pane_id, y, runs], ...],     # Rows of the panes that changed.
+     'cursor': [x, y] or None,              # Relative to the window.
+     'status': [left, middle, right, justify, left_length, right_length] or None,
+     'title': title,
+     'ui': {'background': style_id, 'line': ..., 'line-focussed': ..., 'status': ...}}
+
+'body', 'panes', 'lines' and 'active' are always sent together. 'ui' contains
+the styles of the parts that the client draws itself, and is only sent in the
+first frame. 'runs' (and the parts of the status bar) are lists of
+[style_id, text] items. When a run contains cells that are not exactly one
+character (double width or combined characters), the text is a list with the
+text of each cell instead.
+
+Everything that is specific for one client (messages, the command line,
+copy mode, ...) is still rendered by the server. For as long as that is
+displayed, the server sends terminal output, like for the other clients.
+"""
+from __future__ import unicode_literals
+
+from prompt_toolkit.token import Token
+from prompt_toolkit.utils import take_using_weights
+
+from .arrangement import HSplit, Pane, VSplit
+from .screen import DEFAULT_TOKEN
+
+__all__ = (
+    'ClientRenderer',
+    'RowCache',
+    'get_pane_positions',
+)
+
+
+class RowCache(object):
+    """
+    The encoded rows of the panes, shared by all the clients that render
+    themselves. (Cleared when the UI is invalidated.)
+
+    :param style: The pymux `Style`.
+    """
+    def __init__(self, style):
+        self.style = style
+        self.styles = {}  # Maps style ID to the attributes (a list).
+
+        self._ids_for_attrs = {}
+        self._ids_for_tokens = {}
+        self._rows = {}  # Maps `Pane` to (width, height, rows).
+
+    def clear(self):
+        if self._rows:
+            self._rows = {}
+
+    def get_style_id(self, token):
+        " Return the style ID for this token. "
+        try:
+            return self._ids_for_tokens[token]
+        except KeyError:
+            attrs = list(self.style.get_attrs_for_token(token))
+            key = tuple(attrs)
+
+            if key not in self._ids_for_attrs:
+                style_id = len(self._ids_for_attrs)
+                self._ids_for_attrs[key] = style_id
+                self.styles[style_id] = attrs
+
+            result = self._ids_for_tokens[token] = self._ids_for_attrs[key]
+            return result
+
+    def get_rows(self, pane, width, height):
+        """
+        Return the encoded rows that are visible in this pane.
+        """
+        cached = self._rows.get(pane)
+        if cached is not None and cached[:2] == (width, height):
+            return cached[2]
+
+        screen = pane.process.screen
+        data_buffer = screen.pt_screen.data_buffer
+        line_offset = screen.line_offset
+        reverse_video = screen.has_reverse_video
+
+        rows = [self._encode_row(data_buffer[y + line_offset], width, reverse_video)
+                for y in range(height)]
+
+        self._rows[pane] = (width, height, rows)
+        return rows
+
+    def _encode_row(self, row, width, reverse_video):
+        runs = []
+        cells = []
+        token = None
+
+        def add_run():
+            if cells:
+                if reverse_video:
+                    style_id = self.get_style_id(_reverse(token))
+                else:
+                    style_id = self.get_style_id(token)
+
+                if all(len(c) == 1 for c in cells):
+                    runs.append([style_id, ''.join(cells)])
+                else:
+                    runs.append([style_id, cells[:]])
+
+        for x in range(width):
+            char = row[x]
+
+            if char.token != token:
+                add_run()
+                token = char.token
+                cells = []
+
+            cells.append(char.char)
+
+        # Trailing spaces are filled in by the client.
+        if token == DEFAULT_TOKEN and not reverse_video:
+            while cells and cells[-1] == ' ':
+                cells.pop()
+        add_run()
+
+        return runs
+
+
+def _reverse(token):
+    " Invert the reverse flag of a ('C', ...) token. "
+    if token and token[0] == 'C':
+        return token[:-1] + (not token[-1], )
+    return token
+
+
+def get_pane_positions(pymux, cli, size):
+    """
+    Return the positions of the panes in the active window of this client,
+    like the layout would render them, or `None` when they don't fit.
+
+    Returns a list of (pane, x, y, width, height) tuples and a list of
+    (x, y, length, vertical) tuples for the borders between them.
+
+    (Like the layout, this stores the sizes as weights in the splits.)
+    """
+    window = pymux.arrangement.get_active_window(cli)
+
+    if window.zoom:
+        return [(window.active_pane, 0, 0, size.columns, size.rows)], []
+
+    panes = []
+    lines = []
+
+    def divide(split, x, y, width, height):
+        vertical = isinstance(split, VSplit)
+        available = width if vertical else height
+
+        sizes = _divide(split, available)
+        if sizes is None:
+            return False
+
+        # Store the actual sizes as weights. (See `_create_split`.)
+        for item, item_size in zip(split, sizes[::2]):
+            split.weights[item] = item_size
+
+        for i, item_size in enumerate(sizes):
+            if i % 2 == 0:
+                item = split[i // 2]
+
+                if vertical:
+                    item_pos = (x, y, item_size, height)
+                else:
+                    item_pos = (x, y, width, item_size)
+
+                if isinstance(item, Pane):
+                    panes.append((item, ) + item_pos)
+                elif not divide(item, *item_pos):
+                    return False
+            else:
+                if vertical:
+                    lines.append((x, y, height, True))
+                else:
+                    lines.append((x, y, width, False))
+
+            if vertical:
+                x += item_size
+            else:
+                y += item_size
+
+        return True
+
+    if divide(window.root, 0, 0, size.columns, size.rows):
+        return panes, lines
+
+
+def _divide(split, available):
+    """
+    Divide the available space over the items of this split and the borders
+    in between. Like `prompt_toolkit.layout.containers.VSplit` does with the
+    dimensions that `_create_split` gives.
+    """
+    assert isinstance(split, (HSplit, VSplit))
+
+    if not split:
+        return None
+
+    weights = [split.weights.get(item) for item in split]
+    given = [split.weights[item] for item in split if item in split.weights]
+    average_weight = max(1, sum(given) // len(given)) if sum(given) else 1
+
+    # The items (even indexes) grow, the borders have exactly one row/column.
+    dimensions = []  # (min, max, weight) tuples.
+    for i, weight in enumerate(weights):
+        if i > 0:
+            dimensions.append((1, 1, 1))
+        dimensions.append((0, None, weight or average_weight))
+
+    sizes = [d[0] for d in dimensions]
+    if sum(sizes) > available:
+        return None
+
+    child_generator = take_using_weights(
+        items=list(range(len(dimensions))),
+        weights=[d[2] for d in dimensions])
+
+    i = next(child_generator)
+    while sum(sizes) < available:
+        if dimensions[i][1] is None or sizes[i] < dimensions[i][1]:
+            sizes[i] += 1
+        i = next(child_generator)
+
+    return sizes
+
+
+class ClientRenderer(object):
+    """
+    Send frames to a client that renders itself.
+
+    :param connection: The `ServerConnection`.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.pymux = connection.pymux
+
+        #: True when the last output was a frame. (Not terminal output.)
+        self.sends_frames = False
+
+        # What the client knows.
+        self._ui = None
+        self._styles = set()
+        self._rows = {}  # Maps pane ID to the list of rows.
+        self._layout = None
+        self._status = None
+        self._cursor = None
+        self._title = None
+
+    def redraw(self, cli, render):
+        """
+        Send a frame, or when the server has to render the UI, call `render`.
+        """
+        connection = self.connection
+        positions = None
+
+        if not self._needs_server_render(cli):
+            size = self.pymux.get_window_size(cli)
+            positions = get_pane_positions(self.pymux, cli, size)
+
+        if positions is None:
+            if self.sends_frames:
+                # Forget what the client has on its screen, and repaint
+                # everything, starting at the top left.
+                self.sends_frames = False
+                cli.renderer.reset(leave_alternate_screen=False)
+                cli.output.cursor_goto(0, 0)
+            render()
+
+        elif connection.is_behind:
+            # What changed is sent in the next frame, when the client caught
+            # up. (See `ServerConnection._write_queue_drained`.)
+            connection.skip_output()
+
+        else:
+            self.sends_frames = True
+            connection.send_frame(self._create_frame(cli, size, *positions))
+
+    def _needs_server_render(self, cli):
+        """
+        True when the UI displays things that the client can't compose.
+        """
+        pymux = self.pymux
+        client_state = pymux.get_client_state(cli)
+
+        if (client_state.message or client_state.command_mode or
+                client_state.confirm_text or client_state.prompt_command or
+                pymux.display_pane_numbers or pymux.enable_pane_status):
+            return True
+
+        window = pymux.arrangement.get_active_window(cli)
+        return any(p.display_scroll_buffer or p.clock_mode for p in window.panes)
+
+    def _create_frame(self, cli, size, panes, lines):
+        pymux = self.pymux
+        row_cache = pymux.row_cache
+        frame = {'cmd': 'frame'}
+        rows = []
+
+        if self._ui is None:
+            self._ui = frame['ui'] = self._get_ui_styles()
+
+        active_pane = pymux.arrangement.get_active_pane(cli)
+        cursor = None
+
+        for pane, x, y, width, height in panes:
+            pane.process.set_size(width, height)
+            sent_rows = self._rows.get(pane.pane_id, [])
+
+            for i, row in enumerate(row_cache.get_rows(pane, width, height)):
+                if i >= len(sent_rows) or sent_rows[i] != row:
+                    rows.append([pane.pane_id, i, row])
+
+            self._rows[pane.pane_id] = row_cache.get_rows(pane, width, height)
+
+            if pane == active_pane:
+                screen = pane.process.screen
+                cursor_x = screen.pt_cursor_position.x
+                cursor_y = screen.pt_cursor_position.y - screen.line_offset
+
+                if (screen.pt_screen.show_cursor and
+                        0 <= cursor_x < width and 0 <= cursor_y < height):
+                    cursor = [x + cursor_x, y + cursor_y]
+
+        # Layout.
+        layout = (
+            [size.columns, size.rows],
+            [[p[0].pane_id] + list(p[1:]) for p in panes],
+            [list(l) for l in lines],
+            active_pane.pane_id if active_pane else None)
+
+        if layout != self._layout:
+            self._layout = layout
+            frame['body'], frame['panes'], frame['lines'], frame['active'] = layout
+
+            # Forget the panes that are no longer visible.
+            visible = set(p[0] for p in layout[1])
+            for pane_id in list(self._rows):
+                if pane_id not in visible:
+                    del self._rows[pane_id]
+
+        if rows:
+            frame['rows'] = rows
+
+        if cursor != self._cursor:
+            self._cursor = frame['cursor'] = cursor
+
+        # Status bar.
+        status = self._get_status(cli)
+        if status != self._status:
+            self._status = frame['status'] = status
+
+        # Title.
+        title = pymux.get_title(cli)
+        if title != self._title:
+            self._title = frame['title'] = title
+
+        # Styles that the client doesn't know yet.
+        new_styles = [[i, attrs] for i, attrs in row_cache.styles.items()
+                      if i not in self._styles]
+        if new_styles:
+            self._styles.update(i for i, _ in new_styles)
+            frame['styles'] = new_styles
+
+        return frame
+
+    def _get_status(self, cli):
+        pymux = self.pymux
+
+        if not pymux.enable_status:
+            return None
+
+        layout_manager = pymux.layout_manager
+        get_style_id = pymux.row_cache.get_style_id
+
+        def encode(tokens):
+            return [[get_style_id(t[0]), t[1]] for t in tokens]
+
+        return [
+            encode(layout_manager._get_status_left_tokens(cli)),
+            encode(layout_manager._get_status_tokens(cli)),
+            encode(layout_manager._get_status_right_tokens(cli)),
+            pymux.status_justify,
+            pymux.status_left_length,
+            pymux.status_right_length,
+        ]
+
+    def _get_ui_styles(self):
+        """
+        The style IDs of the parts that the client draws itself.
+        """
+        get_style_id = self.pymux.row_cache.get_style_id
+        return {
+            'background': get_style_id(Token.Background),
+            'line': get_style_id(Token.Line),
+            'line-focussed': get_style_id(Token.Line.Focussed),
+            'status': get_style_id(Token.StatusBar),
+        }
@@ -22,12 +22,17 @@ ALIASES = {
     'last': 'last-window',
     'lastp': 'last-pane',
     'lextl': 'next-layout',
+    'lsc': 'list-clients',
     'lsk': 'list-keys',
+    'ls': 'list-sessions',
     'lsp': 'list-panes',
+    'lsw': 'list-windows',
     'movew': 'move-window',
+    'new': 'new-session',
     'neww': 'new-window',
     'next': 'next-window',
     'pasteb': 'paste-buffer',
+    'pipep': 'pipe-pane',
     'prev': 'previous-window',
     'prevl': 'previous-layout',
     'rename': 'rename-session',
@@ -44,5 +49,6 @@ ALIASES = {
     'splitw': 'split-window',
     'suspendc': 'suspend-client',
     'swapp': 'swap-pane',
+    'switchc': 'switch-client',
     'unbind': 'unbind-key',
 }
@@ -1,9 +1,10 @@
 from __future__ import unicode_literals
-import docopt
+import json
 import os
 import re
 import shlex
 import six
+import time
 
 from prompt_toolkit.document import Document
 from prompt_toolkit.enums import SEARCH_BUFFER
@@ -11,23 +12,34 @@ from prompt_toolkit.key_binding.vi_state import InputMode
 
 from pymux.arrangement import LayoutTypes
 from pymux.commands.aliases import ALIASES
+from pymux.commands.parser import CommandParser
 from pymux.commands.utils import wrap_argument
 from pymux.enums import PROMPT
 from pymux.format import format_pymux_string
 from pymux.key_mappings import pymux_key_to_prompt_toolkit_key_sequence, prompt_toolkit_key_to_vt100_key
 from pymux.layout import focus_right, focus_left, focus_up, focus_down
 from pymux.log import logger
+from pymux.monitor import format_cpu, format_size
 from pymux.options import SetOptionError
+from pymux.pipe import PanePipe
+from pymux.recording import AsciicastRecorder
+from pymux.snapshot import SnapshotError
+from pymux.upgrade import UpgradeError
+from pymux import upgrade
 
 __all__ = (
     'call_command_handler',
+    'compile_commands',
+    'execute_commands',
     'get_documentation_for_command',
     'get_option_flags_for_command',
     'handle_command',
     'has_command_handler',
+    'parse_command',
 )
 
 COMMANDS_TO_HANDLERS = {}  # Global mapping of pymux commands to their handlers.
+COMMANDS_TO_PARSERS = {}  # Parse the list of arguments for the handler.
 COMMANDS_TO_HELP = {}
 COMMANDS_TO_OPTION_FLAGS = {}
 
@@ -51,6 +63,7 @@ def get_option_flags_for_command(command):
 def handle_command(pymux, cli, input_string):
     """
     Handle command.
+    Returns False when the command failed.
     """
     assert isinstance(input_string, six.text_type)
 
@@ -59,23 +72,125 @@ def handle_command(pymux, cli, input_string):
 
     if input_string and not input_string.startswith('#'):  # Ignore comments.
         try:
-            if six.PY2:
-                # In Python2.6, shlex doesn't work with unicode input at all.
-                # In Python2.7, shlex tries to encode using ASCII.
-                parts = shlex.split(input_string.encode('utf-8'))
-                parts = [p.decode('utf-8') for p in parts]
-            else:
-                parts = shlex.split(input_string)
-        except ValueError as e:
-            # E.g. missing closing quote.
-            pymux.show_message(cli, 'Invalid command %s: %s' % (input_string, e))
+            parts = _split_command(input_string)
+        except CommandException as e:
+            pymux.show_message(cli, e.message)
+            return False
+        else:
+            return call_command_handler(parts[0], pymux, cli, parts[1:])
+
+    return True
+
+
+def _split_command(input_string):
+    " Split the command line into the command and its arguments. "
+    try:
+        if six.PY2:
+            # In Python2.6, shlex doesn't work with unicode input at all.
+            # In Python2.7, shlex tries to encode using ASCII.
+            parts = shlex.split(input_string.encode('utf-8'))
+            return [p.decode('utf-8') for p in parts]
         else:
-            call_command_handler(parts[0], pymux, cli, parts[1:])
+            return shlex.split(input_string)
+    except ValueError as e:
+        # E.g. missing closing quote.
+        raise CommandException('Invalid command %s: %s' % (input_string, e))
+
+
+def compile_commands(text):
+    """
+    Parse all the commands in this text (like a configuration file), one
+    command per line. Returns a list of (line_number, execute) tuples, where
+    `execute` is a function like the ones that `parse_command` returns.
+    (Invalid commands are only reported when they are executed.)
+    """
+    assert isinstance(text, six.text_type)
+    result = []
+
+    for line_number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+
+        if line and not line.startswith('#'):  # Ignore comments.
+            try:
+                parts = _split_command(line)
+                execute = parse_command(parts[0], parts[1:])
+            except CommandException as e:
+                execute = _create_error_command(e.message)
+
+            result.append((line_number, execute))
+
+    return result
+
+
+def _create_error_command(message):
+    def execute(pymux, cli):
+        pymux.show_message(cli, message)
+        return False
+    return execute
+
+
+# The maximum number of errors that `execute_commands` reports.
+_MAX_ERRORS = 5
+
+
+def execute_commands(pymux, cli, commands, source):
+    """
+    Execute the commands that `compile_commands` returned, and invalidate the
+    UI only once, at the end. When commands fail, this raises one
+    `CommandException` that contains all the errors.
+
+    :param source: The name of the file. (For the error messages.)
+    """
+    client_state = pymux.get_client_state(cli)
+    errors = []
+
+    with pymux.postpone_invalidate():
+        for line_number, execute in commands:
+            message = client_state.message
+            client_state.message = None
+
+            if not execute(pymux, cli):
+                errors.append('%s:%i: %s' % (source, line_number, client_state.message))
+                client_state.message = None
+
+            # Keep the message of the previous command, if this one didn't
+            # display anything.
+            if client_state.message is None:
+                client_state.message = message
+
+    if errors:
+        # (The message is displayed in one line. Don't list all the errors of
+        # a completely broken file.)
+        message = '; '.join(errors[:_MAX_ERRORS])
+        if len(errors) > _MAX_ERRORS:
+            message += '; (%i more errors)' % (len(errors) - _MAX_ERRORS)
+        raise CommandException(message)
 
 
 def call_command_handler(command, pymux, cli, arguments):
     """
-    Execute command.
+    Execute command. Returns False when the command failed.
+
+    :param arguments: List of options.
+    """
+    try:
+        execute = parse_command(command, arguments)
+    except CommandException as e:
+        pymux.show_message(cli, e.message)
+        return False
+    else:
+        return execute(pymux, cli)
+
+
+def parse_command(command, arguments):
+    """
+    Resolve aliases and parse the arguments of this command. Returns a
+    function that executes the command. It receives (pymux, cli), and
+    returns False when the command failed.
+
+    (Key bindings parse their command once, and execute it many times.)
+
+    Raises `CommandException` when the command or the arguments are invalid.
 
     :param arguments: List of options.
     """
@@ -87,30 +202,45 @@ def call_command_handler(command, pymux, cli, arguments):
     try:
         handler = COMMANDS_TO_HANDLERS[command]
     except KeyError:
-        pymux.show_message(cli, 'Invalid command: %s' % (command,))
-    else:
+        raise CommandException('Invalid command: %s' % (command,))
+
+    variables = COMMANDS_TO_PARSERS[command](arguments)
+
+    def execute(pymux, cli):
+        # (Copy the lists. The handler receives them.)
+        received_options = dict(
+            (k, list(v) if isinstance(v, list) else v) for k, v in variables.items())
+
         try:
-            handler(pymux, cli, arguments)
+            handler(pymux, cli, received_options)
         except CommandException as e:
             pymux.show_message(cli, e.message)
+            return False
+
+        return True
+
+    return execute
 
 
-def cmd(name, options=''):
+def cmd(name, options='', invalidate=True):
     """
     Decorator for all commands.
 
     Commands will receive (pymux, cli, variables) as input.
     Commands can raise CommandException.
+
+    :param invalidate: When False, the UI is not invalidated after executing
+        the command. (For commands that only query the state.)
     """
-    # Validate options.
-    if options:
-        try:
-            docopt.docopt('Usage:\n    %s %s' % (name, options, ), [])
-        except SystemExit:
-            pass
+    # (The options are compiled into a parser when the command is used for
+    # the first time.)
+    parser = CommandParser(name, options)
 
     def decorator(func):
-        def command_wrapper(pymux, cli, arguments):
+        def parse_arguments(arguments):
+            " Turn the list of arguments into a dictionary. "
+            arguments = list(arguments)
+
             # Hack to make the 'bind-key' option work.
             # (bind-key expects a variable number of arguments.)
             if name == 'bind-key' and '--' not in arguments:
@@ -132,10 +262,7 @@ def cmd(name, options=''):
                 if six.PY2:
                     arguments = [a.encode('utf-8') for a in arguments]
 
-                received_options = docopt.docopt(
-                    'Usage:\n    %s %s' % (name, options),
-                    arguments,
-                    help=False)  # Don't interpret the '-h' option as help.
+                received_options = parser.parse(arguments)
 
                 # Make sure that all the received options from docopt are
                 # unicode objects. (Docopt returns 'str' for Python2.)
@@ -145,13 +272,18 @@ def cmd(name, options=''):
             except SystemExit:
                 raise CommandException('Usage: %s %s' % (name, options))
 
+            return received_options
+
+        def command_wrapper(pymux, cli, received_options):
             # Call handler.
             func(pymux, cli, received_options)
 
             # Invalidate all clients, not just the current CLI.
-            pymux.invalidate()
+            if invalidate:
+                pymux.invalidate()
 
         COMMANDS_TO_HANDLERS[name] = command_wrapper
+        COMMANDS_TO_PARSERS[name] = parse_arguments
         COMMANDS_TO_HELP[name] = options
 
         # Get list of option flags.
@@ -224,7 +356,7 @@ def select_window(pymux, cli, variables):
         except ValueError:
             invalid_window()
         else:
-            w = pymux.arrangement.get_window_by_index(number)
+            w = pymux.arrangement.get_window_by_index(cli, number)
             if w:
                 pymux.arrangement.set_active_window(cli, w)
             else:
@@ -245,7 +377,7 @@ def move_window(pymux, cli, variables):
         raise CommandException('Invalid window index: %r' % (dst_window, ))
 
     # Check first whether the index was not yet taken.
-    if pymux.arrangement.get_window_by_index(new_index):
+    if pymux.arrangement.get_window_by_index(cli, new_index):
         raise CommandException("Can't move window: index in use.")
 
     # Save index.
@@ -279,6 +411,17 @@ def kill_window(pymux, cli, variables):
         pymux.kill_pane(pane)
 
 
+@cmd('kill-session', options='[(-t <target-session>)]')
+def kill_session(pymux, cli, variables):
+    " Kill all panes in the current (or given) session. "
+    session = _get_target_session(pymux, cli, variables['<target-session>'])
+
+    # (Iterate over copies. Killing the last pane removes the window.)
+    for w in list(session.windows):
+        for pane in list(w.panes):
+            pymux.kill_pane(pane)
+
+
 @cmd('suspend-client')
 def suspend_client(pymux, cli, variables):
     connection = pymux.get_connection_for_cli(cli)
@@ -328,6 +471,57 @@ def new_window(pymux, cli, variables):
     pymux.create_window(cli, executable, start_directory=start_directory, name=name)
 
 
+@cmd('new-session', options='[-d] [(-s <name>)] [<executable>]')
+def new_session(pymux, cli, variables):
+    """
+    Create a new session in this server, and switch to it.
+    -d: Don't switch to the new session.
+    """
+    name = variables['<name>']
+
+    if name and pymux.arrangement.get_session_by_name(name):
+        raise CommandException('Duplicate session: %s' % (name, ))
+
+    pymux.new_session(cli, name=name, command=variables['<executable>'],
+                      set_active=not variables['-d'])
+
+
+@cmd('switch-client', options='[-n|-p] [(-t <target-session>)]')
+def switch_client(pymux, cli, variables):
+    """
+    Attach this client to another session.
+    -n: Switch to the next session.
+    -p: Switch to the previous session.
+    """
+    arrangement = pymux.arrangement
+    sessions = arrangement.sessions
+
+    if variables['-n'] or variables['-p']:
+        current = arrangement.get_active_session(cli)
+        step = (1 if variables['-n'] else -1)
+        session = sessions[(sessions.index(current) + step) % len(sessions)]
+    else:
+        session = _get_target_session(pymux, cli, variables['<target-session>'])
+
+    arrangement.set_active_session(cli, session)
+
+
+def _get_target_session(pymux, cli, name):
+    """
+    Return the session with the given name, or the session of the client
+    when no name was given.
+    """
+    if name is None:
+        return pymux.arrangement.get_active_session(cli)
+
+    session = pymux.arrangement.get_session_by_name(name)
+
+    if session is None:
+        raise CommandException("Can't find session: %s" % (name, ))
+
+    return session
+
+
 @cmd('next-window')
 def next_window(pymux, cli, variables):
     " Focus the next window. "
@@ -380,7 +574,19 @@ def rename_session(pymux, cli, variables):
     """
     Rename this session.
     """
-    pymux.session_name = variables['<name>']
+    name = variables['<name>']
+
+    if pymux.arrangement.get_session_by_name(name):
+        raise CommandException('Duplicate session: %s' % (name, ))
+
+    session = pymux.arrangement.get_active_session(cli)
+
+    # Keep the default name in sync. (It names the snapshot file, and the
+    # first session when all sessions were closed.)
+    if session.name == pymux.session_name:
+        pymux.session_name = name
+
+    session.name = name
 
 
 @cmd('split-window', options='[-v|-h] [(-c <start-directory>)] [<executable>]')
@@ -522,7 +728,8 @@ def send_keys(pymux, cli, variables):
 
         # Translate prompt_toolkit key to VT100 key.
         for k in keys_sequence:
-            pane.process.write_key(k)
+            if not pane.process.write_key(k):
+                raise CommandException('Input queue of pane is full.')
 
 
 @cmd('copy-mode', options='[-u]')
@@ -545,7 +752,126 @@ def paste_buffer(pymux, cli, variables):
     Paste clipboard content into buffer.
     """
     pane = pymux.arrangement.get_active_pane(cli)
-    pane.process.write_input(cli.clipboard.get_data().text, paste=True)
+
+    if not pane.process.write_input(cli.clipboard.get_data().text, paste=True):
+        raise CommandException('Input queue of pane is full.')
+
+
+@cmd('pipe-pane', options='[-o] [-z] [(-f <filename>)] [<command>]')
+def pipe_pane(pymux, cli, variables):
+    """
+    Copy the output of the active pane to the stdin of a shell command, or
+    to a file. Without a command or file, stop piping.
+    -o: Only open a new pipe when there was none. (Toggle.)
+    -z: Gzip compress the output.
+    """
+    pane = pymux.arrangement.get_active_pane(cli)
+    process = pane.process
+    had_pipe = process.pipe is not None
+
+    command = variables['<command>']
+    filename = variables['<filename>']
+
+    if command and filename:
+        raise CommandException('Use either -f <filename> or a command, not both.')
+
+    # Close the current pipe.
+    process.set_pipe(None)
+
+    if (command or filename) and not (variables['-o'] and had_pipe):
+        if command:
+            command = format_pymux_string(pymux, cli, command, pane=pane)
+        if filename:
+            filename = os.path.expanduser(
+                format_pymux_string(pymux, cli, filename, pane=pane))
+
+        try:
+            pipe = PanePipe(
+                pymux.eventloop, command=command, filename=filename,
+                compress=variables['-z'],
+                max_buffer_size=pymux.pipe_pane_buffer_limit * 1024,
+                block=(pymux.pipe_pane_overflow == 'block'))
+        except (OSError, IOError) as e:
+            raise CommandException('Could not open pipe: %s' % (e, ))
+
+        process.set_pipe(pipe)
+
+
+@cmd('record-pane', options='[-i] [<filename>]')
+def record_pane(pymux, cli, variables):
+    """
+    Record the output of the active pane in asciicast v2 format. Without
+    filename, stop recording.
+    -i: Also record the input.
+    """
+    pane = pymux.arrangement.get_active_pane(cli)
+    process = pane.process
+    filename = variables['<filename>']
+
+    # Stop the current recording.
+    process.set_recorder(None)
+
+    if filename:
+        filename = os.path.expanduser(
+            format_pymux_string(pymux, cli, filename, pane=pane))
+
+        try:
+            recorder = AsciicastRecorder(
+                pymux.eventloop, filename, process.sx, process.sy,
+                record_input=variables['-i'])
+        except (OSError, IOError) as e:
+            raise CommandException('Could not open file: %s' % (e, ))
+
+        process.set_recorder(recorder)
+
+
+@cmd('save-session', options='[<filename>]')
+def save_session(pymux, cli, variables):
+    """
+    Save a snapshot of the windows, panes and scrollback. (Written in the
+    background.)
+    """
+    filename = variables['<filename>']
+    if filename:
+        filename = os.path.expanduser(filename)
+
+    def done(error):
+        if error:
+            pymux.show_message(cli, 'Saving session failed: %s' % (error, ))
+        else:
+            pymux.show_message(cli, 'Session saved.')
+        pymux.invalidate()
+
+    pymux.snapshots.save(filename, done_callback=done)
+
+
+@cmd('restore-session', options='[<filename>]')
+def restore_session(pymux, cli, variables):
+    """
+    Recreate the windows and panes from a snapshot, made by "save-session".
+    """
+    filename = variables['<filename>']
+    if filename:
+        filename = os.path.expanduser(filename)
+
+    try:
+        count = pymux.snapshots.restore(filename)
+    except SnapshotError as e:
+        raise CommandException(e.message)
+
+    pymux.show_message(cli, 'Restoring %i window(s).' % count)
+
+
+@cmd('upgrade-server')
+def upgrade_server(pymux, cli, variables):
+    """
+    Replace the server process by the installed version of pymux, without
+    restarting the processes in the panes. Clients reconnect automatically.
+    """
+    try:
+        upgrade.upgrade_server(pymux)
+    except UpgradeError as e:
+        raise CommandException(e.message)
 
 
 @cmd('source-file', options='<filename>')
@@ -555,13 +881,38 @@ def source_file(pymux, cli, variables):
     """
     filename = os.path.expanduser(variables['<filename>'])
     try:
-        with open(filename, 'rb') as f:
-            for line in f:
-                line = line.decode('utf-8')
-                handle_command(pymux, cli, line)
+        commands = _compile_file(filename)
     except IOError as e:
         raise CommandException('IOError: %s' % (e, ))
 
+    execute_commands(pymux, cli, commands, source=variables['<filename>'])
+
+
+_COMPILED_FILES = {}  # Maps (filename, mtime) to the compiled commands.
+
+
+def _compile_file(filename):
+    """
+    Return the compiled commands of this configuration file. (They are
+    cached, until the file is modified.)
+    """
+    filename = os.path.abspath(filename)
+    key = (filename, os.stat(filename).st_mtime)
+
+    try:
+        return _COMPILED_FILES[key]
+    except KeyError:
+        with open(filename, 'rb') as f:
+            commands = compile_commands(f.read().decode('utf-8'))
+
+        # Forget previous versions of this file.
+        for k in list(_COMPILED_FILES):
+            if k[0] == filename:
+                del _COMPILED_FILES[k]
+
+        _COMPILED_FILES[key] = commands
+        return commands
+
 
 @cmd('set-option', options='<option> <value>')
 def set_option(pymux, cli, variables, window=False):
@@ -611,7 +962,7 @@ def clear_history(pymux, cli, variables):
         pane.process.screen.clear_history()
 
 
-@cmd('list-keys')
+@cmd('list-keys', invalidate=False)
 def list_keys(pymux, cli, variables):
     """
     Display all configured key bindings.
@@ -629,11 +980,25 @@ def list_keys(pymux, cli, variables):
     result = '\n'.join(sorted(result))
 
     # Display help in pane.
-    pane = pymux.arrangement.get_active_pane(cli)
-    pane.display_text(result, title='list-keys')
+    pymux.display_text(cli, result, title='list-keys')
+
+
+def _json_format(variables):
+    """
+    True when the '-F' option of a list command asks for JSON.
+    """
+    output_format = variables['<format>']
+
+    if output_format is None:
+        return False
+    elif output_format == 'json':
+        return True
+    else:
+        raise CommandException('Unsupported format: %s (Only "json" is supported.)' % (
+            output_format, ))
 
 
-@cmd('list-panes')
+@cmd('list-panes', options='[-F <format>]', invalidate=False)
 def list_panes(pymux, cli, variables):
     """
     Display a list of all the panes.
@@ -642,18 +1007,176 @@ def list_panes(pymux, cli, variables):
     active_pane = w.active_pane
 
     result = []
+    records = []
 
     for i, p in enumerate(w.panes):
         process = p.process
+        cpu, rss = pymux.resource_monitor.get_stats(p)
+        history = min(pymux.history_limit, process.screen.line_offset + process.sy)
 
-        result.append('%i: [%sx%s] [history %s/%s] %s\n' % (
-            i, process.sx, process.sy,
-            min(pymux.history_limit, process.screen.line_offset + process.sy),
-            pymux.history_limit,
+        pipe_dropped = process.pipe.dropped if process.pipe else 0
+
+        result.append('%i: [%sx%s] [history %s/%s] [cpu %s] [rss %s] %s%s\n' % (
+            i, process.sx, process.sy, history, pymux.history_limit,
+            format_cpu(cpu), format_size(rss),
+            ('[pipe dropped %s] ' % format_size(pipe_dropped) if pipe_dropped else ''),
             ('(active)' if p == active_pane else '')))
 
+        records.append({
+            'index': i,
+            'id': p.pane_id,
+            'name': p.name,
+            'title': process.screen.title,
+            'width': process.sx,
+            'height': process.sy,
+            'history': history,
+            'history_limit': pymux.history_limit,
+            'cpu': cpu,
+            'rss': rss,
+            'pid': process.pid,
+            'cwd': process.get_cwd(),
+            'terminated': process.is_terminated,
+            'pipe': process.pipe is not None,
+            'pipe_dropped': pipe_dropped,
+            'active': p == active_pane,
+        })
+
+    # Display help in pane.
+    if _json_format(variables):
+        pymux.display_text(cli, json.dumps(records) + '\n', title='list-panes')
+    else:
+        pymux.display_text(cli, ''.join(result), title='list-panes')
+
+
+@cmd('list-windows', options='[-F <format>]', invalidate=False)
+def list_windows(pymux, cli, variables):
+    """
+    Display a list of the windows in the current session.
+    """
+    arrangement = pymux.arrangement
+    session = arrangement.get_active_session(cli)
+    active_window = arrangement.get_active_window(cli)
+
+    result = []
+    records = []
+
+    for w in session.windows:
+        size = pymux.get_window_size_for_window(w)
+
+        result.append('%s: %s%s (%i panes) [%sx%s]%s\n' % (
+            w.index, w.name or '(noname)', format_pymux_string(pymux, cli, '#F', window=w),
+            len(w.panes), size.columns, size.rows,
+            (' (active)' if w == active_window else '')))
+
+        records.append({
+            'index': w.index,
+            'id': w.window_id,
+            'name': w.name,
+            'session': session.name,
+            'panes': [p.pane_id for p in w.panes],
+            'active_pane': w.active_pane.pane_id if w.active_pane else None,
+            'width': size.columns,
+            'height': size.rows,
+            'zoom': w.zoom,
+            'synchronize_panes': w.synchronize_panes,
+            'active': w == active_window,
+        })
+
+    if _json_format(variables):
+        pymux.display_text(cli, json.dumps(records) + '\n', title='list-windows')
+    else:
+        pymux.display_text(cli, ''.join(result), title='list-windows')
+
+
+@cmd('list-clients', options='[-F <format>]', invalidate=False)
+def list_clients(pymux, cli, variables):
+    """
+    Display a list of the attached clients.
+    """
+    result = []
+    records = []
+
+    for i, connection in enumerate(c for c in pymux.connections if c.cli):
+        session = pymux.arrangement.get_active_session(connection.cli)
+        compressor = connection.compressor
+
+        if compressor:
+            compression = ' [compression %i%%, %s -> %s, cpu %.3fs]' % (
+                round(compressor.ratio * 100), format_size(compressor.bytes_in),
+                format_size(compressor.bytes_out), compressor.time)
+        else:
+            compression = ''
+
+        if connection.lagging_since is not None:
+            lag_time = time.time() - connection.lagging_since
+            lag = ' [lag %.1fs, backlog %s]' % (lag_time, format_size(connection.backlog))
+        else:
+            lag_time = None
+            lag = ''
+
+        result.append('%i: %s [%sx%s %s] [sent %s, coalesced %i]%s%s%s\n' % (
+            i, (session.name if session else '-'),
+            connection.size.columns, connection.size.rows, connection.term,
+            format_size(connection.bytes_sent), connection.frames_coalesced,
+            lag, compression,
+            (' (this client)' if connection.cli == cli else '')))
+
+        records.append({
+            'index': i,
+            'session': session.name if session else None,
+            'width': connection.size.columns,
+            'height': connection.size.rows,
+            'term': connection.term,
+            'bytes_sent': connection.bytes_sent,
+            'frames_coalesced': connection.frames_coalesced,
+            'lag': lag_time,
+            'backlog': connection.backlog,
+            'compression_ratio': compressor.ratio if compressor else None,
+            'this_client': connection.cli == cli,
+        })
+
+    if _json_format(variables):
+        pymux.display_text(cli, json.dumps(records) + '\n', title='list-clients')
+        return
+
+    render_groups = pymux.render_groups
+    result.append('\nrenders: %i, reused by other clients: %i\n' % (
+        render_groups.renders, render_groups.reused))
+
     # Display help in pane.
-    active_pane.display_text(''.join(result), title='list-panes')
+    pymux.display_text(cli, ''.join(result), title='list-clients')
+
+
+@cmd('list-sessions', options='[-F <format>]', invalidate=False)
+def list_sessions(pymux, cli, variables):
+    """
+    Display a list of all the sessions.
+    """
+    active_session = pymux.arrangement.get_active_session(cli)
+    result = []
+    records = []
+
+    for s in pymux.arrangement.sessions:
+        attached = sum(1 for c in pymux.clis.values()
+                       if pymux.arrangement.get_active_session(c) == s)
+
+        result.append('%s: %i windows%s%s\n' % (
+            s.name, len(s.windows),
+            (' (%i attached)' % attached if attached else ''),
+            (' (active)' if s == active_session else '')))
+
+        records.append({
+            'name': s.name,
+            'windows': [w.window_id for w in s.windows],
+            'attached': attached,
+            'active': s == active_session,
+        })
+
+    # Display help in pane.
+    if _json_format(variables):
+        pymux.display_text(cli, json.dumps(records) + '\n', title='list-sessions')
+    else:
+        pymux.display_text(cli, ''.join(result), title='list-sessions')
 
 
 # Check whether all aliases point to real commands.
@@ -1,7 +1,6 @@
 from __future__ import unicode_literals
 
 from prompt_toolkit.completion import Completer, Completion
-from prompt_toolkit.contrib.completers import WordCompleter
 from prompt_toolkit.document import Document
 
 from .aliases import ALIASES
@@ -11,6 +10,7 @@ from .utils import wrap_argument
 from pymux.arrangement import LayoutTypes
 from pymux.key_mappings import PYMUX_TO_PROMPT_TOOLKIT_KEYS
 
+from bisect import bisect_left
 from functools import partial
 
 
@@ -19,8 +19,119 @@ __all__ = (
 )
 
 
-def create_command_completer(pymux):
-    return ShlexCompleter(partial(get_completions_for_parts, pymux=pymux))
+def create_command_completer(pymux, get_cli=None):
+    """
+    :param get_cli: Callable that returns the `CommandLineInterface` of this
+        command line. (For completing the windows and panes of the client.)
+    """
+    return ShlexCompleter(partial(get_completions_for_parts, pymux=pymux, get_cli=get_cli))
+
+
+class IndexedWordCompleter(Completer):
+    """
+    Like prompt_toolkit's `WordCompleter`, but for completing on every key
+    press in large lists of words. The words are indexed once, and the result
+    for each text is cached. When a character is typed, the previous result
+    is narrowed down, instead of scanning all the words again.
+
+    :param words: List of words.
+    :param ignore_case: If True, case-insensitive completion.
+    :param meta_dict: Optional dict mapping words to their meta-information.
+    :param WORD: When True, use WORD characters.
+    :param sentence: When True, compare all the text before the cursor,
+        instead of the word before the cursor.
+    :param match_middle: When True, match not only the start, but also in the
+        middle of the word.
+    """
+    # Forget the cached results when there are more than this many.
+    _max_cache_size = 1000
+
+    def __init__(self, words, ignore_case=False, meta_dict=None, WORD=False,
+                 sentence=False, match_middle=False):
+        assert not (WORD and sentence)
+
+        self.words = list(words)
+        self.ignore_case = ignore_case
+        self.meta_dict = meta_dict or {}
+        self.WORD = WORD
+        self.sentence = sentence
+        self.match_middle = match_middle
+
+        if ignore_case:
+            self._keys = [w.lower() for w in self.words]
+        else:
+            self._keys = list(self.words)
+
+        if match_middle:
+            # Substring index: maps every character and every pair of
+            # characters to the indexes of the words that contain them.
+            self._substrings = {}
+
+            for i, key in enumerate(self._keys):
+                for part in set(key) | set(key[j:j + 2] for j in range(len(key) - 1)):
+                    self._substrings.setdefault(part, []).append(i)
+        else:
+            # Prefix index: the sorted words. (The words that start with the
+            # same text are next to each other.)
+            self._sorted = sorted((key, i) for i, key in enumerate(self._keys))
+
+        self._cache = {}  # Maps text to the indexes of the matching words.
+
+    def get_matching_words(self, text):
+        """
+        Return the words that match this text, in the original order.
+        """
+        return [self.words[i] for i in self._find(text)]
+
+    def _find(self, text):
+        if self.ignore_case:
+            text = text.lower()
+
+        try:
+            return self._cache[text]
+        except KeyError:
+            pass
+
+        keys = self._keys
+        previous = self._cache.get(text[:-1]) if text else None
+
+        if not text:
+            result = list(range(len(keys)))
+
+        elif previous is not None:
+            # Narrow down the result for the text without the last character.
+            if self.match_middle:
+                result = [i for i in previous if text in keys[i]]
+            else:
+                result = [i for i in previous if keys[i].startswith(text)]
+
+        elif self.match_middle:
+            result = [i for i in self._substrings.get(text[:2], []) if text in keys[i]]
+
+        else:
+            result = []
+            for key, i in self._sorted[bisect_left(self._sorted, (text, -1)):]:
+                if not key.startswith(text):
+                    break
+                result.append(i)
+            result.sort()
+
+        if len(self._cache) > self._max_cache_size:
+            self._cache.clear()
+
+        self._cache[text] = result
+        return result
+
+    def get_completions(self, document, complete_event):
+        # Get word/text before cursor.
+        if self.sentence:
+            word_before_cursor = document.text_before_cursor
+        else:
+            word_before_cursor = document.get_word_before_cursor(WORD=self.WORD)
+
+        for a in self.get_matching_words(word_before_cursor):
+            display_meta = self.meta_dict.get(a, '')
+            yield Completion(a, -len(word_before_cursor), display_meta=display_meta)
 
 
 class CommandCompleter(Completer):
@@ -29,12 +140,12 @@ class CommandCompleter(Completer):
     """
     def __init__(self):
         # Completer for full command names.
-        self._command_completer = WordCompleter(
+        self._command_completer = IndexedWordCompleter(
             sorted(COMMANDS_TO_HANDLERS.keys()),
             ignore_case=True, WORD=True, match_middle=True)
 
         # Completer for aliases.
-        self._aliases_completer = WordCompleter(
+        self._aliases_completer = IndexedWordCompleter(
             sorted(ALIASES.keys()),
             ignore_case=True, WORD=True, match_middle=True)
 
@@ -58,12 +169,65 @@ class CommandCompleter(Completer):
 
 
 _command_completer = CommandCompleter()
-_layout_type_completer = WordCompleter(sorted(LayoutTypes._ALL), WORD=True)
-_keys_completer = WordCompleter(sorted(PYMUX_TO_PROMPT_TOOLKIT_KEYS.keys()),
-                                ignore_case=True, WORD=True)
+_layout_type_completer = IndexedWordCompleter(sorted(LayoutTypes._ALL), WORD=True)
+_keys_completer = IndexedWordCompleter(sorted(PYMUX_TO_PROMPT_TOOLKIT_KEYS.keys()),
+                                       ignore_case=True, WORD=True)
+
+# Completers for values that can change, like the option values and the
+# windows. Maps (command, argument) to a (words, meta_dict, completer) tuple.
+# The completer is reused (with the results that it cached), as long as the
+# words don't change.
+_value_completers = {}
+
+
+def _get_value_completer(key, words, meta_dict=None, **kw):
+    words = list(words)
+    meta_dict = meta_dict or {}
 
+    try:
+        previous_words, previous_meta_dict, completer = _value_completers[key]
+    except KeyError:
+        pass
+    else:
+        if previous_words == words and previous_meta_dict == meta_dict:
+            return completer
 
-def get_completions_for_parts(parts, last_part, complete_event, pymux):
+    completer = IndexedWordCompleter(words, meta_dict=meta_dict, **kw)
+    _value_completers[key] = (words, meta_dict, completer)
+    return completer
+
+
+def _get_target_completer(pymux, cli, command):
+    """
+    Completer for the value of the -t option of these commands.
+    """
+    arrangement = pymux.arrangement
+
+    if command == 'select-window':
+        session = arrangement.get_active_session(cli)
+        windows = session.windows if session else []
+        meta_dict = dict((':%s' % w.index, w.name) for w in windows)
+
+        return _get_value_completer(
+            (command, '-t'), sorted(meta_dict, key=lambda v: int(v[1:])),
+            meta_dict=meta_dict, WORD=True)
+
+    elif command == 'select-pane':
+        window = arrangement.get_active_window(cli)
+        panes = window.panes if window else []
+        meta_dict = dict((':%s' % i, p.name) for i, p in enumerate(panes))
+        meta_dict.update({':.+': 'next', ':.-': 'previous'})
+
+        return _get_value_completer(
+            (command, '-t'), [':%s' % i for i in range(len(panes))] + [':.+', ':.-'],
+            meta_dict=meta_dict, WORD=True)
+
+    elif command in ('kill-session', 'switch-client'):
+        return _get_value_completer(
+            ('session', '-t'), sorted(s.name for s in arrangement.sessions), sentence=True)
+
+
+def get_completions_for_parts(parts, last_part, complete_event, pymux, get_cli=None):
     completer = None
 
     # Resolve aliases.
@@ -76,19 +240,20 @@ def get_completions_for_parts(parts, last_part, complete_event, pymux):
 
     elif len(parts) >= 1 and last_part.startswith('-'):
         flags = get_option_flags_for_command(parts[0])
-        completer = WordCompleter(sorted(flags), WORD=True)
+        completer = _get_value_completer((parts[0], 'flags'), sorted(flags), WORD=True)
 
     elif len(parts) == 1 and parts[0] in ('set-option', 'set-window-option'):
         options = pymux.options if parts[0] == 'set-option' else pymux.window_options
 
-        completer = WordCompleter(sorted(options.keys()), sentence=True)
+        completer = _get_value_completer((parts[0], 1), sorted(options.keys()), sentence=True)
 
     elif len(parts) == 2 and parts[0] in ('set-option', 'set-window-option'):
         options = pymux.options if parts[0] == 'set-option' else pymux.window_options
 
         option = options.get(parts[1])
         if option:
-            completer = WordCompleter(sorted(option.get_all_values(pymux)), sentence=True)
+            completer = _get_value_completer(
+                (parts[0], parts[1]), sorted(option.get_all_values(pymux)), sentence=True)
 
     elif len(parts) == 1 and parts[0] == 'select-layout':
         completer = _layout_type_completer
@@ -103,9 +268,12 @@ def get_completions_for_parts(parts, last_part, complete_event, pymux):
         elif len(parts) == 2:
             completer = _command_completer
 
+    elif parts[-1] == '-t' and get_cli is not None:
+        completer = _get_target_completer(pymux, get_cli(), parts[0])
+
     # Recursive, for bind-key options.
     if parts and parts[0] == 'bind-key' and len(parts) > 2:
-        for c in get_completions_for_parts(parts[2:], last_part, complete_event, pymux):
+        for c in get_completions_for_parts(parts[2:], last_part, complete_event, pymux, get_cli):
             yield c
 
     if completer:
@@ -0,0 +1,61 @@
+"""
+Argument parsing for the commands.
+
+The options of the commands are docopt usage patterns. `docopt.docopt`
+parses the usage string again for every call. Instead, we compile the
+pattern of each command once (the first time that the command is used),
+and after that, only parse and match the arguments. This uses the docopt
+functions that `docopt.docopt` uses, so the result and the errors are the
+same.
+"""
+from __future__ import unicode_literals
+
+import docopt
+
+__all__ = (
+    'CommandParser',
+)
+
+
+class CommandParser(object):
+    """
+    Parser for the arguments of one command.
+
+    :param name: The name of the command.
+    :param options: Docopt usage pattern for the arguments.
+    """
+    def __init__(self, name, options):
+        self.usage = 'Usage:\n    %s %s' % (name, options)
+        self._pattern = None
+        self._options = None
+
+    def _compile(self):
+        # (Like `docopt.docopt` does.)
+        options = docopt.parse_defaults(self.usage)
+        pattern = docopt.parse_pattern(docopt.formal_usage(docopt.printable_usage(self.usage)),
+                                       options)
+
+        self._options = options
+        self._pattern = pattern.fix()
+        self._leaves = self._pattern.flat()
+
+    def parse(self, arguments):
+        """
+        Match the arguments against the pattern. Returns a dictionary, like
+        `docopt.docopt`, or raises `docopt.DocoptExit`. (A `SystemExit`.)
+        """
+        if self._pattern is None:
+            self._compile()
+
+        # (`parse_argv` adds the unknown options to the list that we pass.)
+        argv = docopt.parse_argv(docopt.TokenStream(arguments, docopt.DocoptExit),
+                                 list(self._options))
+
+        matched, left, collected = self._pattern.match(argv)
+
+        if matched and left == []:
+            # (Copy the default lists. They belong to the pattern.)
+            return dict((a.name, list(a.value) if isinstance(a.value, list) else a.value)
+                        for a in self._leaves + collected)
+
+        raise docopt.DocoptExit()
@@ -0,0 +1,317 @@
+"""
+Composing the terminal output in the client, from the frames that the server
+sends to clients that render themselves. (See `pymux.client_render` for the
+content of these frames.)
+
+The composer keeps the content of the visible panes, and the rows that it
+wrote to the terminal. After each frame, only the rows that changed are
+written again. When the terminal is resized, everything is composed again
+for the new size right away, with what we have; the server sends the
+content for the new size after that.
+
+Note: this module is only imported by the client, when attaching.
+"""
+from __future__ import unicode_literals
+
+from prompt_toolkit.layout.screen import Size
+from prompt_toolkit.styles import Attrs
+from prompt_toolkit.terminal.vt100_output import Vt100_Output
+
+__all__ = (
+    'Composer',
+)
+
+_VERTICAL_LINE = '│'
+_HORIZONTAL_LINE = '─'
+
+
+class Composer(object):
+    """
+    Turn frames into terminal output.
+    """
+    def __init__(self, true_color=False, ansi_colors_only=False, term=None):
+        self._stdout = _TextStdout()
+        self._size = Size(rows=24, columns=80)
+        self._output = Vt100_Output(self._stdout, lambda: self._size,
+                                    true_color=true_color,
+                                    ansi_colors_only=ansi_colors_only,
+                                    term=term, write_binary=False)
+
+        #: True when the terminal displays what we composed. (Not the
+        #: output that the server rendered.)
+        self.active = False
+
+        self._styles = {}  # Maps style ID to `Attrs`.
+        self._ui = {}  # Maps 'background', 'line', ... to style ID.
+        self._body = [0, 0]
+        self._panes = []
+        self._lines = []
+        self._active_pane_id = None
+        self._rows = {}  # Maps pane ID to a {y: runs} dictionary.
+        self._cursor = None
+        self._status = None
+        self._title = None
+        self._title_changed = False
+
+        # What is on the terminal.
+        self._previous = None
+        self._previous_size = None
+
+    def feed(self, frame):
+        " Process a 'frame' packet. "
+        for style_id, attrs in frame.get('styles', []):
+            self._styles[style_id] = Attrs(*attrs)
+
+        if 'ui' in frame:
+            self._ui = frame['ui']
+
+        if 'panes' in frame:
+            self._body = frame['body']
+            self._panes = frame['panes']
+            self._lines = frame['lines']
+            self._active_pane_id = frame['active']
+
+            visible = set(p[0] for p in self._panes)
+            for pane_id in list(self._rows):
+                if pane_id not in visible:
+                    del self._rows[pane_id]
+
+        for pane_id, y, runs in frame.get('rows', []):
+            self._rows.setdefault(pane_id, {})[y] = runs
+
+        if 'cursor' in frame:
+            self._cursor = frame['cursor']
+
+        if 'status' in frame:
+            self._status = frame['status']
+
+        if 'title' in frame:
+            self._title = frame['title']
+            self._title_changed = True
+
+        self.active = True
+
+    def forget(self):
+        """
+        Called when the terminal displays something else. (Output that the
+        server rendered.) The next time, everything is written again.
+        """
+        self.active = False
+        self._previous = None
+
+    def render(self, rows, columns):
+        """
+        Return the output that brings the terminal up to date.
+        """
+        if not self.active:
+            return ''
+
+        size = Size(rows=rows, columns=columns)
+        output = self._output
+        self._size = size
+
+        grid, origin = self._compose(size)
+
+        if self._previous_size == size:
+            previous = self._previous
+        else:
+            previous = None
+
+        output.hide_cursor()
+
+        if previous is None:
+            output.reset_attributes()
+            output.disable_autowrap()
+            output.erase_screen()
+
+        # Write the rows that changed.
+        for y, row in enumerate(grid):
+            if previous is None or previous[y] != row:
+                output.cursor_goto(y + 1, 1)
+                current_style = None
+                output.reset_attributes()
+
+                for style_id, char in row:
+                    if style_id != current_style:
+                        if style_id is None or style_id not in self._styles:
+                            output.reset_attributes()
+                        else:
+                            output.set_attributes(self._styles[style_id])
+                        current_style = style_id
+
+                    output.write(char)
+
+                output.reset_attributes()
+
+        # Cursor.
+        if self._cursor:
+            x = origin[0] + self._cursor[0]
+            y = origin[1] + self._cursor[1]
+
+            if 0 <= x < columns and 0 <= y < len(grid):
+                output.cursor_goto(y + 1, x + 1)
+                output.show_cursor()
+
+        # Title.
+        if self._title_changed:
+            output.set_title(self._title)
+            self._title_changed = False
+
+        output.flush()
+
+        self._previous = grid
+        self._previous_size = size
+        return self._stdout.get_text()
+
+    def _compose(self, size):
+        """
+        Return the rows for the terminal, as lists of (style_id, text) cells,
+        and the position of the top left corner of the window.
+        """
+        ui = self._ui
+        columns = size.columns
+        height = max(0, size.rows - (1 if self._status else 0))
+
+        # Background. (Visible when the window is smaller than the terminal.)
+        background = ui.get('background')
+        grid = [[(background, '.' if (x + y) % 3 == 0 else ' ') for x in range(columns)]
+                for y in range(height)]
+
+        def put(x, y, cells):
+            if 0 <= y < height:
+                row = grid[y]
+                for i, cell in enumerate(cells, x):
+                    if 0 <= i < columns:
+                        row[i] = cell
+
+        # The window, in the center.
+        body_columns, body_rows = self._body
+        x0 = max(0, (columns - body_columns) // 2)
+        y0 = max(0, (height - body_rows) // 2)
+
+        for y in range(body_rows):
+            put(x0, y0 + y, [(None, ' ')] * body_columns)
+
+        # Panes.
+        for pane_id, x, y, width, pane_height in self._panes:
+            pane_rows = self._rows.get(pane_id, {})
+
+            for i in range(pane_height):
+                cells = _get_cells(pane_rows.get(i, []))[:width]
+                put(x0 + x, y0 + y + i, cells)
+
+        # Borders between the panes, and around the window. (Like
+        # `pymux.layout.HighlightBorders` draws them.)
+        line = ui.get('line')
+        line_cells = set()  # Positions of the horizontal lines.
+
+        def put_line(x, y, char):
+            put(x, y, [(line, char)])
+            if char == _HORIZONTAL_LINE:
+                line_cells.add((x, y))
+
+        for x, y, length, vertical in self._lines:
+            for i in range(length):
+                if vertical:
+                    put_line(x0 + x, y0 + y + i, _VERTICAL_LINE)
+                else:
+                    put_line(x0 + x + i, y0 + y, _HORIZONTAL_LINE)
+
+        if self._panes:
+            if y0 + body_rows < height:
+                for x in range(x0, x0 + body_columns):
+                    put_line(x, y0 + body_rows, _HORIZONTAL_LINE)
+                put_line(x0 - 1, y0 + body_rows, '└')
+                put_line(x0 + body_columns, y0 + body_rows, '┘')
+
+            if y0 >= 1:
+                for x in range(x0, x0 + body_columns):
+                    put_line(x, y0 - 1, _HORIZONTAL_LINE)
+                put_line(x0 - 1, y0 - 1, '┌')
+                put_line(x0 + body_columns, y0 - 1, '┐')
+
+            for y in range(y0 + 1, y0 + body_rows):
+                put_line(x0 - 1, y, _VERTICAL_LINE)
+                put_line(x0 + body_columns, y, _VERTICAL_LINE)
+
+            put_line(x0 - 1, y0, '┌')
+            put_line(x0 + body_columns, y0, '┐')
+
+        # Highlight the borders of the active pane.
+        focussed = ui.get('line-focussed')
+
+        def put_focussed(x, y, char):
+            put(x, y, [(focussed, char)])
+
+        for pane_id, x, y, width, pane_height in self._panes:
+            if pane_id == self._active_pane_id:
+                x += x0
+                y += y0
+
+                for i in range(y, y + pane_height):
+                    put_focussed(x - 1, i, '┃')
+                    put_focussed(x + width, i, '┃')
+
+                for line_y, left, right in ((y + pane_height, '┗', '┛'), (y - 1, '┏', '┓')):
+                    if 0 <= line_y < height:
+                        for i in range(x, x + width):
+                            if (i, line_y) in line_cells:
+                                put_focussed(i, line_y, '━')
+                        put_focussed(x - 1, line_y, left)
+                        put_focussed(x + width, line_y, right)
+
+        # Status bar.
+        if self._status:
+            grid.append(self._compose_status(columns))
+
+        return grid, (x0, y0)
+
+    def _compose_status(self, columns):
+        left, middle, right, justify, left_length, right_length = self._status
+        style = self._ui.get('status')
+
+        left = _get_cells(left)[:left_length]
+        right = _get_cells(right)[:right_length]
+        middle = _get_cells(middle)
+
+        space = max(0, columns - len(left) - len(right))
+        padding = max(0, space - len(middle))
+
+        if justify == 'right':
+            middle = [(style, ' ')] * padding + middle
+        elif justify == 'center':
+            middle = [(style, ' ')] * (padding // 2) + middle
+
+        middle = (middle + [(style, ' ')] * space)[:space]
+        return (left + middle + right)[:columns]
+
+
+def _get_cells(runs):
+    """
+    Turn the [style_id, text] runs into a list of (style_id, text) cells.
+    """
+    result = []
+    for style_id, text in runs:
+        result.extend((style_id, c) for c in text)
+    return result
+
+
+class _TextStdout(object):
+    """
+    Stdout-like object that collects the output of `Vt100_Output`.
+    """
+    encoding = 'utf-8'
+
+    def __init__(self):
+        self._data = []
+
+    def write(self, data):
+        self._data.append(data)
+
+    def flush(self):
+        pass
+
+    def get_text(self):
+        text = ''.join(self._data)
+        self._data = []
+        return text
@@ -0,0 +1,115 @@
+"""
+Compression of the data that the server sends to a client.
+
+Clients can ask for compression when they attach. (For slow connections,
+like a forwarded socket.) After the server acknowledged that with a
+'compress' packet, the data from the server consists of frames:
+
+    header:  type (1 byte: b'z' or b'r') + length (unsigned int)
+    payload: the packets, as usual. Compressed for b'z' frames.
+
+All the compressed frames are part of one zlib stream, so that the
+compression can make use of the output that was sent earlier. Every frame
+is flushed, so that the client can decompress it right away. Small packets
+are sent as raw frames; compressing them costs more than it saves.
+
+Note: this module is also used by the client, so it should only import from
+the standard library.
+"""
+from __future__ import unicode_literals
+
+import struct
+import time
+import zlib
+
+__all__ = (
+    'Compressor',
+    'Decompressor',
+)
+
+_FRAME_HEADER = struct.Struct('>cI')
+_COMPRESSED = b'z'
+_RAW = b'r'
+
+
+class Compressor(object):
+    """
+    Compress the data for one client.
+
+    :param level: zlib compression level, 1-9.
+    """
+    def __init__(self, level=6):
+        assert 1 <= level <= 9
+        self._compressobj = zlib.compressobj(level)
+
+        # Statistics.
+        self.bytes_in = 0  # Size of the compressed data before compression.
+        self.bytes_out = 0  # Size after compression.
+        self.bytes_raw = 0  # Data in raw frames.
+        self.time = 0.  # Time spent compressing.
+
+    def compress(self, data, threshold=0):
+        """
+        Return a frame with this data.
+
+        :param threshold: Data smaller than this amount of bytes is not
+            compressed.
+        """
+        if len(data) < threshold:
+            self.bytes_raw += len(data)
+            return _FRAME_HEADER.pack(_RAW, len(data)) + data
+
+        start = time.time()
+        c = self._compressobj
+        compressed = c.compress(data) + c.flush(zlib.Z_SYNC_FLUSH)
+        self.time += time.time() - start
+
+        self.bytes_in += len(data)
+        self.bytes_out += len(compressed)
+        return _FRAME_HEADER.pack(_COMPRESSED, len(compressed)) + compressed
+
+    @property
+    def ratio(self):
+        " Compressed size, divided by the original size. "
+        if self.bytes_in:
+            return float(self.bytes_out) / self.bytes_in
+        return 1.
+
+
+class Decompressor(object):
+    """
+    Turn the frames that we receive back into the original data.
+    """
+    def __init__(self):
+        self._decompressobj = zlib.decompressobj()
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """
+        Feed received data. Returns the data of all the complete frames.
+        """
+        buffer = self._buffer
+        buffer += data
+        result = []
+        pos = 0  # Start of the first frame that was not processed.
+
+        while len(buffer) - pos >= _FRAME_HEADER.size:
+            frame_type, length = _FRAME_HEADER.unpack_from(buffer, pos)
+            start = pos + _FRAME_HEADER.size
+            end = start + length
+
+            if len(buffer) < end:
+                break
+
+            payload = bytes(buffer[start:end])
+            pos = end
+
+            if frame_type == _COMPRESSED:
+                payload = self._decompressobj.decompress(payload)
+
+            result.append(payload)
+
+        # Drop the processed frames. (Once per call, not for every frame.)
+        del buffer[:pos]
+
+        return b''.join(result)
@@ -0,0 +1,304 @@
+"""
+Control mode. (Like "tmux -CC".)
+
+A client that sends a 'control' packet, instead of 'start-gui', doesn't get
+a user interface. Instead, it receives 'control' packets with a list of
+events:
+
+    {'cmd': 'control', 'events': [
+        {'event': 'output', 'pane': pane_id, 'data': text},
+        {'event': 'output-dropped', 'pane': pane_id, 'size': size},
+        {'event': 'window-add', 'window': window_id, 'session': name,
+         'index': index, 'name': name},
+        {'event': 'window-close', 'window': window_id},
+        {'event': 'window-renamed', 'window': window_id, 'name': name},
+        {'event': 'window-pane-changed', 'window': window_id, 'pane': pane_id},
+        {'event': 'pane-add', 'window': window_id, 'pane': pane_id, 'name': name},
+        {'event': 'pane-close', 'window': window_id, 'pane': pane_id},
+        {'event': 'pane-renamed', 'window': window_id, 'pane': pane_id, 'name': name},
+        {'event': 'layout-change', 'window': window_id, 'layout': layout, 'zoom': zoom},
+        {'event': 'reply', 'id': id, 'ok': ok, 'message': message, 'output': output},
+    ]}
+
+Right after the 'control' packet, the client receives the events that
+describe the current windows and panes. 'layout' is a nested list like
+['h', [[size, pane_id], [size, ['v', [...]]]]].
+
+The client executes commands by sending
+{'cmd': 'control-command', 'id': id, 'data': command}. The 'reply' event
+with the same 'id' tells whether the command succeeded. 'message' is the
+message that the command displayed, and 'output' the text that commands
+like "list-panes" display.
+
+Events are collected, and sent in one packet when the event loop has time
+for it. The output of the panes is never blocked by a control client. When
+a control client can't keep up, the output of the panes is dropped for it,
+until everything has been sent. Then, an 'output-dropped' event tells how
+much output of each pane was dropped.
+"""
+from __future__ import unicode_literals
+
+from .arrangement import Pane, VSplit
+
+import json
+import time
+
+__all__ = (
+    'ControlEvents',
+    'ControlSubscriber',
+)
+
+# When more than this amount of bytes is waiting to be sent to a control
+# client, we drop the output of the panes for that client. (At most half of
+# the 'client-backlog-limit', otherwise the client would be disconnected.)
+_OUTPUT_LIMIT = 512 * 1024
+
+# Events are sent at most this many seconds after they happened.
+_MAX_DELAY = .05
+
+
+class ControlEvents(object):
+    """
+    Sends the events to all the control mode clients.
+    """
+    def __init__(self, pymux):
+        self.pymux = pymux
+        self.subscribers = []
+
+        self._state = {}  # What the subscribers know. (See `_get_state`.)
+        self._check_scheduled = False
+
+    def subscribe(self, connection, cli):
+        """
+        Start sending events to this connection. Returns a
+        `ControlSubscriber`.
+
+        :param cli: The `CommandLineInterface` for executing the commands.
+        """
+        # Send the pending changes to the existing subscribers first.
+        self._check_arrangement()
+
+        subscriber = ControlSubscriber(connection, cli)
+        subscriber.add_events(_get_events({}, self._state))
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+
+    def pane_output(self, pane, data):
+        " Called for all the output of all the panes. "
+        # Report new panes before their output.
+        if self._check_scheduled:
+            self._check_arrangement()
+
+        for subscriber in self.subscribers:
+            subscriber.add_output(pane.pane_id, data)
+
+    def arrangement_changed(self):
+        """
+        Called when the UI is invalidated. Windows or panes could have been
+        added, removed or renamed. (This is checked when the event loop has
+        time for it.)
+        """
+        if self.subscribers and not self._check_scheduled:
+            self._check_scheduled = True
+            self.pymux.eventloop.call_from_executor(
+                self._check_arrangement, _max_postpone_until=time.time() + _MAX_DELAY)
+
+    def _check_arrangement(self):
+        self._check_scheduled = False
+
+        state = _get_state(self.pymux)
+        events = _get_events(self._state, state)
+        self._state = state
+
+        if events:
+            for subscriber in self.subscribers:
+                subscriber.add_events(events)
+
+
+class ControlSubscriber(object):
+    """
+    A client in control mode.
+
+    :param connection: The `ServerConnection`.
+    :param cli: The `CommandLineInterface` for executing the commands. (This
+        one is never rendered.)
+    """
+    def __init__(self, connection, cli):
+        self.connection = connection
+        self.pymux = connection.pymux
+        self.cli = cli
+
+        self._events = []
+        self._size = 0  # Size of the output in `_events`. (Encoded as JSON.)
+        self._dropped = {}  # Maps pane ID to the amount of dropped output.
+        self._flush_scheduled = False
+
+    def add_events(self, events):
+        self._events.extend(events)
+        self._schedule_flush()
+
+    def add_output(self, pane_id, data):
+        """
+        Add output of a pane, or drop it when we're behind.
+        """
+        if not data:
+            return
+
+        # The size of the data in the packet. (Escaped control characters
+        # and non-ASCII characters take up to six bytes in JSON.)
+        size = len(json.dumps(data))
+        limit = min(_OUTPUT_LIMIT, self.pymux.client_backlog_limit * 1024 // 2)
+
+        if pane_id in self._dropped or self.connection.backlog + self._size + size > limit:
+            # (Once we dropped output of a pane, we drop everything until
+            # the client caught up. Otherwise, the client can't know where
+            # the gaps are.)
+            self._dropped[pane_id] = self._dropped.get(pane_id, 0) + len(data)
+            return
+
+        events = self._events
+        self._size += size
+
+        # Merge with the previous output of the same pane.
+        if events and events[-1]['event'] == 'output' and events[-1]['pane'] == pane_id:
+            events[-1]['data'] += data
+        else:
+            events.append({'event': 'output', 'pane': pane_id, 'data': data})
+
+        self._schedule_flush()
+
+    def drained(self):
+        """
+        Called when everything has been sent to the client. Tell what we
+        dropped, and continue sending the output.
+        """
+        if self._dropped:
+            self.add_events([{'event': 'output-dropped', 'pane': pane_id, 'size': size}
+                             for pane_id, size in sorted(self._dropped.items())])
+            self._dropped = {}
+
+    def run_command(self, command_id, command):
+        """
+        Execute a command, and reply with the result.
+        """
+        result = self.pymux.run_commands(self.cli, [command])[0]
+        result.update({'event': 'reply', 'id': command_id})
+
+        self.add_events([result])
+
+    def _schedule_flush(self):
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.pymux.eventloop.call_from_executor(
+                self._flush, _max_postpone_until=time.time() + _MAX_DELAY)
+
+    def _flush(self):
+        " Send the collected events in one packet. "
+        self._flush_scheduled = False
+
+        if self._events:
+            events = self._events
+            self._events = []
+            self._size = 0
+
+            self.connection.send_control_events(events)
+
+
+def _get_state(pymux):
+    """
+    Return a dictionary that maps the window IDs to a dictionary with the
+    properties of the window that we report.
+    """
+    state = {}
+
+    for session in pymux.arrangement.sessions:
+        for w in session.windows:
+            active_pane = w.active_pane
+
+            state[w.window_id] = {
+                'session': session.name,
+                'index': w.index,
+                'name': w.name,
+                'panes': [(p.pane_id, p.name) for p in w.panes],
+                'layout': _encode_layout(w.root),
+                'zoom': w.zoom,
+                'active': active_pane.pane_id if active_pane else None,
+            }
+
+    return state
+
+
+def _encode_layout(split):
+    children = []
+
+    for item in split:
+        if isinstance(item, Pane):
+            child = item.pane_id
+        else:
+            child = _encode_layout(item)
+
+        children.append([split.weights[item], child])
+
+    return ['v' if isinstance(split, VSplit) else 'h', children]
+
+
+def _get_events(old_state, new_state):
+    """
+    Return the events that describe the difference between two states.
+    """
+    events = []
+
+    # Closed windows.
+    for window_id, old in sorted(old_state.items()):
+        if window_id not in new_state:
+            for pane_id, _ in old['panes']:
+                events.append({'event': 'pane-close', 'window': window_id, 'pane': pane_id})
+            events.append({'event': 'window-close', 'window': window_id})
+
+    for window_id, new in sorted(new_state.items()):
+        old = old_state.get(window_id)
+
+        if old is None:
+            events.append({
+                'event': 'window-add',
+                'window': window_id,
+                'session': new['session'],
+                'index': new['index'],
+                'name': new['name'],
+            })
+            old_panes = {}
+        else:
+            if old['name'] != new['name']:
+                events.append({'event': 'window-renamed', 'window': window_id,
+                               'name': new['name']})
+            old_panes = dict(old['panes'])
+
+        # Panes.
+        new_panes = dict(new['panes'])
+
+        for pane_id, _ in old['panes'] if old else []:
+            if pane_id not in new_panes:
+                events.append({'event': 'pane-close', 'window': window_id, 'pane': pane_id})
+
+        for pane_id, name in new['panes']:
+            if pane_id not in old_panes:
+                events.append({'event': 'pane-add', 'window': window_id,
+                               'pane': pane_id, 'name': name})
+            elif old_panes[pane_id] != name:
+                events.append({'event': 'pane-renamed', 'window': window_id,
+                               'pane': pane_id, 'name': name})
+
+        # Layout.
+        if old is None or (old['layout'], old['zoom']) != (new['layout'], new['zoom']):
+            events.append({'event': 'layout-change', 'window': window_id,
+                           'layout': new['layout'], 'zoom': new['zoom']})
+
+        if old is None or old['active'] != new['active']:
+            events.append({'event': 'window-pane-changed', 'window': window_id,
+                           'pane': new['active']})
+
+    return events
@@ -2,8 +2,9 @@
 """
 pymux: Pure Python terminal multiplexer.
 Usage:
-    pymux [(standalone|start-server|attach)] [-d]
-          [--truecolor] [--ansicolor] [(-S <socket>)] [(-f <file>)]
+    pymux [(standalone|start-server|attach|new-session|control|batch)] [-d]
+          [(-t <session>)] [(-s <name>)] [--truecolor] [--ansicolor] [--predict]
+          [--compress] [--client-render] [(-S <socket>)] [(-f <file>)]
           [(--log <logfile>)]
           [--] [<command>]
     pymux list-sessions
@@ -15,20 +16,41 @@ Options:
                    not possible.
     start-server : Run a server daemon that can be attached later on.
     attach       : Attach to a running session.
+    new-session  : Create a new session in the running server, or start a
+                   server when none is running.
+    control      : Control mode. Execute the commands from stdin, and write
+                   the events of the server to stdout. (For automation.)
+    batch        : Execute all the commands from stdin at once. Print their
+                   output and errors.
 
-    -f           : Path to configuration file. By default: '~/.pymux.conf'.
-    -S           : Unix socket path.
+    -f <file>    : Path to configuration file. By default: '~/.pymux.conf'.
+    -S <socket>  : Unix socket path.
     -d           : Detach all other clients, when attaching.
-    --log        : Logfile.
+    -t <session> : Name of the session to attach to.
+    -s <name>    : Name for the new session.
+    --log <logfile>  : Logfile.
     --truecolor  : Render true color (24 bit) instead of 256 colors.
                    (Each client can set this separately.)
+    --predict    : Display typed characters before the server echoes them.
+                   (For slow connections.)
+    --compress   : Compress the output of the server. (For slow connections.)
+    --client-render  : Compose the terminal output in the client process,
+                   instead of in the server.
+
+Examples:
+    pymux new-session -S /tmp/pymux.sock -s work
+    pymux attach -S /tmp/pymux.sock -t work
 """
 from __future__ import unicode_literals, absolute_import
 
-from pymux.main import Pymux
-from pymux.client import Client, list_clients
+from pymux.client import Client, list_clients, list_servers
 from pymux.utils import daemonize
 
+# Note: Don't import `pymux.main` (or anything else that is only used by the
+#       server) at the top of this file. When this is only a client, like
+#       "pymux attach" or "pymux send-keys ...", importing the server takes
+#       most of the startup time.
+
 import docopt
 import getpass
 import logging
@@ -43,11 +65,14 @@ __all__ = (
 
 def run():
     a = docopt.docopt(__doc__)
-    socket_name = a['<socket>'] or os.environ.get('PYMUX')
-    socket_name_from_env = not a['<socket>'] and os.environ.get('PYMUX')
-    filename = a['<file>']
+    socket_name = a['-S'] or os.environ.get('PYMUX')
+    socket_name_from_env = not a['-S'] and os.environ.get('PYMUX')
+    filename = a['-f']
     command = a['<command>']
     true_color = a['--truecolor']
+    predict_echo = a['--predict']
+    compress = a['--compress']
+    client_render = a['--client-render']
     ansi_colors_only = a['--ansicolor'] or \
         bool(os.environ.get('PROMPT_TOOLKIT_ANSI_COLORS_ONLY', False))
 
@@ -70,19 +95,22 @@ def run():
     if filename:
         filename = os.path.abspath(os.path.expanduser(filename))
 
-    # Create 'Pymux'.
-    mux = Pymux(source_file=filename, startup_command=command)
+    def create_pymux():
+        """ Create 'Pymux'. (Only when we are going to run a server.) """
+        from pymux.main import Pymux
+        return Pymux(source_file=filename, startup_command=command)
 
     # Setup logging.
-    if a['<logfile>']:
-        logging.basicConfig(filename=a['<logfile>'], level=logging.DEBUG)
+    if a['--log']:
+        logging.basicConfig(filename=a['--log'], level=logging.DEBUG)
 
     if a['standalone']:
+        mux = create_pymux()
         mux.run_standalone(true_color=true_color, ansi_colors_only=ansi_colors_only)
 
     elif a['list-sessions'] or a['<command>'] in ('ls', 'list-sessions'):
-        for c in list_clients():
-            print(c.socket_name)
+        for info in list_servers():
+            print('%s: %s' % (info.socket_name, ', '.join(info.sessions)))
 
     elif a['start-server']:
         if socket_name_from_env:
@@ -92,8 +120,14 @@ def run():
         # Log to stdout.
         logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 
-        # Run server.
-        socket_name = mux.listen_on_socket()
+        from pymux.upgrade import is_upgrading, complete_upgrade
+        mux = create_pymux()
+
+        # Run server. (Or take over from the server that we replace.)
+        if is_upgrading():
+            complete_upgrade(mux)
+        else:
+            socket_name = mux.listen_on_socket(socket_name)
         try:
             mux.run_server()
         except KeyboardInterrupt:
@@ -110,34 +144,80 @@ def run():
             Client(socket_name).attach(
                 detach_other_clients=detach_other_clients,
                 true_color=true_color,
-                ansi_colors_only=ansi_colors_only)
+                ansi_colors_only=ansi_colors_only,
+                session=a['-t'],
+                predict_echo=predict_echo,
+                compress=compress,
+                client_render=client_render)
         else:
             # Connect to the first server.
             for c in list_clients():
                 c.attach(detach_other_clients=detach_other_clients,
                          true_color=true_color,
-                         ansi_colors_only=ansi_colors_only)
+                         ansi_colors_only=ansi_colors_only,
+                         session=a['-t'],
+                         predict_echo=predict_echo,
+                         compress=compress,
+                         client_render=client_render)
                 break
             else:  # Nobreak.
                 print('No pymux instance found.')
                 sys.exit(1)
 
+    elif a['control']:
+        # Connect to the given server, or to the first server.
+        clients = [Client(socket_name)] if socket_name else list_clients()
+
+        for c in clients:
+            c.control(session=a['-t'])
+            break
+        else:  # Nobreak.
+            print('No pymux instance found.')
+            sys.exit(1)
+
+    elif a['batch']:
+        if not socket_name:
+            print('No pymux instance found.')
+            sys.exit(1)
+
+        commands = [line for line in sys.stdin.read().splitlines() if line.strip()]
+        _run_commands(Client(socket_name), commands, pane_id)
+
+    elif a['new-session']:
+        if socket_name_from_env:
+            _socket_from_env_warning()
+            sys.exit(1)
+
+        new_session = {'name': a['-s'], 'command': command}
+
+        # Create the session in the given server, or in the first server.
+        # (When the given socket does not exist, start a server there.)
+        if socket_name:
+            clients = [Client(socket_name)] if os.path.exists(socket_name) else []
+        else:
+            clients = list_clients()
+
+        for c in clients:
+            c.attach(true_color=true_color,
+                     ansi_colors_only=ansi_colors_only,
+                     new_session=new_session,
+                     predict_echo=predict_echo,
+                     compress=compress,
+                     client_render=client_render)
+            break
+        else:  # Nobreak.
+            # No server running. Start one; the first session gets this name.
+            _run_client_and_server(create_pymux(), true_color, ansi_colors_only,
+                                   predict_echo, client_render, compress=compress,
+                                   session_name=a['-s'], socket_name=socket_name)
+
     elif a['<command>'] and socket_name:
-        Client(socket_name).run_command(a['<command>'], pane_id)
+        # (Prints the output, like the JSON of "list-panes -F json".)
+        _run_commands(Client(socket_name), [a['<command>']], pane_id)
 
     elif not socket_name:
-        # Run client/server combination.
-        socket_name = mux.listen_on_socket(socket_name)
-        pid = daemonize()
-
-        if pid > 0:
-            # Create window. It is important that this happens in the daemon,
-            # because the parent of the process running inside should be this
-            # daemon. (Otherwise the `waitpid` call won't work.)
-            mux.run_server()
-        else:
-            Client(socket_name).attach(
-                true_color=true_color, ansi_colors_only=ansi_colors_only)
+        _run_client_and_server(create_pymux(), true_color, ansi_colors_only, predict_echo,
+                               client_render, compress=compress)
 
     else:
         if socket_name_from_env:
@@ -148,6 +228,62 @@ def run():
             sys.exit(1)
 
 
+def _run_client_and_server(mux, true_color, ansi_colors_only, predict_echo,
+                           client_render, compress=False, session_name=None,
+                           socket_name=None):
+    """
+    Run client/server combination.
+
+    :param compress: Ask the server to compress the output.
+    :param session_name: Name for the first session. (By default, the name is
+        taken from the socket name.)
+    :param socket_name: Socket to listen on. (By default, a new one in the
+        temp directory.)
+    """
+    socket_name = mux.listen_on_socket(socket_name)
+
+    if session_name:
+        mux.session_name = session_name
+
+    pid = daemonize()
+
+    if pid > 0:
+        # Create window. It is important that this happens in the daemon,
+        # because the parent of the process running inside should be this
+        # daemon. (Otherwise the `waitpid` call won't work.)
+        mux.run_server()
+    else:
+        Client(socket_name).attach(
+            true_color=true_color, ansi_colors_only=ansi_colors_only,
+            predict_echo=predict_echo, compress=compress,
+            client_render=client_render)
+
+
+def _run_commands(client, commands, pane_id):
+    """
+    Execute these commands in the server. Print their output and errors, and
+    exit with an error code when a command failed.
+    """
+    results = client.run_commands(commands, pane_id)
+
+    if results is None:
+        print('Connection closed.')
+        sys.exit(1)
+
+    failed = False
+    for command, result in zip(commands, results):
+        sys.stdout.write(result['output'])
+
+        if result['message']:
+            print('%s: %s' % (command, result['message']))
+
+        if not result['ok']:
+            failed = True
+
+    if failed:
+        sys.exit(1)
+
+
 def _socket_from_env_warning():
     print('Please be careful nesting pymux sessions.')
     print('Unset PYMUX environment variable first.')
@@ -6,6 +6,8 @@ import datetime
 import socket
 import six
 
+from .monitor import format_cpu, format_size
+
 __all__ = (
     'format_pymux_string',
 )
@@ -57,11 +59,17 @@ def format_pymux_string(pymux, cli, string, window=None, pane=None):
             return z + ' '
 
     def name_of_session():
-        return pymux.session_name
+        return arrangement.get_active_session(cli).name
 
     def title_of_pane():
         return pane.process.screen.title
 
+    def cpu_of_pane():
+        return format_cpu(pymux.resource_monitor.get_stats(pane)[0])
+
+    def memory_of_pane():
+        return format_size(pymux.resource_monitor.get_stats(pane)[1])
+
     def hostname():
         return socket.gethostname()
 
@@ -69,9 +77,11 @@ def format_pymux_string(pymux, cli, string, window=None, pane=None):
         return '#'
 
     format_table = {
+        '#C': cpu_of_pane,
         '#D': id_of_pane,
         '#F': window_flags,
         '#I': index_of_window,
+        '#M': memory_of_pane,
         '#P': index_of_pane,
         '#S': name_of_session,
         '#T': title_of_pane,
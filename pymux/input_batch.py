@@ -0,0 +1,63 @@
+"""
+Writing the typed keys to the panes in batches.
+
+The client sends the keys that are typed in chunks, and prompt_toolkit calls
+the key binding for every key. Instead of writing each key to the pseudo
+terminal right away, the key bindings queue them (see `Process.queue_key`),
+and the queued keys are written once the event loop is done with the input.
+So, each pane gets one write for all the keys that were received at once.
+With 'synchronize-panes', the text is only encoded once for all the panes.
+
+Other writes to a process (pasting, "send-keys") first write the keys that
+are queued for it, so the order never changes.
+"""
+from __future__ import unicode_literals
+
+__all__ = (
+    'InputBatch',
+)
+
+
+class InputBatch(object):
+    """
+    Queue typed keys for processes, and write them in one go.
+
+    :param eventloop: Prompt_toolkit eventloop.
+    """
+    def __init__(self, eventloop):
+        self.eventloop = eventloop
+        self._processes = []  # Processes with queued keys.
+        self._flush_scheduled = False
+
+    def write_key(self, processes, key):
+        """
+        Send a prompt_toolkit Key to these processes.
+        """
+        for process in processes:
+            if not process.queued_keys:
+                self._processes.append(process)
+            process.queue_key(key)
+
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.eventloop.call_from_executor(self.flush)
+
+    def flush(self):
+        " Write all the queued keys. "
+        self._flush_scheduled = False
+
+        processes = self._processes
+        self._processes = []
+
+        encoded = {}  # Maps text to bytes. (Synchronized panes get the same.)
+
+        for process in processes:
+            text = process.take_queued_keys()
+
+            if text:
+                try:
+                    data = encoded[text]
+                except KeyError:
+                    data = encoded[text] = text.encode('utf-8')
+
+                process.write_bytes(data)
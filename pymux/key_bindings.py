@@ -13,7 +13,7 @@ from prompt_toolkit.selection import SelectionType
 from .enums import COMMAND, PROMPT
 from .filters import WaitsForConfirmation, HasPrefix, InScrollBuffer, InScrollBufferNotSearching, InScrollBufferSearching
 from .key_mappings import pymux_key_to_prompt_toolkit_key_sequence
-from .commands.commands import call_command_handler
+from .commands.commands import call_command_handler, parse_command, CommandException
 
 import six
 
@@ -61,6 +61,16 @@ class KeyBindingsManager(object):
         # { (needs_prefix, key) -> (command, handler) }
         self.custom_bindings = {}
 
+        # Filters for the custom key bindings, for when they need the prefix
+        # or not. (All the bindings share these. Creating the filter for
+        # every binding is slow, because prompt_toolkit inspects the
+        # signature of each new filter.)
+        not_typing = ~(WaitsForConfirmation(pymux) | HasFocus(COMMAND) | HasFocus(PROMPT))
+        self._custom_binding_filters = {
+            True: HasPrefix(pymux) & not_typing,
+            False: ~HasPrefix(pymux) & not_typing,
+        }
+
     def _load_prefix_binding(self):
         """
         Load the prefix key binding.
@@ -113,6 +123,9 @@ class KeyBindingsManager(object):
                                waits_for_confirmation | display_pane_numbers |
                                InScrollBuffer(pymux))
 
+        # (Used for the predictive local echo of the clients.)
+        self.pane_input_allowed = pane_input_allowed
+
         @registry.add_binding(Keys.Any, filter=pane_input_allowed, invalidate_ui=False)
         def _(event):
             """
@@ -133,10 +146,11 @@ class KeyBindingsManager(object):
                 pymux.invalidate()
             else:
                 # Write input to pane. If 'synchronize_panes' is on, write
-                # input to all panes in the current window.
+                # input to all panes in the current window. (The keys are
+                # collected, and written together.)
                 panes = w.panes if w.synchronize_panes else [pane]
-                for p in panes:
-                    p.process.write_key(event.key_sequence[0].key)
+                pymux.input_batch.write_key([p.process for p in panes],
+                                            event.key_sequence[0].key)
 
         @registry.add_binding(Keys.BracketedPaste, filter=pane_input_allowed, invalidate_ui=False)
         def _(event):
@@ -151,7 +165,9 @@ class KeyBindingsManager(object):
                 # input to all panes in the current window.
                 panes = w.panes if w.synchronize_panes else [pane]
                 for p in panes:
-                    p.process.write_input(event.data, paste=True)
+                    if not p.process.write_input(event.data, paste=True):
+                        pymux.show_message(event.cli, 'Input queue of pane is full.')
+                        pymux.invalidate()
 
         @registry.add_binding(Keys.Any, filter=has_prefix)
         def _(event):
@@ -249,17 +265,20 @@ class KeyBindingsManager(object):
         keys_sequence = pymux_key_to_prompt_toolkit_key_sequence(key_name)
 
         # Create handler and add to Registry.
-        if needs_prefix:
-            filter = HasPrefix(self.pymux)
-        else:
-            filter = ~HasPrefix(self.pymux)
+        filter = self._custom_binding_filters[needs_prefix]
 
-        filter = filter & ~(WaitsForConfirmation(self.pymux) |
-                            HasFocus(COMMAND) | HasFocus(PROMPT))
+        # Parse the arguments once, instead of every time that the key is
+        # pressed. (When they are invalid, the error is displayed when the
+        # key is pressed, like before.)
+        try:
+            execute = parse_command(command, arguments)
+        except CommandException:
+            def execute(pymux, cli):
+                call_command_handler(command, pymux, cli, arguments)
 
         def key_handler(event):
             " The actual key handler. "
-            call_command_handler(command, self.pymux, event.cli, arguments)
+            execute(self.pymux, event.cli)
             self.pymux.get_client_state(event.cli).has_prefix = False
 
         self.registry.add_binding(*keys_sequence, filter=filter)(key_handler)
@@ -39,36 +39,37 @@ def pymux_key_to_prompt_toolkit_key_sequence(key):
 
 
 # Create a mapping from prompt_toolkit keys to their ANSI sequences.
-# TODO: This is not completely correct yet. It doesn't take
-#       cursor/application mode into account. Create new tables for this.
 _PROMPT_TOOLKIT_KEY_TO_VT100 = dict(
     (key, vt100_data) for vt100_data, key in ANSI_SEQUENCES.items())
 
+_PROMPT_TOOLKIT_KEY_TO_VT100.update({
+    # Required for redis-cli. This can be removed when prompt_toolkit stops
+    # replacing \r by \n.
+    Keys.ControlJ: '\r',
+    '\n': '\r',
+})
+
+# The tables for the normal and the application cursor mode. (Maps
+# `application_mode` to the table.)
+_VT100_KEYS = {
+    False: _PROMPT_TOOLKIT_KEY_TO_VT100,
+    True: dict(_PROMPT_TOOLKIT_KEY_TO_VT100),
+}
+
+_VT100_KEYS[True].update({
+    Keys.Up: '\x1bOA',
+    Keys.Left: '\x1bOD',
+    Keys.Right: '\x1bOC',
+    Keys.Down: '\x1bOB',
+})
+
 
 def prompt_toolkit_key_to_vt100_key(key, application_mode=False):
     """
     Turn a prompt toolkit key. (E.g Keys.ControlB) into a Vt100 key sequence.
     (E.g. \x1b[A.)
     """
-    application_mode_keys = {
-        Keys.Up: '\x1bOA',
-        Keys.Left: '\x1bOD',
-        Keys.Right: '\x1bOC',
-        Keys.Down: '\x1bOB',
-    }
-
-    if key == Keys.ControlJ:
-        # Required for redis-cli. This can be removed when prompt_toolkit stops
-        # replacing \r by \n.
-        return '\r'
-
-    if key == '\n':
-        return '\r'
-
-    elif application_mode and key in application_mode_keys:
-        return application_mode_keys.get(key)
-    else:
-        return _PROMPT_TOOLKIT_KEY_TO_VT100.get(key, key)
+    return _VT100_KEYS[bool(application_mode)].get(key, key)
 
 
 PYMUX_TO_PROMPT_TOOLKIT_KEYS = {
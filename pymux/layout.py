@@ -321,7 +321,7 @@ class LayoutManager(object):
         result = []
 
         # Display panes.
-        for i, w in enumerate(self.pymux.arrangement.windows):
+        for i, w in enumerate(self.pymux.arrangement.get_active_session(cli).windows):
             if i > 0:
                 result.append((Token.StatusBar, ' '))
 
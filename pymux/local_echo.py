@@ -0,0 +1,133 @@
+"""
+Predictive local echo for the client. (Like mosh does.)
+
+When attached over a slow connection, every key press needs a round trip to
+the server before the typed character appears. With local echo, the client
+displays printable characters right away, underlined, at the position of
+the cursor. When the server output arrives, the predictions are erased and
+the server output is written. The server tells us where the cursor of the
+active pane is now (an 'echo-state' packet); the characters before that
+position are confirmed, the others are displayed again.
+
+The server only allows predictions when the cursor is at the end of a line
+in a pane that echoes the input and is not in a full screen application.
+We stop predicting as soon as a key is typed that we don't understand (like
+Enter, or an arrow key), until the server sends a new state.
+
+Note: this module is used by the client, so it should only import from the
+standard library.
+"""
+from __future__ import unicode_literals
+
+import unicodedata
+
+__all__ = (
+    'LocalEcho',
+)
+
+
+class LocalEcho(object):
+    """
+    Keep track of the predicted characters.
+
+    The methods return the text that has to be written to the terminal.
+    """
+    def __init__(self):
+        self._state = None  # Latest 'echo-state' packet from the server.
+        self._blocked = False  # Don't predict until the next state.
+
+        self._pending = ''  # Predicted characters that were not confirmed.
+        self._pending_x = 0  # Column in the pane of the first pending character.
+        self._pending_y = 0
+        self._displayed = 0  # Number of pending characters on the terminal.
+
+    def predict(self, text):
+        """
+        Called with the input that is sent to the server.
+        """
+        result = []
+
+        for c in text:
+            if not self._can_predict():
+                break
+
+            if c == '\x7f' and self._pending:
+                # Backspace. Remove our own prediction.
+                self._pending = self._pending[:-1]
+                self._displayed -= 1
+                result.append('\b \b')
+
+            elif _is_printable(c) and len(self._pending) < self._room:
+                if not self._pending:
+                    self._pending_x = self._state['x']
+                    self._pending_y = self._state['y']
+
+                self._pending += c
+                self._displayed += 1
+                result.append('\x1b[4m%s\x1b[24m' % c)
+
+            else:
+                self._blocked = True
+
+        return ''.join(result)
+
+    def undo(self):
+        """
+        Called before writing server output: erase the displayed predictions,
+        and move the cursor back to where the server left it.
+        """
+        n = self._displayed
+        self._displayed = 0
+
+        if n:
+            return '\x1b[%iD%s\x1b[%iD' % (n, ' ' * n, n)
+        return ''
+
+    def update(self, state):
+        """
+        Called with an 'echo-state' packet, after the server output has been
+        written. Drop the confirmed predictions, and display the others again.
+        """
+        erase = self.undo()  # (Normally done already, by the output.)
+
+        self._state = state
+        self._blocked = False
+
+        if self._pending:
+            confirmed = state['x'] - self._pending_x
+
+            if (state['predict'] and state['y'] == self._pending_y and
+                    0 <= confirmed <= len(self._pending)):
+                self._pending = self._pending[confirmed:]
+                self._pending_x = state['x']
+            else:
+                # The output doesn't look like what we expected.
+                self._pending = ''
+
+        if self._pending and state['predict'] and len(self._pending) <= state['room']:
+            self._displayed = len(self._pending)
+            return erase + '\x1b[4m%s\x1b[24m' % self._pending
+        else:
+            self._pending = ''
+            return erase
+
+    @property
+    def _room(self):
+        return self._state['room'] if self._state else 0
+
+    def _can_predict(self):
+        # (When the pending characters have been erased, we have to wait for
+        # the new state before we know where to display them.)
+        return bool(self._state and self._state['predict'] and not self._blocked and
+                    self._displayed == len(self._pending))
+
+
+def _is_printable(c):
+    """
+    True for characters that move the cursor exactly one column to the right.
+    (Control characters, combining characters and double width characters
+    are not predicted.)
+    """
+    return (c >= ' ' and c != '\x7f' and
+            unicodedata.category(c)[0] not in 'CM' and
+            unicodedata.east_asian_width(c) not in 'WF')
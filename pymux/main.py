@@ -15,16 +15,24 @@ from prompt_toolkit.layout.screen import Size
 from prompt_toolkit.terminal.vt100_output import Vt100_Output, _get_size
 
 from .arrangement import Arrangement, Pane, Window
-from .commands.commands import handle_command, call_command_handler
+from .client_render import RowCache
+from .control import ControlEvents
+from .commands.commands import handle_command, call_command_handler, compile_commands, execute_commands
 from .commands.completer import create_command_completer
 from .enums import COMMAND, PROMPT
+from .input_batch import InputBatch
 from .key_bindings import KeyBindingsManager
 from .layout import LayoutManager, Justify
 from .log import logger
+from .monitor import ResourceMonitor
 from .options import ALL_OPTIONS, ALL_WINDOW_OPTIONS
+from .pool import ShellPool
 from .process import Process
 from .rc import STARTUP_COMMANDS
+from .registry import ServerRegistry
+from .render_groups import RenderGroups
 from .server import ServerConnection, bind_socket
+from .snapshot import SnapshotManager
 from .style import PymuxStyle
 from .utils import get_default_shell
 
@@ -67,6 +75,11 @@ class ClientState(object):
         self.prompt_text = None
         self.prompt_command = None
 
+        # When a list, the text that commands display is appended to this
+        # list, instead of being displayed in the active pane. (For clients
+        # in control mode.)
+        self.command_output = None
+
 
 class Pymux(object):
     """
@@ -99,6 +112,9 @@ class Pymux(object):
         self.mode_keys_vi_mode = False
         self.history_limit = 2000
         self.status_interval = 4
+        self.monitor_interval = 2
+        self.pipe_pane_buffer_limit = 1024  # KB.
+        self.pipe_pane_overflow = 'drop'
         self.default_terminal = 'xterm-256color'
         self.status_left = '[#S] '
         self.status_left_length = 20
@@ -106,9 +122,14 @@ class Pymux(object):
         self.status_right_length = 20
         self.window_status_current_format = '#I:#W#F'
         self.window_status_format = '#I:#W#F'
-        self.session_name = '0'
+        self.session_name = '0'  # Name of the first session.
         self.status_justify = Justify.LEFT
         self.default_shell = get_default_shell()
+        self.shell_pool_size = 0
+        self.session_save_interval = 0  # Seconds. Zero means disabled.
+        self.compression_level = 6
+        self.compression_threshold = 256  # Bytes.
+        self.client_backlog_limit = 4096  # KB.
 
         self.options = ALL_OPTIONS
         self.window_options = ALL_WINDOW_OPTIONS
@@ -123,8 +144,22 @@ class Pymux(object):
         self.connections = []
         self.clis = {}  # Mapping from Connection to CommandLineInterface.
 
+        # Clients that display the same output share the render.
+        self.render_groups = RenderGroups(self)
+
+        # Events for the clients in control mode.
+        self.control_events = ControlEvents(self)
+
+        # (See `postpone_invalidate`.)
+        self._postpone_invalidate = 0
+        self._invalidate_pending = False
+
         self._startup_done = False
         self.source_file = source_file
+
+        #: True when this server took over the panes of a previous server
+        #: process. (See `upgrade-server`.)
+        self.upgraded = False
         self.startup_command = startup_command
 
         # Keep track of all the panes, by ID. (For quick lookup.)
@@ -134,14 +169,32 @@ class Pymux(object):
         self.socket = None
         self.socket_name = None
 
+        # Registry of the running servers. (Used by the clients to find us.)
+        self.registry = ServerRegistry()
+
         # Create eventloop.
         self.eventloop = PosixEventLoop()
 
+        # Writes the typed keys to the panes.
+        self.input_batch = InputBatch(self.eventloop)
+
         # Key bindings manager.
         self.key_bindings_manager = KeyBindingsManager(self)
 
+        # Pre-spawned shells. (Filled when 'shell-pool-size' is set.)
+        self.shell_pool = ShellPool(self)
+
+        # CPU and memory usage of the panes.
+        self.resource_monitor = ResourceMonitor(self)
+
+        # Saving and restoring of session snapshots.
+        self.snapshots = SnapshotManager(self)
+
         self.style = PymuxStyle()
 
+        # Encoded pane content, for clients that render themselves.
+        self.row_cache = RowCache(self.style)
+
     def _start_auto_refresh_thread(self):
         """
         Start the background thread that auto refreshes all clients according to
@@ -188,12 +241,18 @@ class Pymux(object):
         Get the size to be used for the DynamicBody.
         This will be the smallest size of all clients.
         """
+        return self.get_window_size_for_window(self.arrangement.get_active_window(cli))
+
+    def get_window_size_for_window(self, window):
+        """
+        The size of this window: the smallest size of all the clients that
+        display it.
+        """
         get_active_window = self.arrangement.get_active_window
-        active_window = get_active_window(cli)
 
         # Get connections watching the same window.
         connections = [c for c in self.connections if
-                       c.cli and get_active_window(c.cli) == active_window]
+                       c.cli and get_active_window(c.cli) == window]
 
         rows = [c.size.rows for c in connections]
         columns = [c.size.columns for c in connections]
@@ -217,40 +276,52 @@ class Pymux(object):
         :param window: If a window is given, take the CWD of the current
             process of that window as the start path for this pane.
         :param command: If given, run this command instead of `self.default_shell`.
+            (Text, or a list of arguments.)
         :param start_directory: If given, use this as the CWD.
         """
         assert window is None or isinstance(window, Window)
-        assert command is None or isinstance(command, six.text_type)
+        assert command is None or isinstance(command, (six.text_type, list))
         assert start_directory is None or isinstance(start_directory, six.text_type)
 
-        def done_callback():
-            " When the process finishes. "
-            if not self.remain_on_exit:
-                # Remove pane from layout.
-                self.arrangement.remove_pane(pane)
-
-                # No panes left? -> Quit.
-                if not self.arrangement.has_panes:
-                    self.eventloop.stop()
-
-            self.invalidate()
-
-        def bell():
-            " Sound bell on all clients. "
-            if self.enable_bell:
-                for c in self.clis.values():
-                    c.output.bell()
-
         # Start directory.
         if start_directory:
             path = start_directory
         elif window and window.active_process:
             # When the path of the active process is known,
             # start the new process at the same location.
-            path = window.active_process.get_cwd()
+            path = window.active_process.get_cwd(refresh=True)
         else:
             path = None
 
+        # Adopt a pre-spawned shell, when we need the default shell.
+        pane = None
+        if not command:
+            pane = self.shell_pool.take(path or self.original_cwd)
+
+        if pane is None:
+            if not command:
+                command = [self.default_shell]
+            elif isinstance(command, six.text_type):
+                command = command.split()
+
+            pane = self._spawn_pane(command, path)
+
+        # Keep track of panes. This is a WeakKeyDictionary, we only add, but
+        # don't remove.
+        self.panes_by_id[pane.pane_id] = pane
+
+        return pane
+
+    def _spawn_pane(self, command, path):
+        """
+        Start a process and return a :class:`pymux.arrangement.Pane` for it.
+        (Used by `_create_pane` and the shell pool.)
+
+        :param command: List of arguments.
+        :param path: The CWD for the process, or `None`.
+        """
+        assert isinstance(command, list)
+
         def before_exec():
             " Called in the process fork (in the child process). "
             # Go to this directory.
@@ -267,37 +338,101 @@ class Pymux(object):
                 os.environ['PYMUX'] = '%s,%i' % (
                     self.socket_name, pane.pane_id)
 
-        if command:
-            command = command.split()
-        else:
-            command = [self.default_shell]
+        def create_process(**kw):
+            return Process.from_command(
+                self.eventloop, self.invalidate, command,
+                before_exec_func=before_exec, **kw)
+
+        pane = self._create_pane_for_process(create_process)
+
+        logger.info('Created process %r.', command)
+        pane.process.start()
+
+        return pane
+
+    def adopt_pane(self, master, pid, width, height):
+        """
+        Create a :class:`pymux.arrangement.Pane` for a process that is
+        running already. (After `upgrade-server`.)
+
+        :param master: Master side of the pseudo terminal of the process.
+        """
+        def create_process(**kw):
+            return Process(self.eventloop, self.invalidate,
+                           exec_func=lambda: None, master=master, **kw)
+
+        pane = self._create_pane_for_process(create_process)
+
+        logger.info('Adopted process %r.', pid)
+        pane.process.adopt(pid, width, height)
+
+        return pane
+
+    def _create_pane_for_process(self, create_process):
+        """
+        Create the `Process` by calling `create_process` with the callbacks
+        that connect it to pymux, and wrap it in a `Pane`.
+        """
+        def done_callback():
+            " When the process finishes. "
+            if pane.pane_id not in self.panes_by_id:
+                # This is a shell from the pool that was never adopted.
+                self.shell_pool.remove(pane)
+                return
+
+            if not self.remain_on_exit:
+                # Remove pane from layout.
+                self.arrangement.remove_pane(pane)
+
+                # No panes left? -> Quit.
+                if not self.arrangement.has_panes:
+                    self.eventloop.stop()
+
+            self.invalidate()
+
+        def bell():
+            " Sound bell on all clients. "
+            if self.enable_bell:
+                for c in self.clis.values():
+                    c.output.bell()
 
-        # Create process and pane.
         def has_priority():
             return self.arrangement.pane_has_priority(pane)
 
-        process = Process.from_command(
-            self.eventloop, self.invalidate, command, done_callback,
+        def output(data):
+            " Copy the output to the control mode clients. "
+            if self.control_events.subscribers and pane.pane_id in self.panes_by_id:
+                self.control_events.pane_output(pane, data)
+
+        process = create_process(
+            done_callback=done_callback,
             bell_func=bell,
-            before_exec_func=before_exec,
-            has_priority=has_priority)
+            has_priority=has_priority,
+            output_func=output)
 
         pane = Pane(process)
-
-        # Keep track of panes. This is a WeakKeyDictionary, we only add, but
-        # don't remove.
-        self.panes_by_id[pane.pane_id] = pane
-
-        logger.info('Created process %r.', command)
-        process.start()
-
         return pane
 
     def invalidate(self):
         " Invalidate the UI for all clients. "
+        if self._postpone_invalidate:
+            self._invalidate_pending = True
+            return
+
+        self.render_groups.discard_frames()
+        self.row_cache.clear()
+        self.control_events.arrangement_changed()
+
         for c in self.clis.values():
             c.invalidate()
 
+    def postpone_invalidate(self):
+        """
+        Context manager that postpones the invalidation of the UI until the
+        end of the block. (Then, we invalidate only once.)
+        """
+        return _PostponeInvalidate(self)
+
     def create_window(self, cli=None, command=None, start_directory=None, name=None):
         """
         Create a new :class:`pymux.arrangement.Window` in the arrangement.
@@ -310,9 +445,41 @@ class Pymux(object):
 
         pane = self._create_pane(None, command, start_directory=start_directory)
 
+        # The first window also creates the first session.
+        if not self.arrangement.sessions:
+            self.arrangement.create_session(self.session_name)
+
         self.arrangement.create_window(cli, pane, name=name)
         self.invalidate()
 
+    def new_session(self, cli, name=None, command=None, set_active=True):
+        """
+        Create a new :class:`pymux.arrangement.Session` with one window.
+        Returns the session.
+
+        :param cli: When `set_active` is True, attach this client to the new
+            session.
+        :param name: Name for the session. By default, the first available
+            number.
+        """
+        assert name is None or isinstance(name, six.text_type)
+        assert command is None or isinstance(command, six.text_type)
+
+        if name is None:
+            i = 0
+            while self.arrangement.get_session_by_name('%i' % i):
+                i += 1
+            name = '%i' % i
+
+        session = self.arrangement.create_session(name)
+
+        pane = self._create_pane(None, command)
+        self.arrangement.create_window(
+            cli, pane, set_active=set_active, session=session)
+        self.invalidate()
+
+        return session
+
     def add_process(self, cli, command=None, vsplit=False, start_directory=None):
         """
         Add a new process to the current window. (vsplit/hsplit).
@@ -359,8 +526,39 @@ class Pymux(object):
     def handle_command(self, cli, command):
         """
         Handle command from the command line.
+        Returns False when the command failed.
         """
-        handle_command(self, cli, command)
+        return handle_command(self, cli, command)
+
+    def run_commands(self, cli, commands):
+        """
+        Execute a list of commands for this client, and invalidate the UI
+        once, at the end. Returns a list with a dictionary for each command,
+        containing 'ok' (False when the command failed), 'message' (the
+        message that it displayed) and 'output' (the text that it displayed).
+        """
+        client_state = self.get_client_state(cli)
+        results = []
+
+        with self.postpone_invalidate():
+            for command in commands:
+                client_state.message = None
+                client_state.command_output = []
+
+                try:
+                    ok = self.handle_command(cli, command)
+                finally:
+                    output = ''.join(client_state.command_output)
+                    client_state.command_output = None
+
+                results.append({
+                    'ok': ok,
+                    'message': client_state.message,
+                    'output': output,
+                })
+                client_state.message = None
+
+        return results
 
     def show_message(self, cli, message):
         """
@@ -372,9 +570,29 @@ class Pymux(object):
         """
         self.get_client_state(cli).message = message
 
-    def create_cli(self, connection, output, input=None):
+    def display_text(self, cli, text, title=''):
+        """
+        Display the output of a command in the active pane of this client.
+        (Or return it to the client, in control mode.)
+        """
+        client_state = self.get_client_state(cli)
+
+        if client_state.command_output is not None:
+            client_state.command_output.append(text)
+        else:
+            self.arrangement.get_active_pane(cli).display_text(text, title=title)
+            self.invalidate()
+
+    def create_cli(self, connection, output, input=None, client_renderer=None,
+                   render=True):
         """
         Create `CommandLineInterface` instance for this connection.
+
+        :param client_renderer: `ClientRenderer` for clients that render
+            themselves.
+        :param render: When False, the CLI is only used for executing
+            commands. (For control mode and batches of commands.) It's never
+            rendered.
         """
         def get_title():
             return self.get_title(cli)
@@ -393,14 +611,16 @@ class Pymux(object):
         application = Application(
             layout=self.layout_manager.layout,
             key_bindings_registry=self.key_bindings_manager.registry,
-            buffers=_BufferMapping(self),
+            buffers=_BufferMapping(self, get_cli=lambda: cli),
             mouse_support=Condition(lambda cli: self.enable_mouse_support),
             use_alternate_screen=True,
             style=self.style,
             get_title=get_title,
             on_invalidate=(lambda cli: self.invalidate()))
 
-        cli = CommandLineInterface(
+        cli = _CommandLineInterface(
+            self,
+            client_renderer=client_renderer,
             application=application,
             output=output,
             input=input,
@@ -434,30 +654,45 @@ class Pymux(object):
             self.get_client_state(cli).message = None
         cli.input_processor.beforeKeyPress += key_pressed
 
-        cli._is_running = True
+        # Invalidate only once, after the start-up commands.
+        with self.postpone_invalidate():
+            if render:
+                cli._is_running = True
 
-        self.clis[connection] = cli
+                self.clis[connection] = cli
 
-        # Redraw all CLIs. (Adding a new client could mean that the others
-        # change size, so everything has to be redrawn.)
-        self.invalidate()
+                # Redraw all CLIs. (Adding a new client could mean that the
+                # others change size, so everything has to be redrawn.)
+                self.invalidate()
 
-        # Handle start-up comands.
-        # (Does initial key bindings.)
-        if not self._startup_done:
-            self._startup_done = True
+            # Handle start-up comands.
+            # (Does initial key bindings.)
+            if not self._startup_done:
+                self._startup_done = True
+                self._run_startup_commands(cli)
 
-            # Execute default config.
-            for cmd in STARTUP_COMMANDS.splitlines():
-                self.handle_command(cli, cmd)
+        return cli
 
-            # Source the given file.
-            if self.source_file:
-                call_command_handler('source-file', self, cli, [self.source_file])
+    def _run_startup_commands(self, cli):
+        """
+        Execute the default config and the configuration file, and create the
+        first window.
+        """
+        # Execute default config.
+        execute_commands(self, cli, compile_commands(STARTUP_COMMANDS), source='(defaults)')
 
-            # Make sure that there is one window created.
+        # Source the given file.
+        if self.source_file:
+            call_command_handler('source-file', self, cli, [self.source_file])
+
+        # Make sure that there is one window created. (After an upgrade,
+        # the windows exist already.)
+        if not self.upgraded:
             self.create_window(cli, command=self.startup_command)
 
+        # Start filling the shell pool, now that the first window exists.
+        self.shell_pool.refill()
+
         return cli
 
     def get_connection_for_cli(self, cli):
@@ -481,18 +716,26 @@ class Pymux(object):
         # Redraw all clients -> Maybe their size has to change.
         self.invalidate()
 
-    def listen_on_socket(self, socket_name=None):
+    def listen_on_socket(self, socket_name=None, sock=None):
         """
         Listen for clients on a Unix socket.
         Returns the socket name.
+
+        :param sock: A socket that is listening on `socket_name` already.
+            (After `upgrade-server`.)
         """
         if self.socket is None:
-            # Py2 uses 0027 and Py3 uses 0o027, but both know
-            # how to create the right value from the string '0027'.
-            old_umask = os.umask(int('0027', 8))
-            self.socket_name, self.socket = bind_socket(socket_name)
-            _ = os.umask(old_umask)
-            self.socket.listen(0)
+            if sock is None:
+                # Py2 uses 0027 and Py3 uses 0o027, but both know
+                # how to create the right value from the string '0027'.
+                old_umask = os.umask(int('0027', 8))
+                taken = [s.socket_name for s in self.registry.list_servers()]
+                self.socket_name, self.socket = bind_socket(socket_name, taken)
+                _ = os.umask(old_umask)
+                self.socket.listen(0)
+            else:
+                self.socket_name, self.socket = socket_name, sock
+
             self.eventloop.add_reader(self.socket.fileno(), self._socket_accept)
 
         # Set session_name according to socket name.
@@ -502,6 +745,10 @@ class Pymux(object):
         logger.info('Listening on %r.' % self.socket_name)
         return self.socket_name
 
+    def _get_session_names(self):
+        " The names of the sessions. (For the registry.) "
+        return [s.name for s in self.arrangement.sessions] or [self.session_name]
+
     def _socket_accept(self):
         """
         Accept connection from client.
@@ -524,8 +771,19 @@ class Pymux(object):
 
         signal.signal(signal.SIGINT, handle_sigint)
 
+        # Register this server, so that clients can find it. (Only here, in
+        # the process that runs the server, after daemonizing, and after the
+        # session name was set.)
+        try:
+            self.registry.register(self.socket_name, self._get_session_names())
+        except (OSError, IOError) as e:
+            logger.warning('Could not write server registry: %s', e)
+
         # Start background threads.
         self._start_auto_refresh_thread()
+        self.snapshots.start_autosave_thread()
+        self.registry.start_heartbeat_thread(
+            lambda: self.socket_name, self._get_session_names)
 
         # Run eventloop.
 
@@ -551,6 +809,11 @@ class Pymux(object):
             # Clean up socket.
             os.remove(self.socket_name)
 
+            try:
+                self.registry.unregister(self.socket_name)
+            except (OSError, IOError):
+                pass
+
     def run_standalone(self, true_color=False, ansi_colors_only=False):
         """
         Run pymux standalone, rather than using a client/server architecture.
@@ -566,11 +829,54 @@ class Pymux(object):
         cli.run()
 
 
+class _CommandLineInterface(CommandLineInterface):
+    """
+    `CommandLineInterface` that can reuse the output that was rendered for
+    another client, or that lets the client render. (See
+    `pymux.render_groups` and `pymux.client_render`.)
+    """
+    def __init__(self, pymux, client_renderer=None, **kw):
+        super(_CommandLineInterface, self).__init__(**kw)
+        self.pymux = pymux
+        self.client_renderer = client_renderer
+
+    def _redraw(self):
+        # Only draw when no sub application was started.
+        if self._is_running and self._sub_cli is None:
+            def render():
+                self.pymux.render_groups.redraw(
+                    self, super(_CommandLineInterface, self)._redraw)
+
+            if self.client_renderer:
+                self.client_renderer.redraw(self, render)
+            else:
+                render()
+
+
+class _PostponeInvalidate(object):
+    """
+    Context manager for `Pymux.postpone_invalidate`.
+    """
+    def __init__(self, pymux):
+        self.pymux = pymux
+
+    def __enter__(self):
+        self.pymux._postpone_invalidate += 1
+
+    def __exit__(self, *a):
+        pymux = self.pymux
+        pymux._postpone_invalidate -= 1
+
+        if not pymux._postpone_invalidate and pymux._invalidate_pending:
+            pymux._invalidate_pending = False
+            pymux.invalidate()
+
+
 class _BufferMapping(BufferMapping):
     """
     Container for all the Buffer objects in a CommandLineInterface.
     """
-    def __init__(self, pymux):
+    def __init__(self, pymux, get_cli=None):
         self.pymux = pymux
 
         def _handle_command(cli, buffer):
@@ -597,7 +903,7 @@ class _BufferMapping(BufferMapping):
         super(_BufferMapping, self).__init__({
             COMMAND: Buffer(
                 complete_while_typing=True,
-                completer=create_command_completer(pymux),
+                completer=create_command_completer(pymux, get_cli=get_cli),
                 accept_action=AcceptAction(handler=_handle_command),
                 auto_suggest=AutoSuggestFromHistory(),
             ),
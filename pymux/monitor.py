@@ -0,0 +1,154 @@
+"""
+CPU and memory usage of the processes running in the panes.
+"""
+from __future__ import unicode_literals
+from collections import defaultdict
+
+from .process import get_process_stats, process_children_supported
+
+import os
+import resource
+import time
+
+__all__ = (
+    'ResourceMonitor',
+    'format_cpu',
+    'format_size',
+)
+
+try:
+    _CLOCK_TICKS = os.sysconf(str('SC_CLK_TCK'))
+except (AttributeError, ValueError, OSError):
+    _CLOCK_TICKS = 100
+
+_PAGE_SIZE = resource.getpagesize()
+
+
+class ResourceMonitor(object):
+    """
+    Sample the CPU and memory usage of the process tree of each pane.
+
+    Sampling is lazy: all the panes are sampled together, but only when
+    somebody asks for the numbers (the '#C' and '#M' format variables, or
+    `list-panes`), and at most once every `pymux.monitor_interval` seconds.
+    When nothing displays them, nothing is sampled.
+
+    Only the process trees of the panes are read, when the kernel lists the
+    children of each process. Otherwise, we have to read every process in
+    /proc. Then that happens in the executor, and the numbers are one sample
+    behind.
+    """
+    def __init__(self, pymux):
+        self.pymux = pymux
+        self._walk_trees = process_children_supported()
+
+        self._sample_time = None
+        self._sampling = False  # Scanning /proc in the executor.
+        self._ticks = {}  # Maps pane_id to CPU ticks at the last sample.
+        self._stats = {}  # Maps pane_id to (cpu_percent, rss_bytes).
+
+    def get_stats(self, pane):
+        """
+        Return a (cpu_percent, rss_bytes) tuple for this pane. Both values
+        can be `None` when unknown. (CPU usage is only known after the second
+        sample.)
+        """
+        now = time.time()
+
+        if self._sample_time is None or \
+                now - self._sample_time >= self.pymux.monitor_interval:
+            self._sample(now)
+
+        return self._stats.get(pane.pane_id, (None, None))
+
+    def _sample(self, now):
+        " Sample all panes at once. "
+        if self._walk_trees:
+            pids = [pane.process.pid for pane in self.pymux.panes_by_id.values()
+                    if pane.process.pid]
+            self._update(now, get_process_stats(pids))
+
+        elif not self._sampling:
+            self._sampling = True
+
+            def scan():
+                all_stats = get_process_stats()
+                scan_time = time.time()
+
+                def done():
+                    self._sampling = False
+                    self._update(scan_time, all_stats)
+                self.pymux.eventloop.call_from_executor(done)
+
+            self.pymux.eventloop.run_in_executor(scan)
+
+    def _update(self, now, all_stats):
+        " Calculate the usage of each pane from the stats of the processes. "
+        # Build the process tree.
+        children = defaultdict(list)
+        for pid, (ppid, _, _) in all_stats.items():
+            children[ppid].append(pid)
+
+        elapsed = now - self._sample_time if self._sample_time else None
+        ticks_for_panes = {}
+        stats = {}
+
+        for pane in list(self.pymux.panes_by_id.values()):
+            process = pane.process
+
+            if not process.pid or process.is_terminated or \
+                    process.pid not in all_stats:
+                continue
+
+            # Sum over the process and all its descendants.
+            ticks = rss = 0
+            todo = [process.pid]
+
+            while todo:
+                pid = todo.pop()
+                _, t, r = all_stats[pid]
+                ticks += t
+                rss += r
+                todo.extend(children[pid])
+
+            # CPU usage since the previous sample. (When a child terminates,
+            # its ticks disappear from the sum, so never go below zero.)
+            previous_ticks = self._ticks.get(pane.pane_id)
+
+            if elapsed and previous_ticks is not None:
+                cpu = max(0., 100. * (ticks - previous_ticks) / _CLOCK_TICKS / elapsed)
+            else:
+                cpu = None
+
+            ticks_for_panes[pane.pane_id] = ticks
+            stats[pane.pane_id] = (cpu, rss * _PAGE_SIZE)
+
+        self._sample_time = now
+        self._ticks = ticks_for_panes
+        self._stats = stats
+
+
+def format_cpu(cpu):
+    " Format CPU percentage. "
+    if cpu is None:
+        return '-'
+    else:
+        return '%.1f%%' % cpu
+
+
+def format_size(size):
+    " Format amount of bytes in a human readable way. E.g. '12.3M'. "
+    if size is None:
+        return '-'
+
+    for unit in ('B', 'K', 'M', 'G'):
+        if size < 1024:
+            break
+        size /= 1024.
+    else:
+        unit = 'T'
+
+    if unit == 'B':
+        return '%i%s' % (size, unit)
+    else:
+        return '%.1f%s' % (size, unit)
@@ -86,10 +86,13 @@ class StringOption(Option):
 class PositiveIntOption(Option):
     """
     Positive integer option, the attribute is set as a Pymux attribute.
+
+    :param minimum: The smallest value that is accepted.
     """
-    def __init__(self, attribute_name, possible_values=None):
+    def __init__(self, attribute_name, possible_values=None, minimum=0):
         self.attribute_name = attribute_name
         self.possible_values = ['%s' % i for i in (possible_values or [])]
+        self.minimum = minimum
 
     def get_all_values(self, pymux):
         return sorted(set(
@@ -104,14 +107,43 @@ class PositiveIntOption(Option):
         """
         try:
             value = int(value)
-            if value < 0:
+            if value < self.minimum:
                 raise ValueError
         except ValueError:
+            if self.minimum:
+                raise SetOptionError('Expecting an integer of at least %i.' % self.minimum)
             raise SetOptionError('Expecting an integer.')
         else:
             setattr(pymux, self.attribute_name, value)
 
 
+class ShellPoolSizeOption(PositiveIntOption):
+    """
+    Number of pre-spawned shells. The pool is resized right away.
+    """
+    def __init__(self):
+        super(ShellPoolSizeOption, self).__init__('shell_pool_size', [0, 1, 2, 4])
+
+    def set_value(self, pymux, cli, value):
+        super(ShellPoolSizeOption, self).set_value(pymux, cli, value)
+        pymux.shell_pool.refill()
+
+
+class CompressionLevelOption(PositiveIntOption):
+    """
+    zlib compression level for the clients that use compression. (Applies
+    to the clients that attach after changing it.)
+    """
+    def __init__(self):
+        super(CompressionLevelOption, self).__init__('compression_level', [1, 6, 9])
+
+    def set_value(self, pymux, cli, value):
+        if value not in ['%s' % i for i in range(1, 10)]:
+            raise SetOptionError('Expecting a number from 1 to 9.')
+
+        super(CompressionLevelOption, self).set_value(pymux, cli, value)
+
+
 class KeyPrefixOption(Option):
     def get_all_values(self, pymux):
         return PYMUX_TO_PROMPT_TOOLKIT_KEYS.keys()
@@ -154,6 +186,24 @@ class KeysOption(Option):
         else:
             raise SetOptionError('Expecting "vi" or "emacs".')
 
+class ChoiceOption(Option):
+    """
+    Option that accepts one value from a fixed list.
+    """
+    def __init__(self, attribute_name, choices):
+        self.attribute_name = attribute_name
+        self.choices = choices
+
+    def get_all_values(self, pymux):
+        return self.choices
+
+    def set_value(self, pymux, cli, value):
+        if value in self.choices:
+            setattr(pymux, self.attribute_name, value)
+        else:
+            raise SetOptionError('Expecting one of: %s.' % ', '.join(self.choices))
+
+
 class JustifyOption(Option):
     def __init__(self, attribute_name):
         self.attribute_name = attribute_name
@@ -171,11 +221,24 @@ class JustifyOption(Option):
 ALL_OPTIONS = {
     'base-index': BaseIndexOption(),
     'bell': OnOffOption('enable_bell'),
+    'client-backlog-limit': PositiveIntOption(
+        'client_backlog_limit', [1024, 4096, 16384]),
+    'compression-level': CompressionLevelOption(),
+    'compression-threshold': PositiveIntOption(
+        'compression_threshold', [0, 256, 1024]),
     'history-limit': PositiveIntOption(
         'history_limit', [200, 500, 1000, 2000, 5000, 10000]),
+    'monitor-interval': PositiveIntOption(
+        'monitor_interval', [1, 2, 5, 10], minimum=1),
     'mouse': OnOffOption('enable_mouse_support'),
+    'pipe-pane-buffer-limit': PositiveIntOption(
+        'pipe_pane_buffer_limit', [64, 256, 1024, 4096]),
+    'pipe-pane-overflow': ChoiceOption('pipe_pane_overflow', ['drop', 'block']),
     'prefix': KeyPrefixOption(),
     'remain-on-exit': OnOffOption('remain_on_exit'),
+    'session-save-interval': PositiveIntOption(
+        'session_save_interval', [0, 30, 60, 300]),
+    'shell-pool-size': ShellPoolSizeOption(),
     'status': OnOffOption('enable_status'),
     'pane-border-status': OnOffOption('enable_pane_status'),
     'status-keys': KeysOption('status_keys_vi_mode'),
@@ -0,0 +1,193 @@
+"""
+Copy the output of a pane to a file or to the input of a shell command.
+(For the "pipe-pane" command.)
+"""
+from __future__ import unicode_literals
+
+from .log import logger
+from .write_queue import WriteQueue
+
+import os
+import subprocess
+import time
+import zlib
+
+__all__ = (
+    'PanePipe',
+)
+
+
+class PanePipe(object):
+    """
+    Receives the output of a pane and writes it, in batches, to a file or to
+    the stdin of a shell command.
+
+    Output is collected and written when the event loop has time for it, or
+    at most half a second later. That way, a pane producing a lot of output
+    results in a few big writes, rather than one write for each read.
+
+    :param eventloop: Prompt_toolkit eventloop.
+    :param command: Shell command that receives the output on its stdin.
+    :param filename: File to which the output is appended. (Either `command`
+        or `filename` has to be given.)
+    :param append: When False, truncate the file instead of appending.
+    :param compress: When True, write gzip compressed data.
+    :param max_buffer_size: Maximum amount of bytes waiting to be written.
+    :param block: What to do when the buffer is full. When False, output is
+        dropped. When True, `write` returns False, and the caller is expected
+        to stop reading from the process until `on_drained` is called.
+    """
+    def __init__(self, eventloop, command=None, filename=None, append=True,
+                 compress=False, max_buffer_size=1024 * 1024, block=False):
+        assert bool(command) != bool(filename)
+        assert isinstance(max_buffer_size, int)
+
+        self.eventloop = eventloop
+        self.max_buffer_size = max_buffer_size
+        self.block = block
+
+        #: Called when all the buffered output has been written.
+        self.on_drained = lambda: None
+
+        #: Number of bytes that were dropped because the buffer was full.
+        self.dropped = 0
+
+        self.closed = False
+
+        if command:
+            with open(os.devnull, 'wb') as devnull:
+                self._popen = subprocess.Popen(
+                    command, shell=True, stdin=subprocess.PIPE,
+                    stdout=devnull, stderr=devnull, close_fds=True)
+            fd = self._popen.stdin.fileno()
+        else:
+            self._popen = None
+            flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if append else os.O_TRUNC)
+            fd = os.open(filename, flags, int('0644', 8))
+
+        self._fd = fd
+
+        if compress:
+            # 16 + MAX_WBITS: write a gzip header.
+            self._compressor = zlib.compressobj(
+                zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        else:
+            self._compressor = None
+
+        # Output that has not been passed to the write queue yet.
+        self._batch = []
+        self._batch_size = 0
+        self._flush_scheduled = False
+
+        # (The pipe itself enforces `max_buffer_size`. The write queue gets
+        # some extra room for the data that it accepts in 'block' mode.)
+        self._write_queue = WriteQueue(
+            eventloop, fd, max_buffer_size * 2 + 64 * 1024,
+            on_drained=self._drained, on_error=self._error)
+
+    @property
+    def buffer_size(self):
+        " Amount of bytes that still have to be written. "
+        return self._batch_size + self._write_queue.size
+
+    def write(self, data):
+        """
+        Add output of the pane.
+
+        :returns: False when the buffer is full and the caller should stop
+            reading. (Only in 'block' mode.)
+        """
+        if self.closed:
+            return True
+
+        full = self.buffer_size + len(data) > self.max_buffer_size
+
+        if full and not self.block:
+            self._drop(len(data))
+            return True
+
+        self._batch.append(data)
+        self._batch_size += len(data)
+
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+
+            # Process this when the event loop is idle, or at most half a
+            # second later.
+            self.eventloop.call_from_executor(
+                self._flush_batch, _max_postpone_until=time.time() + .5)
+
+        return not full
+
+    def _flush_batch(self):
+        " Pass the collected output to the write queue. "
+        self._flush_scheduled = False
+
+        if self.closed or not self._batch:
+            return
+
+        data = b''.join(self._batch)
+        self._batch = []
+        self._batch_size = 0
+
+        if self._compressor:
+            # Sync flush, so that the file can be decompressed while we're
+            # still writing.
+            data = self._compressor.compress(data) + \
+                self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        if not self._write_queue.write(data):
+            self._drop(len(data))
+
+    def _drop(self, size):
+        " Count output that was dropped, because the buffer was full. "
+        if not self.dropped:
+            logger.warning('pipe-pane: buffer full, dropping output.')
+
+        self.dropped += size
+
+    def _drained(self):
+        if self.closed:
+            self._close_fd()
+        else:
+            self.on_drained()
+
+    def _error(self, e):
+        logger.warning('Error in pipe-pane: %s. Closing pipe.', e)
+        self.closed = True
+        self._close_fd()
+
+    def close(self):
+        """
+        Stop receiving output. What's still buffered will be written first,
+        then the file or the stdin of the command is closed.
+        """
+        if not self.closed:
+            self._flush_batch()
+
+            if self._compressor:
+                data = self._compressor.flush()
+                if not self._write_queue.write(data):
+                    self._drop(len(data))
+
+            if self.dropped:
+                logger.warning('pipe-pane: %i bytes of output were dropped.', self.dropped)
+
+            self.closed = True
+
+            if self._write_queue.size == 0:
+                self._close_fd()
+
+    def _close_fd(self):
+        if self._fd is not None:
+            self._write_queue.close()
+
+            if self._popen:
+                self._popen.stdin.close()
+
+                # Don't leave a zombie process.
+                self.eventloop.run_in_executor(self._popen.wait)
+            else:
+                os.close(self._fd)
+
+            self._fd = None
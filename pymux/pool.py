@@ -0,0 +1,146 @@
+"""
+Pool of pre-spawned shells.
+
+Starting a new pane means forking, executing the shell and waiting for the
+shell to read its rc files. With heavy shell configurations, that can take a
+noticeable amount of time. The pool keeps a number of default shells running
+in the background, parked on their own pseudo terminal, so that
+`new-window` and `split-window` can adopt one of them immediately.
+"""
+from __future__ import unicode_literals
+from six.moves import shlex_quote
+
+from .log import logger
+
+import os
+import signal
+import time
+
+__all__ = (
+    'ShellPool',
+)
+
+
+class _PoolEntry(object):
+    """
+    Record for storing a single pre-spawned shell.
+
+    :param key: The (shell, terminal) tuple with which this shell was started.
+        When one of these options changes, the entry becomes unusable.
+    :param cwd: The directory in which the shell was started.
+    """
+    def __init__(self, key, cwd, pane):
+        self.key = key
+        self.cwd = cwd
+        self.pane = pane
+
+
+class ShellPool(object):
+    """
+    Keeps `pymux.shell_pool_size` default shells ready for adoption.
+
+    The shells are started in the event loop, one at a time, with low
+    priority. (Spawning a process blocks the event loop for a short while, so
+    we don't want to spawn several of them while a client is typing.)
+    """
+    def __init__(self, pymux):
+        self.pymux = pymux
+        self._entries = []
+        self._refill_scheduled = False
+
+    def __contains__(self, pane):
+        return any(e.pane == pane for e in self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def panes(self):
+        " The panes of the shells in the pool. "
+        return [e.pane for e in self._entries]
+
+    def _get_key(self):
+        return (self.pymux.default_shell, self.pymux.default_terminal)
+
+    def take(self, path):
+        """
+        Take a pre-spawned shell out of the pool and return its
+        :class:`pymux.arrangement.Pane`. Return `None` when no shell is
+        available.
+
+        :param path: The directory where the shell is expected to run. If the
+            shell was started somewhere else, a `cd` is sent to it.
+        """
+        key = self._get_key()
+        result = None
+
+        while self._entries and result is None:
+            entry = self._entries.pop(0)
+
+            if entry.key == key and not entry.pane.process.is_terminated:
+                result = entry
+            else:
+                # Started with an old 'default-shell' or 'default-terminal'.
+                self._kill(entry)
+
+        # Start a new shell in the background to replace this one.
+        self.refill()
+
+        if result is not None:
+            pane = result.pane
+            if path and os.path.realpath(path) != os.path.realpath(result.cwd):
+                # The leading space keeps the command out of the shell history
+                # for most shell configurations.
+                pane.process.write_input(' cd %s && clear\r' % shlex_quote(path))
+
+            logger.info('Adopted pre-spawned shell for pane %s.', pane.pane_id)
+            return pane
+
+    def remove(self, pane):
+        """
+        Remove a pane from the pool. (Called when the shell terminates before
+        it was adopted.)
+        """
+        self._entries = [e for e in self._entries if e.pane != pane]
+
+    def clear(self):
+        " Terminate all the shells in the pool. "
+        entries, self._entries = self._entries, []
+        for e in entries:
+            self._kill(e)
+
+    def refill(self):
+        """
+        Bring the pool to the configured size. Missing shells are started in
+        the background, superfluous shells are terminated right away.
+        """
+        size = self.pymux.shell_pool_size
+
+        while len(self._entries) > size:
+            self._kill(self._entries.pop())
+
+        if len(self._entries) < size and not self._refill_scheduled:
+            self._refill_scheduled = True
+
+            def spawn_next():
+                self._refill_scheduled = False
+
+                if len(self._entries) < self.pymux.shell_pool_size:
+                    self._spawn()
+                    self.refill()
+
+            # Process this when the event loop is idle, or at most one second
+            # later. (Like the output of panes that don't have the focus.)
+            self.pymux.eventloop.call_from_executor(
+                spawn_next, _max_postpone_until=time.time() + 1)
+
+    def _spawn(self):
+        " Start one default shell and add it to the pool. "
+        key = self._get_key()
+        cwd = self.pymux.original_cwd
+
+        pane = self.pymux._spawn_pane([self.pymux.default_shell], cwd)
+        self._entries.append(_PoolEntry(key, cwd, pane))
+
+    def _kill(self, entry):
+        entry.pane.process.send_signal(signal.SIGHUP)
@@ -12,11 +12,15 @@ from .key_mappings import prompt_toolkit_key_to_vt100_key
 from .screen import BetterScreen
 from .stream import BetterStream
 from .utils import set_terminal_size, pty_make_controlling_tty
+from .write_queue import WriteQueue
 
+import fcntl
 import os
 import resource
+import select
 import signal
 import sys
+import termios
 import time
 import traceback
 
@@ -24,6 +28,16 @@ __all__ = (
     'Process',
 )
 
+# When output was received, the process name and CWD are refreshed at most
+# once per `_INFO_MIN_AGE` seconds. Without output, they are refreshed every
+# `_INFO_MAX_AGE` seconds.
+_INFO_MIN_AGE = .1
+_INFO_MAX_AGE = 2
+
+# Maximum amount of bytes that can be queued for writing to a process. When a
+# process doesn't read its input, we don't want to keep on buffering.
+_MAX_WRITE_QUEUE_SIZE = 16 * 1024 * 1024
+
 
 class Process(object):
     """
@@ -44,17 +58,23 @@ class Process(object):
     :param exec_func: Callable that is called in the child process. (Usualy,
         this calls execv.)
     :param bell_func: Called when the process does a `bell`.
+    :param output_func: Called with all the output of the process. (Text.)
     :param done_callback: Called when the process terminates.
     :param has_priority: Callable that returns True when this Process should
         get priority in the event loop. (When this pane has the focus.)
         Otherwise output can be delayed.
+    :param master: Master side of the pseudo terminal of a process that is
+        running already. (See `adopt`.) By default, a new pseudo terminal is
+        created.
     """
     def __init__(self, eventloop, invalidate, exec_func, bell_func=None,
-                 done_callback=None, has_priority=None):
+                 done_callback=None, has_priority=None, master=None, output_func=None):
         assert isinstance(eventloop, EventLoop)
         assert callable(invalidate)
         assert callable(exec_func)
+        assert master is None or isinstance(master, int)
         assert bell_func is None or callable(bell_func)
+        assert output_func is None or callable(output_func)
         assert done_callback is None or callable(done_callback)
         assert has_priority is None or callable(has_priority)
 
@@ -63,14 +83,47 @@ class Process(object):
         self.exec_func = exec_func
         self.done_callback = done_callback
         self.has_priority = has_priority or (lambda: True)
+        self.output_func = output_func
 
         self.pid = None
+        self.command = None  # Argument list, when created with `from_command`.
         self.is_terminated = False
         self.suspended = False
         self._reader_connected = False
 
+        # Cached process information: (foreground pgrp, name, cwd).
+        # This is read for every title bar and status bar entry on every
+        # render, so we don't want to go to /proc each time.
+        self._info = (None, None, None)
+        self._info_time = 0
+        self._info_outdated = True
+
+        # Incremented every time the screen content changes. (This allows
+        # session snapshots to skip panes that didn't change.)
+        self.content_version = 0
+
+        # When set, a `PanePipe` that receives a copy of all output.
+        self.pipe = None
+
+        # The pipe and/or recorder that are full. While not empty, we don't
+        # read from the process.
+        self._blocked_sinks = set()
+
+        # When set, an `AsciicastRecorder` for this process.
+        self.recorder = None
+
         # Create pseudo terminal for this pane.
-        self.master, self.slave = os.openpty()
+        if master is None:
+            self.master, self.slave = os.openpty()
+        else:
+            self.master, self.slave = master, None
+
+        # Input that still has to be written to the pseudo terminal.
+        self._write_queue = WriteQueue(eventloop, self.master, _MAX_WRITE_QUEUE_SIZE)
+
+        # Typed keys (text) that are not yet in the write queue. (See
+        # `pymux.input_batch`.)
+        self.queued_keys = []
 
         # Master side -> attached to terminal emulator.
         self._reader = PosixStdinReader(self.master, errors='replace')
@@ -95,9 +148,24 @@ class Process(object):
         self._connect_reader()
         self._waitpid()
 
+    def adopt(self, pid, width, height):
+        """
+        Take over a process that is running already on the pseudo terminal
+        that was passed as `master`. It has to be our child. (This is the case
+        after `upgrade-server`, which replaces the server process image, but
+        keeps its PID.)
+        """
+        assert isinstance(pid, int)
+
+        self.pid = pid
+        self.set_size(width, height)
+        self._connect_reader()
+        self._waitpid()
+
     @classmethod
     def from_command(cls, eventloop, invalidate, command, done_callback,
-                     bell_func=None, before_exec_func=None, has_priority=None):
+                     bell_func=None, before_exec_func=None, has_priority=None,
+                     output_func=None):
         """
         Create Process from command,
         e.g. command=['python', '-c', 'print("test")']
@@ -115,29 +183,44 @@ class Process(object):
                 if os.path.exists(path) and os.access(path, os.X_OK):
                     os.execv(path, command)
 
-        return cls(eventloop, invalidate, execv,
-                   bell_func=bell_func, done_callback=done_callback,
-                   has_priority=has_priority)
+        process = cls(eventloop, invalidate, execv,
+                      bell_func=bell_func, done_callback=done_callback,
+                      has_priority=has_priority, output_func=output_func)
+        process.command = command
+        return process
 
     def _start(self):
         """
         Create fork and start the child process.
         """
+        # The child closes the write end of this pipe when it calls `exec`.
+        # (Both ends are closed on exec.)
+        exec_read, exec_write = os.pipe()
+        _set_close_on_exec(exec_read)
+        _set_close_on_exec(exec_write)
+
         pid = os.fork()
 
         if pid == 0:
-            self._in_child()
+            os.close(exec_read)
+            self._in_child(exec_write)
         elif pid > 0:
             # In parent.
             os.close(self.slave)
+            os.close(exec_write)
             self.slave = None
 
-            # We wait a very short while, to be sure the child had the time to
-            # call _exec. (Otherwise, we are still sharing signal handlers and
-            # FDs.) Resizing the pty, when the child is still in our Python
-            # code and has the signal handler from prompt_toolkit, but closed
-            # the 'fd' for 'call_from_executor', will cause OSError.
-            time.sleep(0.1)
+            # We wait until the child called _exec. (Otherwise, we are still
+            # sharing signal handlers and FDs.) Resizing the pty, when the
+            # child is still in our Python code and has the signal handler
+            # from prompt_toolkit, but closed the 'fd' for
+            # 'call_from_executor', will cause OSError.
+            # (Don't wait longer than 0.1 second, in case exec fails.)
+            try:
+                select.select([exec_read], [], [], 0.1)
+            except (select.error, OSError):
+                pass  # Interrupted by a signal.
+            os.close(exec_read)
 
             self.pid = pid
 
@@ -156,6 +239,9 @@ class Process(object):
             os.close(self.master)
             self._remove_reader()
             self.master = None
+            self._write_queue.close()
+            self.set_pipe(None)
+            self.set_recorder(None)
 
             # Callback.
             self.is_terminated = True
@@ -173,6 +259,10 @@ class Process(object):
         if self.master is not None:
             if (self.sx, self.sy) != (width, height):
                 set_terminal_size(self.master, height, width)
+
+                if self.recorder is not None:
+                    self.recorder.record_resize(width, height)
+                self.content_version += 1
         self.screen.resize(lines=height, columns=width)
 
         self.screen.lines = height
@@ -181,8 +271,12 @@ class Process(object):
         self.sx = width
         self.sy = height
 
-    def _in_child(self):
-        " Will be executed in the forked child. "
+    def _in_child(self, exec_fd):
+        """
+        Will be executed in the forked child.
+
+        :param exec_fd: File descriptor that should stay open until `exec`.
+        """
         os.close(self.master)
 
         # Remove signal handler for SIGWINCH as early as possible.
@@ -199,7 +293,7 @@ class Process(object):
 
         # Execute in child.
         try:
-            self._close_file_descriptors()
+            self._close_file_descriptors(keep=exec_fd)
             self.exec_func()
         except Exception:
             traceback.print_exc()
@@ -208,21 +302,22 @@ class Process(object):
             os._exit(1)
         os._exit(0)
 
-    def _close_file_descriptors(self):
+    def _close_file_descriptors(self, keep):
         # Do not allow child to inherit open file descriptors from parent.
         # (In case that we keep running Python code. We shouldn't close them.
         # because the garbage collector is still active, and he will close them
-        # eventually.)
+        # eventually.) `keep` is closed by `exec`.
         max_fd = resource.getrlimit(resource.RLIMIT_NOFILE)[-1]
 
+        os.closerange(3, keep)
         try:
-            os.closerange(3, max_fd)
+            os.closerange(keep + 1, max_fd)
         except OverflowError:
             # On OS X, max_fd can return very big values, than closerange
             # doesn't understand, e.g. 9223372036854775807. In this case, just
             # use 4096. This is what Linux systems report, and should be
             # sufficient. (I hope...)
-            os.closerange(3, 4096)
+            os.closerange(keep + 1, 4096)
 
     def write_input(self, data, paste=False):
         """
@@ -231,23 +326,49 @@ class Process(object):
         :param data: (text, not bytes.) The input.
         :param paste: When True, and the process running here understands
             bracketed paste. Send as pasted text.
+        :returns: False when the input was refused because the write queue is
+            full. (See `write_bytes`.)
         """
         # send as bracketed paste?
         if paste and self.screen.bracketed_paste_enabled:
             data = '\x1b[200~' + data + '\x1b[201~'
 
-        self.write_bytes(data.encode('utf-8'))
+        return self.write_bytes(data.encode('utf-8'))
 
     def write_bytes(self, data):
-        while self.master is not None:
-            try:
-                os.write(self.master, data)
-            except OSError as e:
-                # This happens when the window resizes and a SIGWINCH was received.
-                # We get 'Error: [Errno 4] Interrupted system call'
-                if e.errno == 4:
-                    continue
-            return
+        """
+        Queue data for writing to the pseudo terminal.
+
+        Nothing in here blocks. As much as possible is written right away, the
+        remainder is written when the pseudo terminal becomes writable again.
+        This way, a big paste, or a process that doesn't read its input, will
+        not freeze the event loop.
+
+        :returns: False when the data was refused because it doesn't fit in
+            the write queue anymore. (Nothing was queued in that case.)
+        """
+        # Keep the order: the keys that were typed before this come first.
+        if self.queued_keys:
+            self.write_queued_keys()
+
+        if self.recorder is not None:
+            self.recorder.record_input(data)
+
+        return self._write_queue.write(data)
+
+    def take_queued_keys(self):
+        """
+        Return the text of the typed keys that were queued by `queue_key`,
+        and clear the queue.
+        """
+        text = ''.join(self.queued_keys)
+        self.queued_keys = []
+        return text
+
+    def write_queued_keys(self):
+        " Write the queued keys to the pseudo terminal. "
+        if self.queued_keys:
+            self.write_bytes(self.take_queued_keys().encode('utf-8'))
 
     def write_key(self, key):
         """
@@ -255,7 +376,15 @@ class Process(object):
         """
         data = prompt_toolkit_key_to_vt100_key(
             key, application_mode=self.screen.in_application_mode)
-        self.write_input(data)
+        return self.write_input(data)
+
+    def queue_key(self, key):
+        """
+        Translate this prompt_toolkit Key, and queue it. The queued keys are
+        written by the next `write_bytes` call, or by `write_queued_keys`.
+        """
+        self.queued_keys.append(prompt_toolkit_key_to_vt100_key(
+            key, application_mode=self.screen.in_application_mode))
 
     def _remove_reader(self):
         """
@@ -281,8 +410,23 @@ class Process(object):
                                      # this could block the event loop.)
 
         if not self._reader.closed:
+            # Copy output to the pipe and recorder. (For "pipe-pane" and
+            # "record-pane".) When one of them is full, stop reading until it
+            # has been drained.
+            if self.pipe is not None and not self.pipe.write(d.encode('utf-8')):
+                self._blocked_sinks.add(self.pipe)
+            if self.recorder is not None and not self.recorder.record_output(d):
+                self._blocked_sinks.add(self.recorder)
+            if self._blocked_sinks:
+                self._remove_reader()
+
+            if self.output_func is not None:
+                self.output_func(d)
+
             def process():
                 self.stream.feed(d)
+                self.content_version += 1
+                self._info_outdated = True
                 self.invalidate()
 
             # Feed directly, if this process has priority. (That is when this
@@ -297,7 +441,7 @@ class Process(object):
                 def do_asap():
                     " Process output and reconnect to event loop. "
                     process()
-                    if not self.suspended:
+                    if not self.suspended and not self._blocked_sinks:
                         self._connect_reader()
 
                 # When the event loop is saturated because of CPU, we will
@@ -327,23 +471,114 @@ class Process(object):
         Resume from 'suspend'.
         """
         if self.suspended and self.master is not None:
-            self._connect_reader()
+            if not self._blocked_sinks:
+                self._connect_reader()
             self.suspended = False
 
-    def get_cwd(self):
+    def set_pipe(self, pipe):
+        """
+        Send a copy of all output to this `PanePipe`. (Or stop when `None` is
+        given.) A previous pipe is closed.
+        """
+        if self.pipe is not None:
+            self.pipe.close()
+            self._sink_drained(self.pipe)
+
+        self.pipe = pipe
+
+        if pipe is not None:
+            pipe.on_drained = lambda: self._sink_drained(pipe)
+
+    def set_recorder(self, recorder):
+        """
+        Record input/output with this `AsciicastRecorder`. (Or stop when
+        `None` is given.) A previous recorder is closed.
+        """
+        if self.recorder is not None:
+            self.recorder.close()
+            self._sink_drained(self.recorder)
+
+        self.recorder = recorder
+
+        if recorder is not None:
+            recorder.on_drained = lambda: self._sink_drained(recorder)
+
+    def _sink_drained(self, sink):
+        """
+        Called when the pipe or recorder was drained (or closed). Continue
+        reading when none of them is full anymore.
+        """
+        if sink in self._blocked_sinks:
+            self._blocked_sinks.remove(sink)
+
+            if not self._blocked_sinks and not self.suspended:
+                self._connect_reader()
+
+    def _get_info(self, refresh=False):
+        """
+        Return the cached (pgrp, name, cwd) tuple. Refresh it when it's
+        outdated.
+
+        The foreground process group changes when a job starts or finishes.
+        That comes with output, so after receiving output, we check the
+        process group again. The name is only read again when the process
+        group actually changed. (Or when the cached value is older than
+        `_INFO_MAX_AGE`, in case the process did an `exec`.)
+        """
+        now = time.time()
+        age = now - self._info_time
+
+        if refresh or age > _INFO_MAX_AGE or (
+                self._info_outdated and age > _INFO_MIN_AGE):
+            old_pgrp, name, cwd = self._info
+
+            if self.master is not None:
+                pgrp = get_pgrp_for_fd(self.master)
+
+                if pgrp != old_pgrp or age > _INFO_MAX_AGE:
+                    name = get_name_for_pgrp(pgrp) if pgrp else None
+            else:
+                pgrp = name = None
+
+            cwd = get_cwd_for_pid(self.pid)
+
+            self._info = (pgrp, name, cwd)
+            self._info_time = now
+            self._info_outdated = False
+
+        return self._info
+
+    def get_cwd(self, refresh=False):
         """
         The current working directory for this process. (Or `None` when
         unknown.)
+
+        :param refresh: When True, don't return a cached value.
         """
-        return get_cwd_for_pid(self.pid)
+        return self._get_info(refresh=refresh)[2]
 
     def get_name(self):
         """
         The name for this process. (Or `None` when unknown.)
         """
-        # TODO: Maybe cache for short time.
-        if self.master is not None:
-            return get_name_for_fd(self.master)
+        return self._get_info()[1]
+
+    def echoes_input(self):
+        """
+        False when the characters that are typed are not displayed, like at a
+        password prompt. (The terminal is in canonical mode, with echo turned
+        off.) In non-canonical mode, we assume that the application echoes
+        the input itself, like readline does.
+        """
+        if self.master is None:
+            return False
+
+        try:
+            lflag = termios.tcgetattr(self.master)[3]
+        except termios.error:
+            return False
+
+        return bool(lflag & termios.ECHO) or not (lflag & termios.ICANON)
 
     def send_signal(self, signal):
         " Send signal to running process. "
@@ -420,6 +655,11 @@ class Process(object):
                             col=self.screen.pt_screen.cursor_position.x)), get_tokens_for_line
 
 
+def _set_close_on_exec(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+
 def get_cwd_for_pid(pid):
     """
     Return the current working directory for a given process ID.
@@ -431,17 +671,128 @@ def get_cwd_for_pid(pid):
             pass
 
 
+def process_children_supported():
+    """
+    True when the kernel lists the children of each thread in
+    /proc/<pid>/task/<tid>/children. (Linux, with CONFIG_PROC_CHILDREN.)
+    """
+    return os.path.exists('/proc/%i/task/%i/children' % (os.getpid(), os.getpid()))
+
+
+def _read_process_stat(pid):
+    """
+    Return a (ppid, cpu_ticks, rss_pages) tuple for this process, or `None`
+    when it terminated.
+    """
+    try:
+        with open('/proc/%s/stat' % pid, 'rb') as f:
+            data = f.read()
+    except IOError:
+        return None
+
+    # The second field is the command name between parentheses, which can
+    # contain spaces. Split after the last parenthesis.
+    fields = data.rpartition(b')')[2].split()
+    try:
+        return (
+            int(fields[1]),  # ppid.
+            int(fields[11]) + int(fields[12]),  # utime + stime.
+            int(fields[21]))  # rss.
+    except (IndexError, ValueError):
+        return None
+
+
+def _get_children(pid):
+    " Return the process IDs of the children of all threads of this process. "
+    result = []
+
+    try:
+        tids = os.listdir('/proc/%s/task' % pid)
+    except OSError:
+        return result
+
+    for tid in tids:
+        try:
+            with open('/proc/%s/task/%s/children' % (pid, tid), 'rb') as f:
+                result.extend(int(c) for c in f.read().split())
+        except (IOError, ValueError):
+            pass
+
+    return result
+
+
+def get_process_stats(pids=None):
+    """
+    Return a dictionary that maps process IDs to a (ppid, cpu_ticks,
+    rss_pages) tuple. `cpu_ticks` is the user plus system time, in clock
+    ticks.
+
+    :param pids: Only return these processes and their descendants. The
+        trees are walked through the children files, so the cost depends on
+        the size of these trees, not on the number of processes on the
+        machine. (Only when `process_children_supported()`.) When `None`,
+        do one pass over /proc and return every running process.
+
+    (It's only implemented for Linux, on other systems, an empty dictionary
+    is returned.)
+    """
+    result = {}
+
+    if sys.platform not in ('linux', 'linux2', 'cygwin'):
+        return result
+
+    if pids is None:
+        try:
+            todo = [name for name in os.listdir('/proc') if name.isdigit()]
+        except OSError:
+            return result
+        walk = False
+    else:
+        todo = list(pids)
+        walk = True
+
+    while todo:
+        pid = int(todo.pop())
+
+        if pid not in result:
+            stat = _read_process_stat(pid)
+
+            if stat is not None:  # Otherwise, terminated in the meantime.
+                result[pid] = stat
+
+                if walk:
+                    todo.extend(_get_children(pid))
+
+    return result
+
+
+def get_pgrp_for_fd(fd):
+    """
+    Return the foreground process group of the terminal with this file
+    descriptor. (Or `None` when unknown.)
+    """
+    try:
+        return os.tcgetpgrp(fd)
+    except OSError:
+        # See: https://github.com/jonathanslenders/pymux/issues/46
+        return
+
+
+def get_name_for_fd(fd):
+    """
+    Return the name of the foreground process for the terminal with this file
+    descriptor.
+    """
+    pgrp = get_pgrp_for_fd(fd)
+    if pgrp:
+        return get_name_for_pgrp(pgrp)
+
+
 if sys.platform in ('linux', 'linux2', 'cygwin'):
-    def get_name_for_fd(fd):
+    def get_name_for_pgrp(pgrp):
         """
         Return the process name for a given process ID.
         """
-        try:
-            pgrp = os.tcgetpgrp(fd)
-        except OSError:
-            # See: https://github.com/jonathanslenders/pymux/issues/46
-            return
-
         try:
             with open('/proc/%s/cmdline' % pgrp, 'rb') as f:
                 return f.read().decode('utf-8', 'ignore').partition('\0')[0]
@@ -450,21 +801,16 @@ if sys.platform in ('linux', 'linux2', 'cygwin'):
 elif sys.platform == 'darwin':
     from .darwin import get_proc_name
 
-    def get_name_for_fd(fd):
+    def get_name_for_pgrp(pgrp):
         """
         Return the process name for a given process ID.
         """
-        try:
-            pgrp = os.tcgetpgrp(fd)
-        except OSError:
-            return
-
         try:
             return get_proc_name(pgrp)
         except IOError:
             pass
 else:
-    def get_name_for_fd(fd):
+    def get_name_for_pgrp(pgrp):
         """
         Return the process name for a given process ID.
         """
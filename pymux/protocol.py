@@ -0,0 +1,174 @@
+"""
+The packets that are exchanged between the client and the server.
+
+There are two wire formats:
+
+- Version 1: every packet is a JSON object, terminated by a zero byte.
+- Version 2: every packet is a frame with a fixed header (type, length),
+  followed by the payload. Output ('out') and input ('in') are sent as raw
+  UTF-8, all other packets are JSON.
+
+Both sides start with version 1, so that a client and a server of different
+pymux versions still understand each other. The handshake is done with
+version 1 'protocol' packets:
+
+1. When a client attaches ('start-gui'), the server sends
+   {'cmd': 'protocol', 'versions': [2]}. (Older clients ignore this.)
+2. A client that knows version 2 answers {'cmd': 'protocol', 'version': 2}.
+   Everything that it sends after that packet uses version 2.
+3. The server acknowledges with {'cmd': 'protocol', 'version': 2}. Both
+   directions use version 2 after that.
+
+Note: this module is also used by the client, so it should only import from
+the standard library.
+"""
+from __future__ import unicode_literals
+
+import json
+import struct
+
+__all__ = (
+    'PROTOCOL_VERSION',
+    'PacketReader',
+    'encode_packet',
+    'packet_data_as_text',
+)
+
+PROTOCOL_VERSION = 2
+
+_FRAME_HEADER = struct.Struct('>BI')
+
+_TYPE_JSON = 0
+_TYPE_OUT = 1
+_TYPE_IN = 2
+
+_RAW_TYPES = {
+    'out': _TYPE_OUT,
+    'in': _TYPE_IN,
+}
+_RAW_COMMANDS = dict((v, k) for k, v in _RAW_TYPES.items())
+
+
+def encode_packet(packet, version=1):
+    """
+    Turn a packet (a dictionary) into bytes.
+    """
+    if version == 1:
+        return json.dumps(packet).encode('utf-8') + b'\0'
+
+    frame_type = _RAW_TYPES.get(packet['cmd'])
+
+    if frame_type is None:
+        payload = json.dumps(packet).encode('utf-8')
+        frame_type = _TYPE_JSON
+    else:
+        payload = packet['data']
+        if not isinstance(payload, bytes):
+            payload = payload.encode('utf-8')
+
+    return _FRAME_HEADER.pack(frame_type, len(payload)) + payload
+
+
+class PacketReader(object):
+    """
+    Split the received data into packets.
+
+    The data of 'out' and 'in' packets is returned as bytes in version 2,
+    but as text in version 1. (Use `packet_data_as_text`.)
+    """
+    def __init__(self):
+        self.version = 1
+        self.decompressor = None
+
+        self._buffer = bytearray()
+        self._pos = 0  # Position of the first byte that was not processed.
+
+    def feed(self, data):
+        if self.decompressor:
+            data = self.decompressor.feed(data)
+
+        # Drop what we processed before. (Once per chunk of received data,
+        # not for every packet.)
+        if self._pos:
+            del self._buffer[:self._pos]
+            self._pos = 0
+
+        self._buffer += data
+
+    def enable_decompression(self, decompressor):
+        """
+        Everything that follows the current packet is compressed. (Call this
+        while iterating over `read_packets`.)
+        """
+        data = bytes(self._buffer[self._pos:])
+        del self._buffer[self._pos:]
+
+        self.decompressor = decompressor
+        self.feed(data)
+
+    def read_packets(self):
+        """
+        Yield the complete packets. The version can be changed while
+        iterating; it applies to the packets that follow.
+        """
+        while True:
+            packet = self._read_packet()
+
+            if packet is None:
+                return
+            if packet is not False:
+                yield packet
+
+    def _read_packet(self):
+        """
+        Return the next packet, `None` when there is no complete packet, or
+        `False` when an invalid packet was skipped.
+        """
+        buffer = self._buffer
+        pos = self._pos
+
+        if self.version == 1:
+            end = buffer.find(b'\0', pos)
+            if end == -1:
+                return None
+
+            self._pos = end + 1
+            try:
+                return json.loads(bytes(buffer[pos:end]).decode('utf-8'))
+            except ValueError:
+                return False
+
+        else:
+            if len(buffer) - pos < _FRAME_HEADER.size:
+                return None
+
+            frame_type, length = _FRAME_HEADER.unpack_from(buffer, pos)
+            start = pos + _FRAME_HEADER.size
+            end = start + length
+
+            if len(buffer) < end:
+                return None
+
+            self._pos = end
+            payload = memoryview(buffer)[start:end].tobytes()
+
+            if frame_type == _TYPE_JSON:
+                try:
+                    return json.loads(payload.decode('utf-8'))
+                except ValueError:
+                    return False
+
+            elif frame_type in _RAW_COMMANDS:
+                return {'cmd': _RAW_COMMANDS[frame_type], 'data': payload}
+
+            else:
+                return False
+
+
+def packet_data_as_text(packet):
+    " The 'data' of an 'out' or 'in' packet as text. "
+    data = packet['data']
+
+    if isinstance(data, bytes):
+        return data.decode('utf-8', 'replace')
+    return data
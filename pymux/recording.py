@@ -0,0 +1,75 @@
+"""
+Recording of pane input/output in the asciicast v2 format.
+(For the "record-pane" command.)
+
+See: https://github.com/asciinema/asciinema/blob/develop/doc/asciicast-v2.md
+"""
+from __future__ import unicode_literals
+
+from .pipe import PanePipe
+
+import json
+import os
+import time
+
+__all__ = (
+    'AsciicastRecorder',
+)
+
+
+class AsciicastRecorder(PanePipe):
+    """
+    Write the output of a pane, with timestamps, to an asciicast file.
+    Optionally, also the input can be recorded.
+
+    Writing is done by the batched writer of :class:`.PanePipe` in 'block'
+    mode: when the disk can't keep up, the pane stops reading, rather than
+    producing a recording with holes.
+
+    :param width: Initial width of the pane.
+    :param height: Initial height of the pane.
+    :param record_input: When True, also record the input. (Key strokes.)
+    """
+    def __init__(self, eventloop, filename, width, height, record_input=False):
+        assert isinstance(width, int)
+        assert isinstance(height, int)
+
+        super(AsciicastRecorder, self).__init__(
+            eventloop, filename=filename, append=False, block=True)
+
+        self.include_input = record_input
+        self._start = time.time()
+
+        header = {
+            'version': 2,
+            'width': width,
+            'height': height,
+            'timestamp': int(self._start),
+            'env': {
+                'TERM': os.environ.get('TERM', ''),
+                'SHELL': os.environ.get('SHELL', ''),
+            },
+        }
+        self.write(json.dumps(header).encode('utf-8') + b'\n')
+
+    def _write_event(self, event_type, data):
+        line = json.dumps([round(time.time() - self._start, 6), event_type, data])
+        return self.write(line.encode('utf-8') + b'\n')
+
+    def record_output(self, data):
+        """
+        Record output. (Text.)
+
+        :returns: False when the writer is full and the caller should stop
+            reading.
+        """
+        return self._write_event('o', data)
+
+    def record_input(self, data):
+        " Record input. (Bytes.) "
+        if self.include_input:
+            self._write_event('i', data.decode('utf-8', 'replace'))
+
+    def record_resize(self, width, height):
+        " Record a change of the terminal size. "
+        self._write_event('r', '%ix%i' % (width, height))
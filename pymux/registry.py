@@ -0,0 +1,216 @@
+"""
+Registry of the running pymux servers.
+
+Each user has one registry file in the temp directory. Every server adds
+itself when it starts listening, and refreshes its entry (the heartbeat, and
+the names of its sessions) while it runs. The file is locked while it's read
+or written, so that servers that start at the same time don't overwrite each
+other's entries.
+
+Clients read this file to find the running servers, instead of connecting
+to every socket that happens to exist in the temp directory. Entries of
+servers that died without cleaning up are removed, together with their
+socket.
+
+Note: this module is also used by the client, so it should only import from
+the standard library.
+"""
+from __future__ import unicode_literals
+
+import errno
+import fcntl
+import getpass
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+
+__all__ = (
+    'ServerInfo',
+    'ServerRegistry',
+    'get_default_registry_filename',
+)
+
+# Interval at which a server refreshes its entry.
+HEARTBEAT_INTERVAL = 30
+
+# When the heartbeat of a server is older than this, we are no longer sure
+# that the PID belongs to the server. (It could have been reused, or the
+# machine was suspended.) Then we try to connect to its socket.
+STALE_TIMEOUT = 3 * HEARTBEAT_INTERVAL
+
+
+def get_default_registry_filename():
+    return '%s/pymux.registry.%s' % (tempfile.gettempdir(), getpass.getuser())
+
+
+class ServerInfo(object):
+    """
+    One entry of the registry.
+    """
+    def __init__(self, socket_name, pid, sessions, heartbeat):
+        self.socket_name = socket_name
+        self.pid = pid
+        self.sessions = sessions
+        self.heartbeat = heartbeat
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data['socket'], data['pid'], data['sessions'], data['heartbeat'])
+
+    def to_json(self):
+        return {
+            'socket': self.socket_name,
+            'pid': self.pid,
+            'sessions': self.sessions,
+            'heartbeat': self.heartbeat,
+        }
+
+    @property
+    def is_alive(self):
+        " True when this server is still running. "
+        if not os.path.exists(self.socket_name):
+            return False
+
+        try:
+            os.kill(self.pid, 0)
+        except OSError as e:
+            # EPERM means that the process exists, but belongs to someone else.
+            if e.errno != errno.EPERM:
+                return False
+
+        if time.time() - self.heartbeat > STALE_TIMEOUT:
+            return _can_connect(self.socket_name)
+
+        return True
+
+    def __repr__(self):
+        return 'ServerInfo(socket_name=%r, pid=%r, sessions=%r)' % (
+            self.socket_name, self.pid, self.sessions)
+
+
+class ServerRegistry(object):
+    """
+    Access to the registry file.
+
+    :param filename: The registry file. (By default, the file for the
+        current user.)
+    """
+    def __init__(self, filename=None):
+        self.filename = filename or get_default_registry_filename()
+
+    def _update(self, func=None):
+        """
+        Lock the registry, remove the stale entries and call `func` with the
+        dictionary that maps socket names to the live :class:`.ServerInfo`
+        instances. This dictionary can be modified by `func`; the result is
+        written back. Returns the dictionary.
+        """
+        # Only the user itself can read and write the registry.
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, int('0600', 8))
+
+        with os.fdopen(fd, 'r+b') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+            try:
+                servers = dict((s['socket'], ServerInfo.from_json(s))
+                               for s in json.loads(f.read().decode('utf-8')))
+            except (ValueError, KeyError, TypeError):
+                servers = {}  # Empty or corrupt file.
+
+            # Prune stale entries, and remove their sockets.
+            for info in list(servers.values()):
+                if not info.is_alive:
+                    del servers[info.socket_name]
+                    _remove_socket(info.socket_name)
+
+            if func:
+                func(servers)
+
+            data = json.dumps([s.to_json() for s in servers.values()])
+            f.seek(0)
+            f.truncate()
+            f.write(data.encode('utf-8'))
+
+            # (The lock is released when the file is closed.)
+
+        return servers
+
+    def list_servers(self):
+        """
+        Return the :class:`.ServerInfo` instances of the running servers,
+        sorted by socket name.
+        """
+        try:
+            servers = self._update()
+        except (OSError, IOError):
+            return []
+
+        return sorted(servers.values(), key=lambda s: s.socket_name)
+
+    def register(self, socket_name, sessions):
+        """
+        Add the current process to the registry, or refresh its entry.
+
+        :param sessions: List of the session names.
+        """
+        info = ServerInfo(socket_name, os.getpid(), sessions, time.time())
+
+        def add(servers):
+            servers[socket_name] = info
+        self._update(add)
+
+    def unregister(self, socket_name):
+        def remove(servers):
+            servers.pop(socket_name, None)
+        self._update(remove)
+
+    def start_heartbeat_thread(self, get_socket_name, get_sessions):
+        """
+        Start the background thread that keeps the entry of this server up
+        to date. The entry is written every `HEARTBEAT_INTERVAL` seconds, or
+        sooner when the list of sessions changes.
+
+        :param get_socket_name: Callable that returns the socket name.
+        :param get_sessions: Callable that returns the session names.
+        """
+        def run():
+            last_sessions = None
+            last_write = 0
+
+            while True:
+                time.sleep(1)
+                sessions = get_sessions()
+
+                if sessions != last_sessions or time.time() - last_write > HEARTBEAT_INTERVAL:
+                    try:
+                        self.register(get_socket_name(), sessions)
+                    except (OSError, IOError):
+                        pass
+                    else:
+                        last_sessions = sessions
+                        last_write = time.time()
+
+        t = threading.Thread(target=run)
+        t.daemon = True
+        t.start()
+
+
+def _can_connect(socket_name):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(socket_name)
+        return True
+    except socket.error:
+        return False
+    finally:
+        s.close()
+
+
+def _remove_socket(socket_name):
+    try:
+        os.remove(socket_name)
+    except OSError:
+        pass
@@ -0,0 +1,173 @@
+"""
+Render once for clients that display the same thing.
+
+When several clients look at the same window, at the same size and with the
+same terminal settings (pair programming, a wall monitor), their output is
+identical. Instead of rendering the layout for each of them, we render it for
+the first one, and send the same output to the others.
+
+The renderer of prompt_toolkit remembers the screen that it rendered the
+last time, and writes only the difference. So, the output of a render can
+only be reused by a client whose renderer starts from the same screen. After
+reusing it, we copy the state of the renderer that did the render.
+
+A client that starts from another screen (it attached later, it displayed a
+message, or it was behind) renders itself. The result is the same screen, so
+after that, it continues from the state of the other renderer, and reuses the
+output of the next render.
+
+Clients that display something of their own (a message, the command line,
+copy mode) always render themselves.
+"""
+from __future__ import unicode_literals
+
+from .server import SocketStdout
+
+__all__ = (
+    'RenderGroups',
+)
+
+# The attributes of the prompt_toolkit `Renderer` that describe what the
+# client displays.
+_RENDERER_STATE = (
+    '_attrs_for_token',
+    '_bracketed_paste_enabled',
+    '_cursor_pos',
+    '_in_alternate_screen',
+    '_last_screen',
+    '_last_size',
+    '_last_style_hash',
+    '_last_title',
+    '_last_token',
+    '_min_available_height',
+    '_mouse_support_enabled',
+    'mouse_handlers',
+)
+
+
+class _Frame(object):
+    """
+    Output of one render.
+
+    :param previous_screen: The screen from which the render started.
+    :param data: The output. (Text.)
+    :param state: Dictionary with the renderer state after the render.
+    """
+    def __init__(self, previous_screen, data, state):
+        self.previous_screen = previous_screen
+        self.data = data
+        self.state = state
+
+
+class RenderGroups(object):
+    """
+    Keep the output of the renders since the last invalidate, so that other
+    clients can reuse it.
+    """
+    def __init__(self, pymux):
+        self.pymux = pymux
+        self._frames = {}  # Maps group key to `_Frame`.
+
+        # Statistics.
+        self.renders = 0
+        self.reused = 0
+
+    def discard_frames(self):
+        """
+        Called when the UI has been invalidated. What we rendered before
+        doesn't have to be up to date anymore.
+        """
+        if self._frames:
+            self._frames = {}
+
+    def _get_key(self, cli):
+        """
+        Return a key that is equal for all the clients that render the same
+        output, or `None` when this client has to render itself.
+        """
+        pymux = self.pymux
+        output = cli.output
+
+        if not isinstance(getattr(output, 'stdout', None), SocketStdout):
+            return None
+
+        client_state = pymux.get_client_state(cli)
+        if (client_state.has_prefix or client_state.message or
+                client_state.command_mode or client_state.confirm_text or
+                client_state.prompt_command):
+            return None
+
+        arrangement = pymux.arrangement
+        window = arrangement.get_active_window(cli)
+
+        # In copy mode, the cursor is displayed for the client that has the
+        # focus.
+        if any(p.display_scroll_buffer for p in window.panes):
+            return None
+
+        return (
+            arrangement.get_active_session(cli),
+            window,
+            arrangement.get_previous_active_window(cli),  # (For the status bar.)
+            output.get_size(),
+            output.true_color(),
+            output.ansi_colors_only(),
+            output.term,
+        )
+
+    def redraw(self, cli, render):
+        """
+        Render the UI for this client, or reuse the output that was rendered
+        for another client.
+
+        :param render: Callable that does the actual render.
+        """
+        key = self._get_key(cli)
+
+        if key is None:
+            render()
+            self.renders += 1
+            return
+
+        renderer = cli.renderer
+        frame = self._frames.get(key)
+
+        if (frame is not None and renderer._last_screen is not None and
+                renderer._last_screen is frame.previous_screen):
+            # Send the same output. (After what this client has written
+            # itself, like a bell.)
+            cli.output.stdout.write(frame.data)
+            cli.output.flush()
+            _set_renderer_state(renderer, frame.state)
+
+            cli.render_counter += 1
+            cli.on_render.fire()
+            self.reused += 1
+        else:
+            stdout = cli.output.stdout
+            previous_screen = renderer._last_screen
+
+            stdout.start_capture()
+            try:
+                render()
+            finally:
+                data = stdout.stop_capture()
+
+            self.renders += 1
+
+            if frame is None:
+                self._frames[key] = _Frame(previous_screen, data, _get_renderer_state(renderer))
+            else:
+                # We rendered the same screen as the other clients in this
+                # group. Continue from their state, so that we can reuse the
+                # output next time.
+                _set_renderer_state(renderer, frame.state)
+
+
+def _get_renderer_state(renderer):
+    return dict((name, getattr(renderer, name)) for name in _RENDERER_STATE)
+
+
+def _set_renderer_state(renderer, state):
+    for name, value in state.items():
+        setattr(renderer, name, value)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""
+Replay an asciicast recording in a headless pymux screen and report how long
+the vt100 parsing and rendering took. Recordings made with "record-pane"
+become repeatable benchmarks this way. Run it with "python -m pymux.replay".
+
+Usage:
+    replay.py [--realtime] [(--render-interval <seconds>)] <file>
+    replay.py -h | --help
+
+Options:
+    --realtime        : Respect the timing of the recording, rather than
+                        replaying as fast as possible.
+    --render-interval : Render the screen at most once per this amount of
+                        seconds of recording time. (Default: 0.1, like the
+                        pymux server.)
+"""
+from __future__ import unicode_literals, print_function
+
+from pymux.screen import BetterScreen
+from pymux.stream import BetterStream
+
+from six.moves import range
+
+import docopt
+import gzip
+import json
+import resource
+import sys
+import time
+
+__all__ = (
+    'ReplayResult',
+    'read_asciicast',
+    'replay',
+)
+
+
+class ReplayResult(object):
+    """
+    Statistics of one replay.
+    """
+    def __init__(self):
+        self.event_count = 0
+        self.byte_count = 0
+        self.parse_time = 0.
+        self.render_count = 0
+        self.render_time = 0.
+        self.total_time = 0.
+        self.peak_memory = 0  # In KB.
+
+    def __repr__(self):
+        return ('ReplayResult(events=%i, bytes=%i, parse_time=%.3f, '
+                'render_count=%i, render_time=%.3f, total_time=%.3f, '
+                'peak_memory=%iKB)' % (
+                    self.event_count, self.byte_count, self.parse_time,
+                    self.render_count, self.render_time, self.total_time,
+                    self.peak_memory))
+
+
+def read_asciicast(filename):
+    """
+    Read an asciicast v2 file. (Optionally gzip compressed.)
+    Returns a (header, events) tuple, where events is a list of
+    (time, event_type, data) tuples.
+    """
+    opener = gzip.open if filename.endswith('.gz') else open
+
+    with opener(filename, 'rb') as f:
+        lines = f.read().decode('utf-8').splitlines()
+
+    header = json.loads(lines[0])
+
+    if header.get('version') != 2:
+        raise ValueError('Only asciicast version 2 is supported.')
+
+    events = []
+    for line in lines[1:]:
+        if line.strip():
+            try:
+                events.append(tuple(json.loads(line)))
+            except ValueError:
+                break  # Incomplete last line. (Recording was not closed.)
+
+    return header, events
+
+
+def _render(screen):
+    """
+    Walk over the visible part of the screen, like the renderer of pymux
+    does when it copies a pane to the output.
+    """
+    data_buffer = screen.data_buffer
+    line_offset = screen.line_offset
+    columns = screen.columns
+
+    for y in range(line_offset, line_offset + screen.lines):
+        row = data_buffer[y]
+        for x in range(columns):
+            row[x]
+
+
+def replay(filename, realtime=False, render_interval=.1):
+    """
+    Feed the output events of a recording into a headless `BetterScreen`.
+    Returns a :class:`.ReplayResult`.
+    """
+    header, events = read_asciicast(filename)
+    result = ReplayResult()
+
+    screen = BetterScreen(header['height'], header['width'],
+                          write_process_input=lambda data: None)
+    stream = BetterStream(screen)
+    stream.attach(screen)
+
+    def render():
+        start = time.time()
+        _render(screen)
+        result.render_time += time.time() - start
+        result.render_count += 1
+
+    start = time.time()
+    last_render = None  # Recording time of the last render.
+    needs_render = False
+
+    for timestamp, event_type, data in events:
+        if realtime:
+            delay = start + timestamp - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+        if needs_render and timestamp - last_render >= render_interval:
+            render()
+            last_render = timestamp
+            needs_render = False
+
+        if event_type == 'o':
+            t = time.time()
+            stream.feed(data)
+            result.parse_time += time.time() - t
+            result.byte_count += len(data)
+            result.event_count += 1
+
+            if not needs_render:
+                needs_render = True
+                if last_render is None:
+                    last_render = timestamp
+
+        elif event_type == 'r':
+            width, height = data.split('x')
+            screen.resize(lines=int(height), columns=int(width))
+
+    if needs_render:
+        render()
+
+    result.total_time = time.time() - start
+
+    # Linux reports the maximum resident set size in KB, OS X in bytes.
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result.peak_memory = max_rss // 1024 if sys.platform == 'darwin' else max_rss
+
+    return result
+
+
+def run():
+    a = docopt.docopt(__doc__)
+
+    result = replay(a['<file>'], realtime=a['--realtime'],
+                    render_interval=float(a['--render-interval'] or .1))
+
+    print('Output events: %i (%i characters)' % (result.event_count, result.byte_count))
+    print('Parse time:    %.3fs' % result.parse_time)
+    print('Renders:       %i (%.3fs)' % (result.render_count, result.render_time))
+    print('Total time:    %.3fs' % result.total_time)
+    print('Peak memory:   %iKB' % result.peak_memory)
+
+
+if __name__ == '__main__':
+    run()
@@ -347,7 +347,8 @@ class BetterScreen(object):
             self._reset_offset_and_margins()
 
     @property
-    def _in_alternate_screen(self):
+    def in_alternate_screen(self):
+        " True when the alternate screen buffer is active. (Full screen applications.) "
         return bool(self._original_screen)
 
     def shift_in(self):
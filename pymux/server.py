@@ -1,21 +1,31 @@
 from __future__ import unicode_literals
 import getpass
-import json
 import socket
 import tempfile
+import time
 
 from prompt_toolkit.layout.screen import Size
 from prompt_toolkit.terminal.vt100_input import InputStream
 from prompt_toolkit.terminal.vt100_output import Vt100_Output
 from prompt_toolkit.input import Input
 
+from .client_render import ClientRenderer
+from .compression import Compressor
 from .log import logger
+from .protocol import PROTOCOL_VERSION, PacketReader, encode_packet, packet_data_as_text
+from .write_queue import WriteQueue
 
 __all__ = (
     'ServerConnection',
+    'SocketStdout',
     'bind_socket',
 )
 
+# When more than this amount of bytes is waiting to be sent to a client, the
+# client is behind. We stop sending the output of every render, and send one
+# full repaint when the client has caught up.
+_COALESCE_SIZE = 64 * 1024
+
 
 class ServerConnection(object):
     """
@@ -28,9 +38,34 @@ class ServerConnection(object):
         self.size = Size(rows=20, columns=80)
         self._closed = False
 
-        self._recv_buffer = b''
+        self._reader = PacketReader()
+        self._protocol_version = 1  # Wire format of the packets that we send.
         self.cli = None
 
+        # `ControlSubscriber`, when this client is in control mode.
+        self.control = None
+
+        # True when the client does predictive local echo. It needs to know
+        # where the cursor of the active pane is after each render.
+        self.predict_echo = False
+
+        # Compression of the data that we send. (When the client asks for it.)
+        self.compressor = None
+        self.term = None
+
+        # Outgoing data. (We never block on a slow client.) The size is
+        # limited by the 'client-backlog-limit' check in `_send_packet`.
+        self._write_queue = WriteQueue(
+            pymux.eventloop, connection.fileno(), max_size=2 ** 31 - 1,
+            on_drained=self._write_queue_drained, on_error=self._write_error)
+        self._needs_repaint = False
+
+        # Statistics. (For "list-clients".)
+        self.bytes_sent = 0
+        self.frames_coalesced = 0
+        self.skipped_bytes = 0  # Output that was not sent, since lagging.
+        self.lagging_since = None  # Time when the queue became non-empty.
+
         def feed_key(key):
             self.cli.input_processor.feed(key)
             self.cli.input_processor.process_keys()
@@ -62,33 +97,42 @@ class ServerConnection(object):
             self.detach_and_close()
         else:
             # Receive and process packets.
-            self._recv_buffer += data
+            self._reader.feed(data)
+
+            for packet in self._reader.read_packets():
+                self._process(packet)
 
-            while b'\0' in self._recv_buffer:
-                # Zero indicates end of packet.
-                pos = self._recv_buffer.index(b'\0')
-                self._process(self._recv_buffer[:pos])
-                self._recv_buffer = self._recv_buffer[pos + 1:]
+                if self._closed:
+                    break
 
-    def _process(self, data):
+    def _process(self, packet):
         """
         Process packet received from client.
         """
-        try:
-            packet = json.loads(data.decode('utf-8'))
-        except ValueError:
-            # So far, this never happened. But it would be good to have some
-            # protection.
-            logger.warning('Received invalid JSON from client. Ignoring.')
-            return
-
-        # Handle commands.
+        # Handle commands. (From `Client.run_command`, and from the clients
+        # of older pymux versions.)
         if packet['cmd'] == 'run-command':
             self._run_command(packet)
 
+        # A batch of commands. (Sends the results back.)
+        elif packet['cmd'] == 'run-commands':
+            self._run_commands(packet)
+
+        # Command from a client in control mode.
+        elif packet['cmd'] == 'control-command':
+            if self.control:
+                self.control.run_command(packet.get('id'), packet['data'])
+
         # Handle stdin.
         elif packet['cmd'] == 'in':
-            self._inputstream.feed(packet['data'])
+            self._inputstream.feed(packet_data_as_text(packet))
+
+        # Switch to the binary protocol. (See `pymux.protocol`.)
+        elif packet['cmd'] == 'protocol':
+            if packet.get('version') == PROTOCOL_VERSION:
+                self._reader.version = PROTOCOL_VERSION
+                self._send_packet({'cmd': 'protocol', 'version': PROTOCOL_VERSION})
+                self._protocol_version = PROTOCOL_VERSION
 
         elif packet['cmd'] == 'flush-input':
             self._inputstream.flush()  # Flush escape key.
@@ -105,22 +149,183 @@ class ServerConnection(object):
             true_color = bool(packet['true-color'])
             ansi_colors_only = bool(packet['ansi-colors-only'])
             term = packet['term']
+            client_render = bool(packet.get('client-render'))
+            self.predict_echo = bool(packet.get('predict-echo'))
+
+            # Everything after the 'compress' packet is compressed.
+            if packet.get('compress') and self.compressor is None:
+                self._send_packet({'cmd': 'compress'})
+                self.compressor = Compressor(self.pymux.compression_level)
+
+            # Tell the client that we understand the binary protocol.
+            self._send_packet({'cmd': 'protocol', 'versions': [PROTOCOL_VERSION]})
 
             if detach_other_clients:
                 for c in self.pymux.connections:
                     c.detach_and_close()
 
-            self._create_cli(true_color=true_color, ansi_colors_only=ansi_colors_only, term=term)
+            self._create_cli(true_color=true_color, ansi_colors_only=ansi_colors_only, term=term,
+                             client_render=client_render)
+            self._select_session(self.cli, packet.get('session'), packet.get('new-session'))
+
+        # Start control mode. (See `pymux.control`.)
+        elif packet['cmd'] == 'control':
+            if self.cli is None and self.control is None:
+                self._send_packet({'cmd': 'protocol', 'versions': [PROTOCOL_VERSION]})
+
+                cli = self._create_command_cli()
+                self._select_session(cli, packet.get('session'), None)
+
+                self.control = self.pymux.control_events.subscribe(self, cli)
+
+    def _select_session(self, cli, session_name, new_session):
+        """
+        Attach the CLI to the session with this name, or to a new session.
+
+        :param new_session: `None`, or a dictionary with the 'name' and
+            'command' for a new session.
+        """
+        pymux = self.pymux
+        arrangement = pymux.arrangement
+
+        if new_session is not None:
+            name = new_session.get('name')
+
+            if name and arrangement.get_session_by_name(name):
+                pymux.show_message(cli, 'Duplicate session: %s' % (name, ))
+            else:
+                pymux.new_session(cli, name=name, command=new_session.get('command'))
+
+        elif session_name is not None:
+            session = arrangement.get_session_by_name(session_name)
+
+            if session is None:
+                pymux.show_message(cli, "Can't find session: %s" % (session_name, ))
+            else:
+                arrangement.set_active_session(cli, session)
 
     def _send_packet(self, data):
         """
         Send packet to client.
         """
-        try:
-            self.connection.send(json.dumps(data).encode('utf-8') + b'\0')
-        except socket.error:
-            if not self._closed:
-                self.detach_and_close()
+        if self._closed:
+            return
+
+        data = encode_packet(data, self._protocol_version)
+
+        if self.compressor:
+            data = self.compressor.compress(data, self.pymux.compression_threshold)
+
+        self.bytes_sent += len(data)
+        self._write_queue.write(data)
+
+        if self._write_queue.size and self.lagging_since is None:
+            self.lagging_since = time.time()
+
+        self._check_backlog()
+
+    def _check_backlog(self):
+        """
+        Disconnect the client when it's too far behind.
+        """
+        if self.backlog > self.pymux.client_backlog_limit * 1024 and not self._closed:
+            logger.warning('Disconnecting client. Backlog of %i bytes.', self.backlog)
+            self.detach_and_close()
+
+    @property
+    def backlog(self):
+        """
+        Amount of output bytes that this client is behind. (What's in the
+        queue, and the output that we skipped.)
+        """
+        return self._write_queue.size + self.skipped_bytes
+
+    @property
+    def is_behind(self):
+        """
+        True when we don't send rendered output to this client, until the
+        queue has been drained.
+        """
+        return self._needs_repaint or self._write_queue.size > _COALESCE_SIZE
+
+    def skip_output(self, size=0):
+        """
+        Don't send this rendered output, because the client is behind. We
+        repaint when the queue has been drained.
+        """
+        self.frames_coalesced += 1
+        self.skipped_bytes += size
+        self._needs_repaint = True
+        self._check_backlog()
+
+    def _send_output_packet(self, data):
+        """
+        Send rendered output to the client. For clients that do local echo,
+        follow it by the state of the active pane.
+        """
+        if self.is_behind:
+            self.skip_output(len(data['data']))
+            return
+
+        self._send_packet(data)
+
+        if self.predict_echo and self.cli:
+            self._send_packet(self._get_echo_state())
+
+    def send_frame(self, frame):
+        """
+        Send a 'frame' packet. (For clients that render themselves.)
+        """
+        self._send_packet(frame)
+
+    def send_control_events(self, events):
+        """
+        Send a 'control' packet. (For clients in control mode.)
+        """
+        self._send_packet({'cmd': 'control', 'events': events})
+
+    def _get_echo_state(self):
+        """
+        Tell the client whether it can predict the echo of the characters
+        that are typed. This is only the case when the key presses go to the
+        active pane, the process echoes them, and the terminal cursor is at
+        the end of the text in the pane.
+
+        'x' and 'y' are the position of the cursor in the pane, which the
+        client uses to see how many of its predictions were confirmed.
+        'room' is the number of columns that are left on the line.
+        """
+        pymux = self.pymux
+        cli = self.cli
+        state = {'cmd': 'echo-state', 'predict': False, 'x': 0, 'y': 0, 'room': 0}
+
+        if not pymux.key_bindings_manager.pane_input_allowed(cli):
+            return state
+
+        pane = pymux.arrangement.get_active_pane(cli)
+        if pane is None or pane.clock_mode or pane.process.is_terminated:
+            return state
+
+        process = pane.process
+        screen = process.screen
+        x = screen.pt_cursor_position.x
+        y = screen.pt_cursor_position.y
+
+        # Only at the end of the line. (We can't predict how text on the
+        # right of the cursor moves.)
+        row = screen.data_buffer.get(y, {})
+        text_on_the_right = any(c.char != ' ' for col, c in row.items() if col >= x)
+
+        state.update({
+            'predict': (screen.pt_screen.show_cursor and
+                        not screen.in_alternate_screen and
+                        not text_on_the_right and
+                        process.echoes_input()),
+            'x': x,
+            'y': y,
+            'room': max(0, screen.columns - x - 1),
+        })
+        return state
 
     def _run_command(self, packet):
         """
@@ -142,19 +347,59 @@ class ServerConnection(object):
         finally:
             self._close_cli()
 
-    def _create_cli(self, true_color=False, ansi_colors_only=False, term='xterm'):
+    def _run_commands(self, packet):
+        """
+        Execute a batch of commands from the client, and send a
+        'command-results' packet with the result of each command. (See
+        `Pymux.run_commands`.)
+
+        The commands are executed in a temporary CLI, which is never rendered.
+        Commands that only query the state (like "list-panes -F json") don't
+        cause a render of the other clients.
+        """
+        cli = self.cli
+
+        if cli is None:
+            cli = self._create_command_cli()
+
+            pane_id = packet.get('pane_id')
+            if pane_id is not None:
+                self.pymux.arrangement.set_active_window_from_pane_id(cli, int(pane_id))
+
+        results = self.pymux.run_commands(cli, packet['commands'])
+
+        self._send_packet({'cmd': 'command-results', 'results': results})
+
+    def _create_cli(self, true_color=False, ansi_colors_only=False, term='xterm',
+                    client_render=False):
         """
         Create CommandLineInterface for this client.
         Called when the client wants to attach the UI to the server.
+
+        :param client_render: Send frames instead of terminal output. (See
+            `pymux.client_render`.)
         """
-        output = Vt100_Output(_SocketStdout(self._send_packet),
+        self.term = term
+        output = Vt100_Output(SocketStdout(self._send_output_packet),
                               lambda: self.size,
                               true_color=true_color,
                               ansi_colors_only=ansi_colors_only,
                               term=term,
                               write_binary=False)
         input = _ClientInput(self._send_packet)
-        self.cli = self.pymux.create_cli(self, output, input)
+        client_renderer = ClientRenderer(self) if client_render else None
+        self.cli = self.pymux.create_cli(self, output, input, client_renderer=client_renderer)
+
+    def _create_command_cli(self):
+        """
+        Create a CommandLineInterface that is only used for executing
+        commands. (For control mode and batches of commands.)
+        """
+        # (Nothing is sent through this output and input.)
+        output = Vt100_Output(SocketStdout(lambda data: None), lambda: self.size,
+                              write_binary=False)
+        input = _ClientInput(lambda data: None)
+        return self.pymux.create_cli(self, output, input, render=False)
 
     def _close_cli(self):
         if self in self.pymux.clis:
@@ -174,22 +419,78 @@ class ServerConnection(object):
 
             self.cli.run_in_terminal(suspend)
 
+    def request_reconnect(self):
+        """
+        Ask the client to connect again, and close this connection. (Before
+        the server is replaced by a new one.)
+        """
+        self._send_packet({'cmd': 'reconnect'})
+
+        if not self._closed:
+            self.detach_and_close()
+
+    def _write_queue_drained(self):
+        """
+        Everything has been sent. When we skipped output, do a full repaint.
+        """
+        self.lagging_since = None
+
+        if self.control:
+            self.control.drained()
+
+        if self._needs_repaint:
+            # (Not right away, we could be called while rendering.)
+            self.pymux.eventloop.call_from_executor(self._repaint)
+
+    def _repaint(self):
+        """
+        Send a full repaint, instead of the output that we skipped.
+        """
+        if self._needs_repaint and self.cli and not self._write_queue.size:
+            self._needs_repaint = False
+            self.skipped_bytes = 0
+
+            # Forget what the client has on its screen. (This writes and
+            # flushes some output itself.) Then start from the top left.
+            # (The next frame of a client that renders itself contains
+            # everything that changed in the meantime.)
+            client_renderer = self.cli.client_renderer
+
+            if client_renderer is None or not client_renderer.sends_frames:
+                self.cli.renderer.reset(leave_alternate_screen=False)
+                self.cli.output.cursor_goto(0, 0)
+            self.cli.invalidate()
+
+    def _write_error(self, e):
+        if not self._closed:
+            self.detach_and_close()
+
     def detach_and_close(self):
+        self._closed = True
+
         # Remove from Pymux.
         self.pymux.connections.remove(self)
         self._close_cli()
 
+        if self.control:
+            self.pymux.control_events.unsubscribe(self.control)
+
+        # Send what we can, without blocking. (Like the 'reconnect' request.)
+        self._write_queue.flush()
+        self._write_queue.close()
+
         # Remove from eventloop.
         self.pymux.eventloop.remove_reader(self.connection.fileno())
         self.connection.close()
 
-        self._closed = True
-
 
-def bind_socket(socket_name=None):
+def bind_socket(socket_name=None, taken=()):
     """
     Find a socket to listen on and return it.
 
+    :param taken: Socket names of the running servers. (From the registry.)
+        These are skipped without trying.
+
     Returns (socket_name, sock_obj)
     """
     s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
@@ -203,6 +504,10 @@ def bind_socket(socket_name=None):
             try:
                 socket_name = '%s/pymux.sock.%s.%i' % (
                     tempfile.gettempdir(), getpass.getuser(), i)
+
+                if socket_name in taken:
+                    raise OSError('Socket is in use.')
+
                 s.bind(socket_name)
                 return socket_name, s
             except (OSError, socket.error):
@@ -215,7 +520,7 @@ def bind_socket(socket_name=None):
                     raise
 
 
-class _SocketStdout(object):
+class SocketStdout(object):
     """
     Stdout-like object that writes everything through the unix socket to the
     client.
@@ -224,10 +529,24 @@ class _SocketStdout(object):
         assert callable(send_packet)
         self.send_packet = send_packet
         self._buffer = []
+        self._capture = None
 
     def write(self, data):
         self._buffer.append(data)
 
+        if self._capture is not None:
+            self._capture.append(data)
+
+    def start_capture(self):
+        " Start recording the output that is written. (See `stop_capture`.) "
+        self._capture = []
+
+    def stop_capture(self):
+        " Stop recording, and return the output that was written. "
+        data = ''.join(self._capture)
+        self._capture = None
+        return data
+
     def flush(self):
         data = {'cmd': 'out', 'data': ''.join(self._buffer)}
         self.send_packet(data)
@@ -0,0 +1,466 @@
+"""
+Session snapshots. (For the "save-session" and "restore-session" commands.)
+
+A snapshot contains the sessions and their windows, the split tree of each window with the
+weights, the names, and for each pane the working directory, the command and
+the scrollback. It's stored in a compact binary file:
+
+    header:   magic (8 bytes), format version (unsigned short)
+    sections: length (unsigned int) + zlib compressed data
+
+The first section is the arrangement, as JSON. Then follows one section for
+each pane, containing the scrollback as UTF-8 text.
+"""
+from __future__ import unicode_literals
+
+from .arrangement import Pane, HSplit, VSplit, Window
+from .log import logger
+
+import errno
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+__all__ = (
+    'SnapshotError',
+    'SnapshotManager',
+    'encode_arrangement',
+    'decode_window',
+    'get_default_snapshot_filename',
+    'get_scrollback',
+)
+
+_MAGIC = b'PYMUXSS\0'
+_VERSION = 2  # Version 2 stores the session of each window.
+
+_HEADER = struct.Struct('>8sH')
+_SECTION_LENGTH = struct.Struct('>I')
+
+
+class SnapshotError(Exception):
+    """
+    Raised when a snapshot can't be read.
+    """
+    def __init__(self, message):
+        self.message = message
+
+
+def get_default_snapshot_filename(session_name):
+    " The file used when no filename was given, and for the automatic saves. "
+    return os.path.expanduser('~/.pymux/sessions/%s.snapshot' % session_name)
+
+
+class SnapshotManager(object):
+    """
+    Save and restore session snapshots.
+
+    Saving happens in two steps: the state is collected in the event loop
+    (that's cheap), while compressing and writing is done in an executor.
+    The compressed scrollback of each pane is cached, together with the
+    `content_version` of the process, so that only the panes that received
+    output since the previous save are compressed again.
+    """
+    def __init__(self, pymux):
+        self.pymux = pymux
+
+        self._saving = False
+        self._cache = {}  # Maps pane_id to (content_version, compressed data).
+        self._last_saved_state = None
+
+    def save(self, filename=None, done_callback=None):
+        """
+        Save a snapshot in the background.
+
+        :param done_callback: Called in the event loop with an error message
+            or `None` when the snapshot was written.
+        """
+        filename = filename or get_default_snapshot_filename(self.pymux.session_name)
+        done_callback = done_callback or (lambda error: None)
+
+        if self._saving:
+            done_callback('A snapshot is being written already.')
+            return
+
+        arrangement, pane_list = encode_arrangement(self.pymux)
+        self._write_in_executor(filename, arrangement, pane_list, done_callback)
+
+    def _autosave(self):
+        " Called at the 'session-save-interval'. Skip when nothing changed. "
+        if self._saving or not self.pymux.arrangement.has_panes:
+            return
+
+        arrangement, pane_list = encode_arrangement(self.pymux)
+        state = (arrangement, [(p.pane_id, p.process.content_version) for p in pane_list])
+
+        if state != self._last_saved_state:
+            def done(error):
+                if error:
+                    logger.warning('Saving session failed: %s', error)
+                else:
+                    self._last_saved_state = state
+
+            filename = get_default_snapshot_filename(self.pymux.session_name)
+            self._write_in_executor(filename, arrangement, pane_list, done)
+
+    def start_autosave_thread(self):
+        """
+        Start the background thread that saves a snapshot every
+        `pymux.session_save_interval` seconds. (When that's not zero.)
+        """
+        def run():
+            while True:
+                time.sleep(self.pymux.session_save_interval or 5)
+
+                if self.pymux.session_save_interval:
+                    self.pymux.eventloop.call_from_executor(self._autosave)
+
+        t = threading.Thread(target=run)
+        t.daemon = True
+        t.start()
+
+    def _write_in_executor(self, filename, arrangement, pane_list, done_callback):
+        """
+        Compress and write the snapshot in an executor.
+        """
+        # Take the scrollback of the changed panes. (This has to happen in the
+        # event loop, the screens are modified there.)
+        cache = self._cache
+        scrollback = []
+
+        for pane in pane_list:
+            version = pane.process.content_version
+            cached = cache.get(pane.pane_id)
+
+            if cached and cached[0] == version:
+                scrollback.append((pane.pane_id, version, None))
+            else:
+                scrollback.append((pane.pane_id, version, get_scrollback(pane.process.screen)))
+
+        self._saving = True
+
+        def write():
+            " In executor. "
+            error = None
+            new_cache = {}
+
+            try:
+                sections = [zlib.compress(json.dumps(arrangement).encode('utf-8'))]
+
+                for pane_id, version, text in scrollback:
+                    if text is None:
+                        data = cache[pane_id][1]
+                    else:
+                        data = zlib.compress(text.encode('utf-8'))
+
+                    new_cache[pane_id] = (version, data)
+                    sections.append(data)
+
+                _write_file(filename, sections)
+            except (OSError, IOError) as e:
+                error = '%s' % (e, )
+            else:
+                self._cache = new_cache
+
+            self.pymux.eventloop.call_from_executor(lambda: done(error))
+
+        def done(error):
+            " Back in the event loop. "
+            self._saving = False
+            done_callback(error)
+
+        self.pymux.eventloop.run_in_executor(write)
+
+    def restore(self, filename=None):
+        """
+        Restore the windows from a snapshot. They are added next to the
+        windows that exist already.
+
+        The file is read right away (this can raise `SnapshotError`), but the
+        windows are created one at a time, with low priority, because every
+        process that we spawn blocks the event loop for a short while.
+        Returns the number of windows.
+        """
+        filename = filename or get_default_snapshot_filename(self.pymux.session_name)
+        arrangement, scrollback = _read_file(filename)
+
+        windows = arrangement['windows']
+        panes = arrangement['panes']
+
+        if len(scrollback) != len(panes):
+            raise SnapshotError('Corrupt snapshot: missing scrollback.')
+
+        def restore_next(i):
+            if i < len(windows):
+                self._restore_window(windows[i], panes, scrollback)
+                self.pymux.invalidate()
+
+                self.pymux.eventloop.call_from_executor(
+                    lambda: restore_next(i + 1),
+                    _max_postpone_until=time.time() + .5)
+
+        restore_next(0)
+        return len(windows)
+
+    def _restore_window(self, data, panes, scrollback):
+        " Create one window from the snapshot. "
+        pymux = self.pymux
+
+        def create_pane(i):
+            p = panes[i]
+
+            # (Pass the list of arguments. Arguments can contain spaces.)
+            pane = pymux._create_pane(command=p['command'] or None, start_directory=p['cwd'])
+            pane.chosen_name = p['name']
+
+            # Display the scrollback above the output of the new process.
+            text = scrollback[i]
+            if text:
+                pane.process.stream.feed(text.replace('\n', '\r\n') + '\r\n')
+
+            return pane
+
+        decode_window(pymux.arrangement, data, create_pane)
+
+
+def encode_arrangement(pymux):
+    """
+    Collect the state of the arrangement. (In the event loop.)
+    Returns an (arrangement, pane_list) tuple, where `arrangement` is a
+    JSON serializable dictionary that refers to the panes by their index
+    in `pane_list`.
+    """
+    pane_list = []
+    pane_indexes = {}
+
+    def encode_split(split):
+        children = []
+
+        for item in split:
+            if isinstance(item, Pane):
+                pane_indexes[item] = len(pane_list)
+                pane_list.append(item)
+                child = pane_indexes[item]
+            else:
+                child = encode_split(item)
+
+            children.append([split.weights[item], child])
+
+        return ['v' if isinstance(split, VSplit) else 'h', children]
+
+    windows = []
+    for session in pymux.arrangement.sessions:
+        for w in session.windows:
+            root = encode_split(w.root)
+
+            windows.append({
+                'session': session.name,
+                'index': w.index,
+                'name': w.chosen_name,
+                'layout': w.previous_selected_layout,
+                'zoom': w.zoom,
+                'synchronize_panes': w.synchronize_panes,
+                'active_pane': pane_indexes.get(w.active_pane, 0),
+                'root': root,
+            })
+
+    panes = []
+    for pane in pane_list:
+        command = pane.process.command
+
+        # Panes running the default shell get the default shell again.
+        # (Which can come from the shell pool.)
+        if command == [pymux.default_shell]:
+            command = None
+
+        panes.append({
+            'name': pane.chosen_name,
+            'cwd': pane.process.get_cwd(),
+            'command': command,
+        })
+
+    arrangement = {
+        'session_name': pymux.session_name,
+        'windows': windows,
+        'panes': panes,
+    }
+
+    return arrangement, pane_list
+
+
+def decode_window(arrangement, data, create_pane):
+    """
+    Add a window, encoded by `encode_arrangement`, to the arrangement.
+
+    :param data: The dictionary for this window.
+    :param create_pane: Callable that receives the index of a pane and
+        returns a :class:`.Pane`.
+    """
+    created = {}
+
+    def decode_split(data):
+        split = VSplit() if data[0] == 'v' else HSplit()
+
+        for weight, child in data[1]:
+            if isinstance(child, int):
+                item = created[child] = create_pane(child)
+            else:
+                item = decode_split(child)
+
+            split.append(item)
+            split.weights[item] = weight
+
+        return split
+
+    # Add the window to the session with the same name.
+    session = arrangement.get_session_by_name(data['session'])
+    if session is None:
+        session = arrangement.create_session(data['session'])
+
+    # Take the original index, when it's still available.
+    taken_indexes = [w.index for w in session.windows]
+    index = data['index']
+
+    if index in taken_indexes:
+        index = arrangement.base_index
+        while index in taken_indexes:
+            index += 1
+
+    w = Window(index)
+    w.root = decode_split(data['root'])
+    w.chosen_name = data['name']
+    w.previous_selected_layout = data['layout']
+    w.synchronize_panes = data['synchronize_panes']
+
+    if not w.has_panes:
+        if not session.windows:
+            arrangement.sessions.remove(session)
+        return
+
+    w.active_pane = created.get(data['active_pane'], w.panes[0])
+    w.zoom = data['zoom']
+
+    session.windows.append(w)
+    session.windows = sorted(session.windows, key=lambda w: w.index)
+
+
+def get_scrollback(screen, up_to_cursor=False):
+    """
+    Return the content of the screen, including the history, as text.
+
+    :param up_to_cursor: When True, stop at the line of the cursor, and keep
+        that line even when it's empty. (Feeding the result to an empty
+        screen puts the cursor back on the same line.)
+    """
+    data_buffer = screen.data_buffer
+
+    if not data_buffer:
+        return ''
+
+    first_row = min(data_buffer.keys())
+
+    if up_to_cursor:
+        last_row = screen.pt_cursor_position.y
+    else:
+        last_row = max(screen.max_y, screen.pt_cursor_position.y)
+    lines = []
+
+    for lineno in range(first_row, last_row + 1):
+        row = data_buffer.get(lineno)
+        line = []
+
+        if row:
+            skip = False
+            for x in range(max(row.keys()) + 1):
+                if skip:
+                    # Second cell of a double width character.
+                    skip = False
+                    continue
+
+                c = row.get(x)
+                if c is None:
+                    line.append(' ')
+                else:
+                    line.append(c.char)
+                    skip = (c.width == 2)
+
+        lines.append(''.join(line).rstrip())
+
+    # Don't restore the empty lines below the cursor.
+    if not up_to_cursor:
+        while lines and not lines[-1]:
+            lines.pop()
+
+    return '\n'.join(lines)
+
+
+def _write_file(filename, sections):
+    """
+    Write the sections to the file. We write to a temporary file first, so
+    that a crash while writing doesn't destroy the previous snapshot.
+    """
+    directory = os.path.dirname(filename)
+
+    if directory:
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    tmp_filename = filename + '.tmp'
+
+    with open(tmp_filename, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION))
+
+        for data in sections:
+            f.write(_SECTION_LENGTH.pack(len(data)))
+            f.write(data)
+
+    os.rename(tmp_filename, filename)
+
+
+def _read_file(filename):
+    """
+    Read a snapshot. Returns an (arrangement, scrollback) tuple, where
+    `scrollback` is a list of text for each pane.
+    """
+    try:
+        with open(filename, 'rb') as f:
+            data = f.read()
+    except (OSError, IOError) as e:
+        raise SnapshotError('Could not read snapshot: %s' % (e, ))
+
+    if len(data) < _HEADER.size:
+        raise SnapshotError('Not a pymux snapshot.')
+
+    magic, version = _HEADER.unpack_from(data, 0)
+
+    if magic != _MAGIC:
+        raise SnapshotError('Not a pymux snapshot.')
+
+    if version > _VERSION:
+        raise SnapshotError('Unsupported snapshot version: %i.' % version)
+
+    sections = []
+    pos = _HEADER.size
+
+    try:
+        while pos < len(data):
+            length, = _SECTION_LENGTH.unpack_from(data, pos)
+            pos += _SECTION_LENGTH.size
+            sections.append(zlib.decompress(data[pos:pos + length]).decode('utf-8'))
+            pos += length
+
+        arrangement = json.loads(sections[0])
+    except (struct.error, zlib.error, ValueError, IndexError):
+        raise SnapshotError('Corrupt snapshot.')
+
+    # Version 1 had only one session.
+    if version < 2:
+        for w in arrangement['windows']:
+            w['session'] = arrangement['session_name']
+
+    return arrangement, sections[1:]
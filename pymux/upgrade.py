@@ -0,0 +1,292 @@
+"""
+Live server upgrade. (For the "upgrade-server" command.)
+
+The server replaces its own process image by a freshly started Python
+interpreter, running the installed version of pymux. Because the process ID
+stays the same, the processes in the panes remain our children, and they
+keep running without noticing anything.
+
+Before calling `exec`, the server state (the arrangement, and the screen
+content of each pane) is written to an unlinked temporary file. The file
+descriptor of that file, the listening socket and the pseudo terminal
+masters of all panes are sent with `SCM_RIGHTS` over a Unix socket pair. The
+messages wait in the kernel while `exec` runs, and the new image, which
+inherits only the receiving end of the socket pair, picks them up. Attached
+clients are asked to reconnect.
+"""
+from __future__ import unicode_literals
+
+from .arrangement import Pane
+from .log import logger
+from .snapshot import encode_arrangement, decode_window, get_scrollback
+
+import array
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+
+__all__ = (
+    'UpgradeError',
+    'upgrade_server',
+    'is_upgrading',
+    'complete_upgrade',
+)
+
+# Environment variable that contains the file descriptor of the socket from
+# which the new server receives the state.
+_ENV_VARIABLE = 'PYMUX_UPGRADE_FD'
+
+# Environment variable with the original PYTHONPATH. (The new server gets the
+# `sys.path` of the old one as PYTHONPATH, but the panes should get the
+# original.)
+_ENV_PYTHONPATH = 'PYMUX_UPGRADE_PYTHONPATH'
+
+_VERSION = 1
+
+# The kernel accepts at most 253 file descriptors in one message.
+_MAX_FDS_PER_MESSAGE = 200
+
+
+class UpgradeError(Exception):
+    """
+    Raised when the server can't be upgraded.
+    """
+    def __init__(self, message):
+        self.message = message
+
+
+def upgrade_server(pymux):
+    """
+    Replace the running server by a new one, keeping all panes. This only
+    returns when something went wrong. (Raises `UpgradeError`.)
+    """
+    if pymux.socket is None or pymux._runs_standalone:
+        raise UpgradeError('Only a server that listens on a socket can be upgraded.')
+
+    if not hasattr(socket.socket, 'sendmsg'):
+        raise UpgradeError('Upgrading requires Python 3.3 or newer.')
+
+    arrangement, pane_list = encode_arrangement(pymux)
+
+    if any(p.process.is_terminated for p in pane_list):
+        raise UpgradeError('Kill the panes of terminated processes first.')
+
+    state = {
+        'version': _VERSION,
+        'socket_name': pymux.socket_name,
+        'arrangement': arrangement,
+        'panes': [_encode_pane(p) for p in pane_list],
+    }
+
+    # Shells in the pool are killed. The new server has to wait for them.
+    state['reap'] = [p.process.pid for p in pymux.shell_pool.panes]
+
+    fds = [_write_state(state), pymux.socket.fileno()] + \
+        [p.process.master for p in pane_list]
+
+    sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    try:
+        try:
+            _send_fds(sender, fds)
+        finally:
+            os.close(fds[0])
+            sender.close()
+
+        pymux.shell_pool.clear()
+
+        # Ask the clients to reconnect. They keep trying until the new server
+        # accepts connections on the same socket.
+        for c in list(pymux.connections):
+            c.request_reconnect()
+
+        # (Before Python 3.4, file descriptors are inheritable by default.)
+        if hasattr(receiver, 'set_inheritable'):
+            receiver.set_inheritable(True)
+
+        env = dict(os.environ)
+        env[_ENV_VARIABLE] = '%i' % receiver.fileno()
+        env[_ENV_PYTHONPATH] = os.environ.get('PYTHONPATH', '')
+        env['PYTHONPATH'] = os.pathsep.join(p for p in sys.path if p)
+
+        args = [sys.executable, '-m', 'pymux', 'start-server']
+        if pymux.source_file:
+            args.extend(['-f', pymux.source_file])
+
+        logger.info('Upgrading server: %r.', args)
+        os.execve(sys.executable, args, env)
+
+    except (OSError, socket.error) as e:
+        # Clients that were asked to reconnect will connect to us again.
+        logger.warning('Upgrading server failed: %s', e)
+        pymux.shell_pool.refill()
+        raise UpgradeError('Upgrading server failed: %s' % (e, ))
+
+    finally:
+        receiver.close()
+
+
+def is_upgrading():
+    " True when this server has been started by `upgrade_server`. "
+    return _ENV_VARIABLE in os.environ
+
+
+def complete_upgrade(pymux):
+    """
+    Called in the new server: receive the state and adopt the socket and the
+    running processes.
+    """
+    fd = int(os.environ.pop(_ENV_VARIABLE))
+
+    # Restore the original PYTHONPATH, before any pane is spawned.
+    python_path = os.environ.pop(_ENV_PYTHONPATH, '')
+    if python_path:
+        os.environ['PYTHONPATH'] = python_path
+    else:
+        os.environ.pop('PYTHONPATH', None)
+
+    receiver = socket.fromfd(fd, socket.AF_UNIX, socket.SOCK_DGRAM)
+    os.close(fd)
+
+    try:
+        fds = _receive_fds(receiver)
+    finally:
+        receiver.close()
+
+    with os.fdopen(fds[0], 'rb') as f:
+        state = json.loads(f.read().decode('utf-8'))
+
+    if state['version'] != _VERSION:
+        raise UpgradeError('Unsupported upgrade state version.')
+
+    # Listening socket.
+    sock = socket.fromfd(fds[1], socket.AF_UNIX, socket.SOCK_STREAM)
+    os.close(fds[1])
+    pymux.listen_on_socket(state['socket_name'], sock=sock)
+
+    # Panes.
+    panes = []
+    for data, master in zip(state['panes'], fds[2:]):
+        panes.append(_adopt_pane(pymux, data, master))
+
+    for data in state['arrangement']['windows']:
+        decode_window(pymux.arrangement, data, lambda i: panes[i])
+
+    # Wait for the shells of the old pool. (They are still our children.)
+    for pid in state['reap']:
+        pymux.eventloop.run_in_executor(lambda pid=pid: _waitpid(pid))
+
+    pymux.upgraded = True
+    logger.info('Server upgraded. Adopted %i panes.', len(panes))
+
+
+def _encode_pane(pane):
+    " Return the state of one pane as a dictionary. "
+    process = pane.process
+    screen = process.screen
+
+    return {
+        'pane_id': pane.pane_id,
+        'pid': process.pid,
+        'command': process.command,
+        'width': process.sx,
+        'height': process.sy,
+        'title': screen.title,
+        'modes': list(screen.mode),
+        'text': get_scrollback(screen, up_to_cursor=True),
+        'cursor_x': screen.pt_cursor_position.x,
+    }
+
+
+def _adopt_pane(pymux, data, master):
+    " Create a pane for a running process in the new server. "
+    pane = pymux.adopt_pane(master, data['pid'], data['width'], data['height'])
+    process = pane.process
+    process.command = data['command']
+
+    # Keep the pane ID. (The processes know it from $PYMUX.)
+    pane.pane_id = data['pane_id']
+    Pane._pane_counter = max(Pane._pane_counter, pane.pane_id)
+    pymux.panes_by_id[pane.pane_id] = pane
+
+    # Restore the screen. (The text only, without colors.) Then ask the
+    # application to redraw itself, which full screen applications do.
+    process.stream.feed(data['text'].replace('\n', '\r\n'))
+    process.stream.feed('\x1b[%iG' % (data['cursor_x'] + 1))
+    process.screen.mode = set(data['modes'])
+    process.screen.title = data['title']
+
+    try:
+        os.killpg(os.tcgetpgrp(master), signal.SIGWINCH)
+    except OSError:
+        pass
+
+    return pane
+
+
+def _write_state(state):
+    """
+    Write the state to an unlinked temporary file and return the file
+    descriptor. (The state can be much bigger than what fits in the socket
+    buffer.)
+    """
+    fd, path = tempfile.mkstemp(prefix='pymux.upgrade-')
+    os.unlink(path)
+
+    data = json.dumps(state).encode('utf-8')
+    while data:
+        data = data[os.write(fd, data):]
+
+    os.lseek(fd, 0, os.SEEK_SET)
+    return fd
+
+
+def _send_fds(sock, fds):
+    """
+    Send the file descriptors, in one or more messages. Nobody is receiving
+    yet, so this must not block.
+    """
+    chunks = [fds[i:i + _MAX_FDS_PER_MESSAGE]
+              for i in range(0, len(fds), _MAX_FDS_PER_MESSAGE)]
+
+    sock.setblocking(0)
+
+    for chunk in chunks:
+        header = json.dumps({'messages': len(chunks)}).encode('utf-8')
+        sock.sendmsg([header], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                                 array.array('i', chunk))])
+
+
+def _receive_fds(sock):
+    " Receive the file descriptors that were sent by `_send_fds`. "
+    fds = []
+    received = 0
+    messages = 1
+
+    sock.settimeout(5)
+    itemsize = array.array('i').itemsize
+
+    while received < messages:
+        data, ancdata, flags, address = sock.recvmsg(
+            1024, socket.CMSG_SPACE(_MAX_FDS_PER_MESSAGE * itemsize))
+
+        messages = json.loads(data.decode('utf-8'))['messages']
+        received += 1
+
+        for level, type, payload in ancdata:
+            if level == socket.SOL_SOCKET and type == socket.SCM_RIGHTS:
+                a = array.array('i')
+                a.frombytes(payload[:len(payload) - len(payload) % itemsize])
+                fds.extend(a)
+
+    return fds
+
+
+def _waitpid(pid):
+    try:
+        os.waitpid(pid, 0)
+    except OSError:
+        pass
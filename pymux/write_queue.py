@@ -0,0 +1,149 @@
+"""
+Non blocking output queue for file descriptors.
+"""
+from __future__ import unicode_literals
+from collections import deque
+from six.moves import range
+
+from .utils import nonblocking
+
+import errno
+import os
+import select
+
+__all__ = (
+    'WriteQueue',
+)
+
+# Size of the chunks in the queue. (Slicing after a partial write never copies
+# more than this.)
+_CHUNK_SIZE = 64 * 1024
+
+
+class WriteQueue(object):
+    """
+    Queue for writing to a file descriptor without blocking the event loop.
+
+    As much as possible is written right away. The remainder is written when
+    the file descriptor becomes writable again. The prompt_toolkit event loop
+    only knows about readers, so we wait for writability with `select` in an
+    executor, and continue writing in the main thread.
+
+    :param eventloop: Prompt_toolkit eventloop.
+    :param fd: The file descriptor. (The caller owns it, call `close` before
+        closing the file descriptor.)
+    :param max_size: Maximum amount of bytes in the queue.
+    :param on_drained: Called when the queue became empty.
+    :param on_error: Called with the `OSError` when writing failed. (E.g.
+        EIO or EPIPE.) The queue is cleared in that case.
+    """
+    def __init__(self, eventloop, fd, max_size, on_drained=None, on_error=None):
+        assert isinstance(fd, int)
+        assert isinstance(max_size, int)
+        assert on_drained is None or callable(on_drained)
+        assert on_error is None or callable(on_error)
+
+        self.eventloop = eventloop
+        self.fd = fd
+        self.max_size = max_size
+        self.on_drained = on_drained or (lambda: None)
+        self.on_error = on_error or (lambda e: None)
+
+        self.size = 0
+        self._queue = deque()
+        self._waiting_for_writable = False
+
+    def write(self, data):
+        """
+        Queue data.
+
+        :returns: False when the data was refused because it doesn't fit in
+            the queue anymore. (Nothing was queued in that case.)
+        """
+        if self.fd is None:
+            return True  # Closed. Drop data.
+
+        if self.size + len(data) > self.max_size:
+            return False
+
+        for i in range(0, len(data), _CHUNK_SIZE):
+            self._queue.append(data[i:i + _CHUNK_SIZE])
+        self.size += len(data)
+
+        # When we are already waiting for the fd to become writable, the data
+        # will be written after the data that's already queued.
+        if not self._waiting_for_writable:
+            self.flush()
+
+        return True
+
+    def flush(self):
+        """
+        Write as much as possible, without blocking.
+        """
+        queue = self._queue
+
+        if self.fd is None or not queue:
+            return
+
+        with nonblocking(self.fd):
+            while queue:
+                data = queue[0]
+
+                try:
+                    written = os.write(self.fd, data)
+                except OSError as e:
+                    if e.errno == errno.EINTR:
+                        # This happens when the window resizes and a SIGWINCH
+                        # was received.
+                        continue
+                    elif e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        written = 0
+                    else:
+                        self.clear()
+                        self.on_error(e)
+                        return
+
+                self.size -= written
+
+                if written < len(data):
+                    # Partial write. Wait until we can write the rest.
+                    queue[0] = data[written:]
+                    self._wait_for_writable()
+                    return
+                else:
+                    queue.popleft()
+
+        self.on_drained()
+
+    def _wait_for_writable(self):
+        self._waiting_for_writable = True
+        fd = self.fd
+
+        def wait():
+            " Wait in executor. "
+            while self.fd == fd:
+                try:
+                    if select.select([], [fd], [], 1)[1]:
+                        break
+                except (select.error, OSError, ValueError):
+                    break  # The fd was closed in the meantime.
+
+            self.eventloop.call_from_executor(writable)
+
+        def writable():
+            " Back in the main thread. "
+            self._waiting_for_writable = False
+            self.flush()
+
+        self.eventloop.run_in_executor(wait)
+
+    def clear(self):
+        " Drop everything that's still in the queue. "
+        self._queue.clear()
+        self.size = 0
+
+    def close(self):
+        " Drop the queue and stop writing. "
+        self.clear()
+        self.fd = None